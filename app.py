@@ -3,11 +3,12 @@ from flask_jwt_extended import JWTManager
 from config import Config
 from flask_cors import CORS
 from datetime import timedelta
+from utils.registro import configurar_logging
 import logging
 import os
 
 # Configurar logging
-logging.basicConfig(level=logging.INFO)
+configurar_logging()
 logger = logging.getLogger(__name__)
 
 # Crear la aplicación Flask
@@ -32,9 +33,9 @@ def create_app():
                 "http://192.168.1.60:*"
             ],
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "If-None-Match", "If-Modified-Since"],
             "supports_credentials": True,
-            "expose_headers": ["Content-Type", "Authorization"],
+            "expose_headers": ["Content-Type", "Authorization", "ETag", "Last-Modified"],
             "max_age": 3600
         }
     })
@@ -49,6 +50,31 @@ def create_app():
 
     jwt = JWTManager(app)
 
+    # Tokens con accesos desactualizados (versión anterior a la del usuario) se rechazan
+    from utils.acceso import init_jwt
+    init_jwt(jwt)
+
+    # Devolver al pool las conexiones que un endpoint no haya cerrado
+    from utils.db import init_app as init_db
+    init_db(app)
+
+    # Tiempos por request (Server-Timing) y agregados para /api/metrics.
+    # Antes que cache_http: su after_request corre último y ve el estado final
+    from utils.metricas import init_app as init_metricas
+    init_metricas(app)
+
+    # ETag, 304 y Cache-Control para las respuestas JSON de los GET
+    from utils.cache_http import init_app as init_cache_http, politica_cache, SIN_CACHE
+    init_cache_http(app)
+
+    # Almacén de imágenes: sin uno persistente y compartido no se arranca
+    from utils.imagenes import validar_almacen
+    validar_almacen()
+
+    # Plantillas Excel estáticas de carga masiva: se generan una vez por proceso
+    from utils.plantillas import precargar_plantillas
+    precargar_plantillas()
+
     # Registrar los blueprints
     from blueprints.usuarios import usuarios_bp
     from blueprints.auth import auth_bp
@@ -59,6 +85,7 @@ def create_app():
     from blueprints.mapeo import mapeo_bp
     from blueprints.variedades import variedades_bp
     from blueprints.conteo import conteo_bp
+    from blueprints.jobs import jobs_bp
 
     
     # Registrar blueprints
@@ -72,6 +99,7 @@ def create_app():
     app.register_blueprint(mapeo_bp, url_prefix="/api/mapeo")
     app.register_blueprint(variedades_bp, url_prefix="/api/variedades")
     app.register_blueprint(conteo_bp, url_prefix="/api/conteo")
+    app.register_blueprint(jobs_bp, url_prefix="/api/jobs")
 
     # Crear un nuevo blueprint para las rutas raíz
     root_bp = Blueprint('root_bp', __name__)
@@ -83,53 +111,37 @@ def create_app():
     from blueprints.opciones import obtener_sucursales
     root_bp.add_url_rule('/sucursales/', 'obtener_sucursales', obtener_sucursales, methods=['GET', 'OPTIONS'])
 
-    # Endpoints de atributos y especies para CORS
+    # Endpoints de atributos y especies para CORS (desde el cache de catálogos)
+    from utils.catalogos import catalogo_atributos, catalogo_especies, respuesta_catalogo, version_catalogo, buscar_por_id
+    from utils.cache_http import version_previa
+
     @root_bp.route('/atributos', methods=['GET'])
+    @version_previa(lambda: version_catalogo(catalogo_atributos()))
     def listar_atributos():
         """
         Listar todos los atributos base
         """
         try:
-            from utils.db import get_db_connection
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
+            catalogo = catalogo_atributos()
             
-            # Primero verificar si la tabla existe
-            cursor.execute("SHOW TABLES LIKE 'conteo_dim_atributocultivo'")
-            if not cursor.fetchone():
-                cursor.close()
-                conn.close()
-                return jsonify({
+            if catalogo.datos is None:
+                return respuesta_catalogo(catalogo, {
                     "success": True,
                     "message": "Tabla de atributos no existe aún",
                     "data": {
                         "atributos": [],
                         "total": 0
                     }
-                }), 200
-            
-            query = """
-                SELECT 
-                    id,
-                    nombre
-                FROM conteo_dim_atributocultivo
-                ORDER BY nombre
-            """
-            
-            cursor.execute(query)
-            atributos = cursor.fetchall()
+                })
             
-            cursor.close()
-            conn.close()
-            
-            return jsonify({
+            return respuesta_catalogo(catalogo, {
                 "success": True,
                 "message": "Atributos obtenidos exitosamente",
                 "data": {
-                    "atributos": atributos,
-                    "total": len(atributos)
+                    "atributos": catalogo.datos,
+                    "total": len(catalogo.datos)
                 }
-            }), 200
+            })
             
         except Exception as e:
             logger.error(f"Error obteniendo atributos: {str(e)}")
@@ -148,23 +160,8 @@ def create_app():
         Obtener un atributo específico
         """
         try:
-            from utils.db import get_db_connection
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            
-            query = """
-                SELECT 
-                    id,
-                    nombre
-                FROM conteo_dim_atributocultivo
-                WHERE id = %s
-            """
-            
-            cursor.execute(query, (atributo_id,))
-            atributo = cursor.fetchone()
-            
-            cursor.close()
-            conn.close()
+            catalogo = catalogo_atributos()
+            atributo = buscar_por_id(catalogo, atributo_id)
             
             if not atributo:
                 return jsonify({
@@ -172,11 +169,11 @@ def create_app():
                     "message": "Atributo no encontrado"
                 }), 404
             
-            return jsonify({
+            return respuesta_catalogo(catalogo, {
                 "success": True,
                 "message": "Atributo obtenido exitosamente",
                 "data": atributo
-            }), 200
+            }, variante=atributo_id)
             
         except Exception as e:
             logger.error(f"Error obteniendo atributo {atributo_id}: {str(e)}")
@@ -187,52 +184,32 @@ def create_app():
             }), 500
 
     @root_bp.route('/especies', methods=['GET'])
+    @version_previa(lambda: version_catalogo(catalogo_especies()))
     def listar_especies():
         """
         Listar todas las especies
         """
         try:
-            from utils.db import get_db_connection
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
+            catalogo = catalogo_especies()
             
-            # Primero verificar si la tabla existe
-            cursor.execute("SHOW TABLES LIKE 'general_dim_especie'")
-            if not cursor.fetchone():
-                cursor.close()
-                conn.close()
-                return jsonify({
+            if catalogo.datos is None:
+                return respuesta_catalogo(catalogo, {
                     "success": True,
                     "message": "Tabla de especies no existe aún",
                     "data": {
                         "especies": [],
                         "total": 0
                     }
-                }), 200
+                })
             
-            query = """
-                SELECT 
-                    id,
-                    nombre,
-                    caja_equivalente
-                FROM general_dim_especie
-                ORDER BY nombre
-            """
-            
-            cursor.execute(query)
-            especies = cursor.fetchall()
-            
-            cursor.close()
-            conn.close()
-            
-            return jsonify({
+            return respuesta_catalogo(catalogo, {
                 "success": True,
                 "message": "Especies obtenidas exitosamente",
                 "data": {
-                    "especies": especies,
-                    "total": len(especies)
+                    "especies": catalogo.datos,
+                    "total": len(catalogo.datos)
                 }
-            }), 200
+            })
             
         except Exception as e:
             logger.error(f"Error obteniendo especies: {str(e)}")
@@ -251,24 +228,8 @@ def create_app():
         Obtener una especie específica
         """
         try:
-            from utils.db import get_db_connection
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True)
-            
-            query = """
-                SELECT 
-                    id,
-                    nombre,
-                    caja_equivalente
-                FROM general_dim_especie
-                WHERE id = %s
-            """
-            
-            cursor.execute(query, (especie_id,))
-            especie = cursor.fetchone()
-            
-            cursor.close()
-            conn.close()
+            catalogo = catalogo_especies()
+            especie = buscar_por_id(catalogo, especie_id)
             
             if not especie:
                 return jsonify({
@@ -276,11 +237,11 @@ def create_app():
                     "message": "Especie no encontrada"
                 }), 404
             
-            return jsonify({
+            return respuesta_catalogo(catalogo, {
                 "success": True,
                 "message": "Especie obtenida exitosamente",
                 "data": especie
-            }), 200
+            }, variante=especie_id)
             
         except Exception as e:
             logger.error(f"Error obteniendo especie {especie_id}: {str(e)}")
@@ -292,11 +253,12 @@ def create_app():
 
     # Endpoint de prueba para verificar conexión a BD
     @root_bp.route('/test-db', methods=['GET'])
+    @politica_cache(SIN_CACHE)
     def test_database():
         try:
             logger.info("🔍 Iniciando prueba de conexión a BD...")
             from utils.db import get_db_connection
-            logger.info(f"📊 Configuración: DATABASE_URL={getattr(Config, 'DATABASE_URL', 'No definido')}")
+            logger.info(f"📊 Configuración: DATABASE_URL {'definida' if getattr(Config, 'DATABASE_URL', None) else 'no definida'}")
             
             conn = get_db_connection()
             logger.info("✅ Conexión establecida")
@@ -317,6 +279,7 @@ def create_app():
     
     # Endpoint de configuración para debug
     @root_bp.route('/config', methods=['GET'])
+    @politica_cache(SIN_CACHE)
     def show_config():
         try:
             config_info = {
@@ -331,6 +294,26 @@ def create_app():
         except Exception as e:
             return {"status": "error", "message": str(e)}, 500
     
+    # Métricas acumuladas del proceso en formato de texto de Prometheus
+    @root_bp.route('/metrics', methods=['GET'])
+    def metrics():
+        from utils.metricas import texto_prometheus
+        from utils.db import get_pool
+        from flask import request, Response
+        import hmac
+        
+        # El servicio es público (--allow-unauthenticated): sin token configurado no se expone
+        if not Config.METRICAS_TOKEN:
+            return {"error": "No encontrado"}, 404
+        if not hmac.compare_digest(
+            request.headers.get('Authorization', ''), f"Bearer {Config.METRICAS_TOKEN}"
+        ):
+            return {"error": "No autorizado"}, 401
+        
+        respuesta = Response(texto_prometheus(get_pool()), mimetype='text/plain; version=0.0.4')
+        respuesta.headers['Cache-Control'] = SIN_CACHE
+        return respuesta
+    
     # Registrar el blueprint raíz
     app.register_blueprint(root_bp, url_prefix="/api")
 
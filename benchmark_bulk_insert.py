@@ -0,0 +1,86 @@
+"""
+Benchmark de inserción masiva de plantas: fila a fila vs insertar_en_lotes().
+
+Trabaja sobre una tabla TEMPORARY creada con LIKE general_dim_planta, así que
+no toca datos reales. Usa la misma configuración de BD que la API (.env).
+
+Uso:
+    python benchmark_bulk_insert.py
+    python benchmark_bulk_insert.py --tamanos 10000 100000 1000000 --lote 1000
+    python benchmark_bulk_insert.py --max-fila-a-fila 20000
+"""
+import argparse
+import time
+
+from utils.db import get_db_connection
+from utils.bulk import insertar_en_lotes
+
+TABLA = 'bench_planta'
+
+
+def filas_plantas(n, plantas_por_hilera=300):
+    # Simula hileras de `plantas_por_hilera` plantas (id_hilera ficticio)
+    for i in range(n):
+        yield (i // plantas_por_hilera + 1, i % plantas_por_hilera + 1)
+
+
+def fila_a_fila(cursor, n):
+    for id_hilera, planta in filas_plantas(n):
+        cursor.execute(
+            f"INSERT INTO {TABLA} (id_hilera, planta, fecha_creacion) VALUES (%s, %s, NOW())",
+            (id_hilera, planta)
+        )
+
+
+def en_lotes(cursor, n, lote):
+    return insertar_en_lotes(
+        cursor, TABLA, ['id_hilera', 'planta'], filas_plantas(n),
+        expresiones={'fecha_creacion': 'NOW()'}, tamano_lote=lote
+    )
+
+
+def medir(conn, cursor, funcion, *args):
+    cursor.execute(f"TRUNCATE TABLE {TABLA}")
+    inicio = time.perf_counter()
+    funcion(cursor, *args)
+    conn.commit()
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanos', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--lote', type=int, default=1000, help='filas por INSERT multi-VALUES')
+    parser.add_argument('--max-fila-a-fila', type=int, default=100000,
+                        help='sobre este tamaño el tiempo fila a fila se extrapola')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"CREATE TEMPORARY TABLE {TABLA} LIKE general_dim_planta")
+
+    print(f"🔍 Benchmark INSERT plantas (lote={args.lote})")
+    print(f"{'filas':>10} | {'fila a fila (s)':>16} | {'en lotes (s)':>12} | {'speedup':>8}")
+    print("-" * 56)
+
+    try:
+        for n in args.tamanos:
+            if n <= args.max_fila_a_fila:
+                t_fila = medir(conn, cursor, fila_a_fila, n)
+                etiqueta = f"{t_fila:16.2f}"
+            else:
+                # Extrapolación lineal desde una muestra de max_fila_a_fila filas
+                t_muestra = medir(conn, cursor, fila_a_fila, args.max_fila_a_fila)
+                t_fila = t_muestra * n / args.max_fila_a_fila
+                etiqueta = f"~{t_fila:15.2f}"
+
+            t_lotes = medir(conn, cursor, en_lotes, n, args.lote)
+            print(f"{n:>10} | {etiqueta} | {t_lotes:12.2f} | {t_fila / t_lotes:7.1f}x")
+    finally:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {TABLA}")
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 from flask import Blueprint, request, jsonify
-import bcrypt
 from config import Config
 from utils.db import get_db_connection
+from utils.acceso import tiene_acceso_sucursal, claims_acceso
+from utils.claves import ColaClavesLlenaError, verificar_clave, hashear_clave, invalidar_cache_clave
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, create_refresh_token
 from datetime import date
 import logging
@@ -18,8 +19,8 @@ def login():
     try:
         data = request.get_json()
         
-        # Log para debug
-        logger.info(f"Login attempt - Data received: {data}")
+        # Solo los nombres de los campos: el body trae la clave
+        logger.debug("Login attempt - campos recibidos: %s", list(data.keys()) if isinstance(data, dict) else None)
         
         # Verificar si data es None
         if not data:
@@ -56,7 +57,7 @@ def login():
         cursor.execute(sql, (usuario,))
         user = cursor.fetchone()
 
-        logger.info(f"User lookup result: {'Found' if user else 'Not found'} for usuario: {usuario}")
+        logger.debug("User lookup result: %s for usuario: %s", 'Found' if user else 'Not found', usuario)
 
         if not user:
             cursor.close()
@@ -64,15 +65,20 @@ def login():
             logger.error(f"User not found or no app access: {usuario}")
             return jsonify({"error": "Usuario no encontrado o sin acceso a la aplicación"}), 401
 
-        # Verificar contraseña
+        # Verificar contraseña (bcrypt en el pool de utils/claves.py, no en este hilo)
         try:
-            password_valid = bcrypt.checkpw(clave.encode('utf-8'), user['clave'].encode('utf-8'))
-            logger.info(f"Password validation: {'Valid' if password_valid else 'Invalid'} for usuario: {usuario}")
+            password_valid = verificar_clave(user['id'], clave, user['clave'], rehash=True)
+            logger.debug("Password validation: %s for usuario: %s", 'Valid' if password_valid else 'Invalid', usuario)
             
             if not password_valid:
                 cursor.close()
                 conn.close()
                 return jsonify({"error": "Contraseña incorrecta"}), 401
+        except ColaClavesLlenaError:
+            logger.warning("Login rechazado: cola de verificación de claves llena")
+            cursor.close()
+            conn.close()
+            return jsonify({"error": "Servidor ocupado, reintente en unos segundos"}), 503, {'Retry-After': '2'}
         except Exception as e:
             logger.error(f"Error checking password: {str(e)}")
             cursor.close()
@@ -84,9 +90,10 @@ def login():
             identity=user['id'],
             additional_claims={
                 'rol': user['id_rol'],
-                'perfil': user['id_perfil'],
                 'sucursal': user['id_sucursalactiva'],
-                'sucursal_nombre': user['sucursal_nombre']
+                'sucursal_nombre': user['sucursal_nombre'],
+                # perfil, sucursales, apps, permisos y versión (utils/acceso.py)
+                **claims_acceso(cursor, user['id'], user['id_perfil'])
             }
         )
 
@@ -142,9 +149,10 @@ def refresh():
             identity=user['id'],
             additional_claims={
                 'rol': user['id_rol'],
-                'perfil': user['id_perfil'],
                 'sucursal': user['id_sucursalactiva'],
-                'sucursal_nombre': user['sucursal_nombre']
+                'sucursal_nombre': user['sucursal_nombre'],
+                # perfil, sucursales, apps, permisos y versión (utils/acceso.py)
+                **claims_acceso(cursor, user['id'], user['id_perfil'])
             }
         )
 
@@ -184,25 +192,27 @@ def cambiar_clave():
         cursor.execute("SELECT clave FROM general_dim_usuario WHERE id = %s", (usuario_id,))
         user = cursor.fetchone()
 
-        if not user or not bcrypt.checkpw(clave_actual.encode('utf-8'), user['clave'].encode('utf-8')):
+        if not user or not verificar_clave(usuario_id, clave_actual, user['clave']):
             cursor.close()
             conn.close()
             return jsonify({"error": "Clave actual incorrecta"}), 401
 
-        # Generar nuevo hash con bcrypt
-        salt = bcrypt.gensalt()
-        nueva_clave_hash = bcrypt.hashpw(nueva_clave.encode('utf-8'), salt)
+        # Generar nuevo hash con bcrypt (costo CLAVES_COSTO_BCRYPT)
+        nueva_clave_hash = hashear_clave(nueva_clave)
 
         # Actualizar clave
         cursor.execute("UPDATE general_dim_usuario SET clave = %s WHERE id = %s", 
-                      (nueva_clave_hash.decode('utf-8'), usuario_id))
+                      (nueva_clave_hash, usuario_id))
         conn.commit()
+        invalidar_cache_clave(usuario_id)
 
         cursor.close()
         conn.close()
 
         return jsonify({"message": "Clave actualizada correctamente"}), 200
 
+    except ColaClavesLlenaError:
+        return jsonify({"error": "Servidor ocupado, reintente en unos segundos"}), 503, {'Retry-After': '2'}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -222,13 +232,7 @@ def cambiar_sucursal():
         cursor = conn.cursor(dictionary=True)
 
         # Verificar que el usuario tenga acceso a la sucursal
-        cursor.execute("""
-            SELECT 1 
-            FROM usuario_pivot_sucursal_usuario 
-            WHERE id_usuario = %s AND id_sucursal = %s
-        """, (usuario_id, nueva_sucursal_id))
-        
-        if not cursor.fetchone():
+        if not tiene_acceso_sucursal(usuario_id, nueva_sucursal_id, cursor):
             cursor.close()
             conn.close()
             return jsonify({"error": "No tienes acceso a esta sucursal"}), 403
@@ -2,6 +2,10 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import logging
 from utils.db import get_db_connection
+from utils.catalogos import (
+    obtener_catalogo, invalidar_catalogos, respuesta_catalogo,
+    catalogo_atributos, catalogo_especies, buscar_por_id
+)
 from datetime import datetime
 
 conteo_bp = Blueprint('conteo_bp', __name__)
@@ -13,6 +17,23 @@ logger = logging.getLogger(__name__)
 # ENDPOINTS PARA ATRIBUTO ÓPTIMO
 # ============================================================================
 
+def _cargar_atributos_optimos(cursor):
+    cursor.execute("""
+        SELECT 
+            ao.id,
+            ao.id_atributo,
+            ao.edad_min,
+            ao.edad_max,
+            ao.optimo_ha,
+            ao.min_ha,
+            ao.max_ha,
+            a.nombre as nombre_atributo
+        FROM conteo_dim_atributooptimo ao
+        LEFT JOIN conteo_dim_atributocultivo a ON ao.id_atributo = a.id
+        ORDER BY ao.id_atributo, ao.edad_min
+    """)
+    return cursor.fetchall()
+
 @conteo_bp.route('/atributo-optimo', methods=['GET'])
 @jwt_required()
 def listar_atributos_optimos():
@@ -20,38 +41,17 @@ def listar_atributos_optimos():
     Listar todos los atributos óptimos
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        catalogo = obtener_catalogo('atributos_optimos', _cargar_atributos_optimos)
+        atributos = catalogo.datos
         
-        query = """
-            SELECT 
-                ao.id,
-                ao.id_atributo,
-                ao.edad_min,
-                ao.edad_max,
-                ao.optimo_ha,
-                ao.min_ha,
-                ao.max_ha,
-                a.nombre as nombre_atributo
-            FROM conteo_dim_atributooptimo ao
-            LEFT JOIN conteo_dim_atributocultivo a ON ao.id_atributo = a.id
-            ORDER BY ao.id_atributo, ao.edad_min
-        """
-        
-        cursor.execute(query)
-        atributos = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+        return respuesta_catalogo(catalogo, {
             "success": True,
             "message": "Atributos óptimos obtenidos exitosamente",
             "data": {
                 "atributos": atributos,
                 "total": len(atributos)
             }
-        }), 200
+        })
         
     except Exception as e:
         logger.error(f"Error obteniendo atributos óptimos: {str(e)}")
@@ -182,6 +182,7 @@ def crear_atributo_optimo():
         atributo_creado = cursor.fetchone()
         
         conn.commit()
+        invalidar_catalogos('atributos_optimos')
         cursor.close()
         conn.close()
         
@@ -269,6 +270,7 @@ def actualizar_atributo_optimo(atributo_id):
         atributo_actualizado = cursor.fetchone()
         
         conn.commit()
+        invalidar_catalogos('atributos_optimos')
         cursor.close()
         conn.close()
         
@@ -312,6 +314,7 @@ def eliminar_atributo_optimo(atributo_id):
         cursor.execute(delete_query, (atributo_id,))
         
         conn.commit()
+        invalidar_catalogos('atributos_optimos')
         cursor.close()
         conn.close()
         
@@ -333,6 +336,21 @@ def eliminar_atributo_optimo(atributo_id):
 # ENDPOINTS PARA ATRIBUTO ESPECIE
 # ============================================================================
 
+def _cargar_atributos_especie(cursor):
+    cursor.execute("""
+        SELECT 
+            ae.id,
+            ae.id_atributo,
+            ae.id_especie,
+            a.nombre as nombre_atributo,
+            e.nombre as nombre_especie
+        FROM conteo_pivot_atributo_especie ae
+        LEFT JOIN conteo_dim_atributocultivo a ON ae.id_atributo = a.id
+        LEFT JOIN general_dim_especie e ON ae.id_especie = e.id
+        ORDER BY ae.id_atributo, ae.id_especie
+    """)
+    return cursor.fetchall()
+
 @conteo_bp.route('/atributo-especie', methods=['GET'])
 @jwt_required()
 def listar_atributos_especie():
@@ -340,36 +358,17 @@ def listar_atributos_especie():
     Listar todas las relaciones atributo-especie
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        catalogo = obtener_catalogo('atributos_especie', _cargar_atributos_especie)
+        atributos_especie = catalogo.datos
         
-        query = """
-            SELECT 
-                ae.id,
-                ae.id_atributo,
-                ae.id_especie,
-                a.nombre as nombre_atributo,
-                e.nombre as nombre_especie
-            FROM conteo_pivot_atributo_especie ae
-            LEFT JOIN conteo_dim_atributocultivo a ON ae.id_atributo = a.id
-            LEFT JOIN general_dim_especie e ON ae.id_especie = e.id
-            ORDER BY ae.id_atributo, ae.id_especie
-        """
-        
-        cursor.execute(query)
-        atributos_especie = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+        return respuesta_catalogo(catalogo, {
             "success": True,
             "message": "Relaciones atributo-especie obtenidas exitosamente",
             "data": {
                 "atributos_especie": atributos_especie,
                 "total": len(atributos_especie)
             }
-        }), 200
+        })
         
     except Exception as e:
         logger.error(f"Error obteniendo atributos especie: {str(e)}")
@@ -501,6 +500,7 @@ def crear_atributo_especie():
         relacion_creada = cursor.fetchone()
         
         conn.commit()
+        invalidar_catalogos('atributos_especie')
         cursor.close()
         conn.close()
         
@@ -586,6 +586,7 @@ def actualizar_atributo_especie(relacion_id):
         relacion_actualizada = cursor.fetchone()
         
         conn.commit()
+        invalidar_catalogos('atributos_especie')
         cursor.close()
         conn.close()
         
@@ -629,6 +630,7 @@ def eliminar_atributo_especie(relacion_id):
         cursor.execute(delete_query, (relacion_id,))
         
         conn.commit()
+        invalidar_catalogos('atributos_especie')
         cursor.close()
         conn.close()
         
@@ -657,31 +659,17 @@ def listar_atributos():
     Listar todos los atributos base
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        catalogo = catalogo_atributos()
+        atributos = catalogo.datos or []
         
-        query = """
-            SELECT 
-                id,
-                nombre
-            FROM conteo_dim_atributocultivo
-            ORDER BY nombre
-        """
-        
-        cursor.execute(query)
-        atributos = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+        return respuesta_catalogo(catalogo, {
             "success": True,
             "message": "Atributos obtenidos exitosamente",
             "data": {
                 "atributos": atributos,
                 "total": len(atributos)
             }
-        }), 200
+        })
         
     except Exception as e:
         logger.error(f"Error obteniendo atributos: {str(e)}")
@@ -708,22 +696,8 @@ def obtener_atributo(atributo_id):
     Obtener un atributo específico
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        query = """
-            SELECT 
-                id,
-                nombre
-            FROM conteo_dim_atributocultivo
-            WHERE id = %s
-        """
-        
-        cursor.execute(query, (atributo_id,))
-        atributo = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        catalogo = catalogo_atributos()
+        atributo = buscar_por_id(catalogo, atributo_id)
         
         if not atributo:
             return jsonify({
@@ -731,11 +705,11 @@ def obtener_atributo(atributo_id):
                 "message": "Atributo no encontrado"
             }), 404
         
-        return jsonify({
+        return respuesta_catalogo(catalogo, {
             "success": True,
             "message": "Atributo obtenido exitosamente",
             "data": atributo
-        }), 200
+        }, variante=atributo_id)
         
     except Exception as e:
         logger.error(f"Error obteniendo atributo {atributo_id}: {str(e)}")
@@ -752,32 +726,17 @@ def listar_especies():
     Listar todas las especies
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
+        catalogo = catalogo_especies()
+        especies = catalogo.datos or []
         
-        query = """
-            SELECT 
-                id,
-                nombre,
-                caja_equivalente
-            FROM general_dim_especie
-            ORDER BY nombre
-        """
-        
-        cursor.execute(query)
-        especies = cursor.fetchall()
-        
-        cursor.close()
-        conn.close()
-        
-        return jsonify({
+        return respuesta_catalogo(catalogo, {
             "success": True,
             "message": "Especies obtenidas exitosamente",
             "data": {
                 "especies": especies,
                 "total": len(especies)
             }
-        }), 200
+        })
         
     except Exception as e:
         logger.error(f"Error obteniendo especies: {str(e)}")
@@ -794,23 +753,8 @@ def obtener_especie(especie_id):
     Obtener una especie específica
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        query = """
-            SELECT 
-                id,
-                nombre,
-                caja_equivalente
-            FROM general_dim_especie
-            WHERE id = %s
-        """
-        
-        cursor.execute(query, (especie_id,))
-        especie = cursor.fetchone()
-        
-        cursor.close()
-        conn.close()
+        catalogo = catalogo_especies()
+        especie = buscar_por_id(catalogo, especie_id)
         
         if not especie:
             return jsonify({
@@ -818,11 +762,11 @@ def obtener_especie(especie_id):
                 "message": "Especie no encontrada"
             }), 404
         
-        return jsonify({
+        return respuesta_catalogo(catalogo, {
             "success": True,
             "message": "Especie obtenida exitosamente",
             "data": especie
-        }), 200
+        }, variante=especie_id)
         
     except Exception as e:
         logger.error(f"Error obteniendo especie {especie_id}: {str(e)}")
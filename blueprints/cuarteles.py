@@ -1,7 +1,16 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import logging
 from utils.db import get_db_connection
+from utils.acceso import sucursales_permitidas, filtro_sucursales
+from utils.bulk import insertar_en_lotes
+from utils.jobs import encolar_job, pide_async
+from utils.conteo_plantas import asegurar_tabla_conteo, sumar_plantas, reconciliar, SQL_PLANTAS_ACTIVAS
+from utils.conteo_hileras import bloquear_cuartel, sumar_hileras
+from utils.diagnostico import diagnostico_activo, registrar_diagnostico, resumen_filas
+from utils.registro import Resumen, muestreo
+from utils.plantillas import excel_streaming, ENCABEZADOS_PLANTAS, ANCHOS_PLANTAS, MIMETYPE_XLSX
+from utils.servidor import clase_ruta, RUTA_LARGA
 from datetime import datetime
 
 cuarteles_bp = Blueprint('cuarteles_bp', __name__)
@@ -9,6 +18,47 @@ cuarteles_bp = Blueprint('cuarteles_bp', __name__)
 # Configurar logging
 logger = logging.getLogger(__name__)
 
+def diagnostico_cuarteles(cursor, user_id, filtro_suc, params_suc, cuarteles):
+    """Cuarteles del usuario en cualquier estado y primeros cuarteles de la BD, para comparar"""
+    cursor.execute(f"""
+        SELECT 
+            c.id,
+            c.nombre,
+            c.id_ceco,
+            c.id_estado,
+            s.nombre as sucursal_nombre
+        FROM general_dim_cuartel c
+        LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
+        LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
+        WHERE {filtro_suc}
+        ORDER BY ce.id_sucursal, c.nombre
+    """, params_suc)
+    por_sucursal = cursor.fetchall()
+    
+    cursor.execute("""
+        SELECT 
+            c.id,
+            c.nombre,
+            c.id_ceco,
+            c.id_estado,
+            s.nombre as sucursal_nombre
+        FROM general_dim_cuartel c
+        LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
+        LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
+        ORDER BY c.id_ceco, c.nombre
+        LIMIT 10
+    """)
+    primeros = cursor.fetchall()
+    
+    registrar_diagnostico(
+        'listar_cuarteles',
+        usuario_id=user_id,
+        sucursales=params_suc,
+        cuarteles_activos=len(cuarteles),
+        cuarteles_por_sucursal=resumen_filas(por_sucursal),
+        primeros_cuarteles_bd=resumen_filas(primeros)
+    )
+
 @cuarteles_bp.route('/cuarteles', methods=['GET'])
 @jwt_required()
 def listar_cuarteles():
@@ -24,7 +74,8 @@ def listar_cuarteles():
         cursor = conn.cursor(dictionary=True)
         
         # Obtener cuarteles del usuario según sus sucursales asignadas
-        query = """
+        filtro_suc, params_suc = filtro_sucursales('ce.id_sucursal', sucursales_permitidas(user_id, cursor))
+        query = f"""
             SELECT 
                 c.id,
                 c.id_ceco,
@@ -48,60 +99,17 @@ def listar_cuarteles():
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             LEFT JOIN general_dim_variedad v ON c.id_variedad = v.id
-            WHERE ce.id_sucursal IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            WHERE {filtro_suc}
             AND c.id_estado = 1
             ORDER BY c.nombre
         """
         
-        cursor.execute(query, (user_id,))
+        cursor.execute(query, params_suc)
         cuarteles = cursor.fetchall()
         
-        # Log para debug
-        logger.info(f"Usuario ID: {user_id}")
-        logger.info(f"Cuarteles encontrados: {len(cuarteles)}")
-        
-        # Consulta adicional para debug - verificar cuarteles por sucursal
-        debug_query = """
-            SELECT 
-                c.id,
-                c.nombre,
-                c.id_ceco,
-                c.id_estado,
-                s.nombre as sucursal_nombre
-            FROM general_dim_cuartel c
-            LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
-            LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
-            WHERE ce.id_sucursal IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
-            ORDER BY ce.id_sucursal, c.nombre
-        """
-        cursor.execute(debug_query, (user_id,))
-        debug_info = cursor.fetchall()
-        logger.info(f"Debug - Cuarteles por sucursal: {debug_info}")
-        
-        # Consulta para verificar todos los cuarteles
-        all_cuarteles_query = """
-            SELECT 
-                c.id,
-                c.nombre,
-                c.id_ceco,
-                c.id_estado,
-                s.nombre as sucursal_nombre
-            FROM general_dim_cuartel c
-            LEFT JOIN general_dim_sucursal s ON c.id_ceco = s.id
-            ORDER BY c.id_ceco, c.nombre
-            LIMIT 10
-        """
-        cursor.execute(all_cuarteles_query)
-        all_cuarteles = cursor.fetchall()
-        logger.info(f"Debug - Primeros 10 cuarteles en BD: {all_cuarteles}")
+        # Verificación extra solo con diagnóstico activo (DIAGNOSTICO_ACTIVO, muestreado)
+        if diagnostico_activo():
+            diagnostico_cuarteles(cursor, user_id, filtro_suc, params_suc, cuarteles)
         
         cursor.close()
         conn.close()
@@ -137,7 +145,8 @@ def obtener_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al cuartel
-        query = """
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        query = f"""
             SELECT 
                 c.id,
                 c.id_ceco,
@@ -160,13 +169,12 @@ def obtener_cuartel(cuartel_id):
             FROM general_dim_cuartel c
             LEFT JOIN general_dim_sucursal s ON c.id_ceco = s.id
             LEFT JOIN general_dim_variedad v ON c.id_variedad = v.id
-            INNER JOIN usuario_pivot_sucursal_usuario upsu ON s.id = upsu.id_sucursal
             WHERE c.id = %s 
-            AND upsu.id_usuario = %s 
+            AND {filtro_suc}
             AND c.id_estado = 1
         """
         
-        cursor.execute(query, (cuartel_id, user_id))
+        cursor.execute(query, (cuartel_id, *params_suc))
         cuartel = cursor.fetchone()
         
         if not cuartel:
@@ -220,16 +228,16 @@ def editar_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al cuartel
-        query_verificar = """
+        filtro_suc, params_suc = filtro_sucursales('c.id_ceco', sucursales_permitidas(user_id, cursor))
+        query_verificar = f"""
             SELECT c.id 
             FROM general_dim_cuartel c
-            INNER JOIN usuario_pivot_sucursal_usuario upsu ON c.id_ceco = upsu.id_sucursal
             WHERE c.id = %s 
-            AND upsu.id_usuario = %s 
+            AND {filtro_suc}
             AND c.id_estado = 1
         """
         
-        cursor.execute(query_verificar, (cuartel_id, user_id))
+        cursor.execute(query_verificar, (cuartel_id, *params_suc))
         cuartel_existe = cursor.fetchone()
         
         if not cuartel_existe:
@@ -337,16 +345,16 @@ def eliminar_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al cuartel
-        query_verificar = """
+        filtro_suc, params_suc = filtro_sucursales('c.id_ceco', sucursales_permitidas(user_id, cursor))
+        query_verificar = f"""
             SELECT c.id, c.nombre
             FROM general_dim_cuartel c
-            INNER JOIN usuario_pivot_sucursal_usuario upsu ON c.id_ceco = upsu.id_sucursal
             WHERE c.id = %s 
-            AND upsu.id_usuario = %s 
+            AND {filtro_suc}
             AND c.id_estado = 1
         """
         
-        cursor.execute(query_verificar, (cuartel_id, user_id))
+        cursor.execute(query_verificar, (cuartel_id, *params_suc))
         cuartel = cursor.fetchone()
         
         if not cuartel:
@@ -416,7 +424,8 @@ def obtener_hileras_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso al cuartel y obtener hileras
-        query = """
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        query = f"""
             SELECT 
                 h.id,
                 h.hilera,
@@ -426,15 +435,11 @@ def obtener_hileras_cuartel(cuartel_id):
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             WHERE c.id = %s 
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             ORDER BY h.hilera
         """
         
-        cursor.execute(query, (cuartel_id, user_id))
+        cursor.execute(query, (cuartel_id, *params_suc))
         hileras = cursor.fetchall()
         
         cursor.close()
@@ -479,7 +484,8 @@ def agregar_hilera_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso al cuartel usando EXACTAMENTE la misma lógica que GET
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        cursor.execute(f"""
             SELECT 
                 h.id,
                 h.hilera,
@@ -489,31 +495,23 @@ def agregar_hilera_cuartel(cuartel_id):
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             WHERE c.id = %s 
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             ORDER BY h.hilera
             LIMIT 1
-        """, (cuartel_id, user_id))
+        """, (cuartel_id, *params_suc))
         
         # Si no hay hileras, verificar acceso al cuartel directamente
         if not cursor.fetchone():
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT c.id
                 FROM general_dim_cuartel c
                 LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
                 LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
                 WHERE c.id = %s 
-                AND s.id IN (
-                    SELECT id_sucursal 
-                    FROM usuario_pivot_sucursal_usuario 
-                    WHERE id_usuario = %s
-                )
+                AND {filtro_suc}
                 AND c.id_estado = 1
                 LIMIT 1
-            """, (cuartel_id, user_id))
+            """, (cuartel_id, *params_suc))
             
             if not cursor.fetchone():
                 cursor.close()
@@ -523,14 +521,8 @@ def agregar_hilera_cuartel(cuartel_id):
                     "message": "Cuartel no encontrado o sin acceso"
                 }), 404
         
-        # Obtener número actual de hileras
-        cursor.execute("""
-            SELECT COUNT(*) as total
-            FROM general_dim_hilera 
-            WHERE id_cuartel = %s AND id_estado = 1
-        """, (cuartel_id,))
-        
-        hileras_actuales = cursor.fetchone()['total']
+        # Bloquear el cuartel antes de crear la hilera (utils/conteo_hileras.py)
+        hileras_previas = bloquear_cuartel(cursor, cuartel_id)
         
         # Crear la nueva hilera
         cursor.execute("""
@@ -560,12 +552,7 @@ def agregar_hilera_cuartel(cuartel_id):
             }), 500
         
         # Actualizar el número de hileras en el cuartel
-        nuevo_total = hileras_actuales + 1
-        cursor.execute("""
-            UPDATE general_dim_cuartel 
-            SET n_hileras = %s 
-            WHERE id = %s
-        """, (nuevo_total, cuartel_id))
+        nuevo_total = sumar_hileras(cursor, cuartel_id, 1, hileras_previas)
         
         conn.commit()
         cursor.close()
@@ -611,20 +598,17 @@ def eliminar_hilera_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso a la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        cursor.execute(f"""
             SELECT h.* FROM general_dim_hilera h
             INNER JOIN general_dim_cuartel c ON h.id_cuartel = c.id
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             WHERE h.id = %s 
             AND c.id = %s
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             AND h.id_estado = 1
-        """, (hilera_id, cuartel_id, user_id))
+        """, (hilera_id, cuartel_id, *params_suc))
         
         hilera_info = cursor.fetchone()
         if not hilera_info:
@@ -650,19 +634,19 @@ def eliminar_hilera_cuartel(cuartel_id):
                 "message": f"No se puede eliminar la hilera porque tiene {plantas_count} plantas asociadas"
             }), 400
         
+        # Bloquear el cuartel antes de tocar la hilera (utils/conteo_hileras.py)
+        bloquear_cuartel(cursor, cuartel_id)
+        
         # Desactivar la hilera (soft delete)
         cursor.execute("""
             UPDATE general_dim_hilera 
             SET id_estado = 0
-            WHERE id = %s
+            WHERE id = %s AND id_estado = 1
         """, (hilera_id,))
         
-        # Actualizar el número de hileras en el cuartel
-        cursor.execute("""
-            UPDATE general_dim_cuartel 
-            SET n_hileras = n_hileras - 1
-            WHERE id = %s
-        """, (cuartel_id,))
+        # Actualizar el número de hileras en el cuartel (si otra petición ya
+        # la desactivó, rowcount es 0 y no se descuenta dos veces)
+        sumar_hileras(cursor, cuartel_id, -cursor.rowcount)
         
         conn.commit()
         cursor.close()
@@ -699,7 +683,8 @@ def obtener_plantas_cuartel(cuartel_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso al cuartel y obtener plantas
-        query = """
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        query = f"""
             SELECT 
                 p.id,
                 p.planta,
@@ -712,15 +697,11 @@ def obtener_plantas_cuartel(cuartel_id):
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             WHERE c.id = %s 
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             ORDER BY h.hilera, p.planta
         """
         
-        cursor.execute(query, (cuartel_id, user_id))
+        cursor.execute(query, (cuartel_id, *params_suc))
         plantas = cursor.fetchall()
         
         cursor.close()
@@ -761,20 +742,17 @@ def eliminar_hilera_especifica(cuartel_id, hilera_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso a la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        cursor.execute(f"""
             SELECT h.* FROM general_dim_hilera h
             INNER JOIN general_dim_cuartel c ON h.id_cuartel = c.id
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             WHERE h.id = %s 
             AND c.id = %s
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             AND h.id_estado = 1
-        """, (hilera_id, cuartel_id, user_id))
+        """, (hilera_id, cuartel_id, *params_suc))
         
         hilera_info = cursor.fetchone()
         if not hilera_info:
@@ -800,19 +778,19 @@ def eliminar_hilera_especifica(cuartel_id, hilera_id):
                 "message": f"No se puede eliminar la hilera porque tiene {plantas_count} plantas asociadas"
             }), 400
         
+        # Bloquear el cuartel antes de tocar la hilera (utils/conteo_hileras.py)
+        bloquear_cuartel(cursor, cuartel_id)
+        
         # Desactivar la hilera (soft delete)
         cursor.execute("""
             UPDATE general_dim_hilera 
             SET id_estado = 0
-            WHERE id = %s
+            WHERE id = %s AND id_estado = 1
         """, (hilera_id,))
         
-        # Actualizar el número de hileras en el cuartel
-        cursor.execute("""
-            UPDATE general_dim_cuartel 
-            SET n_hileras = n_hileras - 1
-            WHERE id = %s
-        """, (cuartel_id,))
+        # Actualizar el número de hileras en el cuartel (si otra petición ya
+        # la desactivó, rowcount es 0 y no se descuenta dos veces)
+        sumar_hileras(cursor, cuartel_id, -cursor.rowcount)
         
         conn.commit()
         cursor.close()
@@ -849,7 +827,8 @@ def obtener_plantas_hilera(cuartel_id, hilera_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso a la hilera y obtener plantas
-        query = """
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        query = f"""
             SELECT 
                 p.id,
                 p.planta,
@@ -863,15 +842,11 @@ def obtener_plantas_hilera(cuartel_id, hilera_id):
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
             WHERE c.id = %s 
             AND h.id = %s
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             ORDER BY p.planta
         """
         
-        cursor.execute(query, (cuartel_id, hilera_id, user_id))
+        cursor.execute(query, (cuartel_id, hilera_id, *params_suc))
         plantas = cursor.fetchall()
         
         cursor.close()
@@ -895,7 +870,105 @@ def obtener_plantas_hilera(cuartel_id, hilera_id):
             "message": "Error interno del servidor"
         }), 500
 
+def ejecutar_catastro_masivo(conn, cursor, user_id, cuarteles_data, progreso=None):
+    """
+    Crea las hileras de cada cuartel del lote y retorna el resumen.
+    Se usa en el request o como job (progreso informa el avance).
+    """
+    cuarteles_procesados = 0
+    hileras_creadas = 0
+    errores = []
+    
+    # Sucursales del usuario: una sola consulta para todo el lote
+    filtro_suc, params_suc = filtro_sucursales('ce.id_sucursal', sucursales_permitidas(user_id, cursor))
+    
+    for n, cuartel_data in enumerate(cuarteles_data, start=1):
+        if progreso:
+            progreso.avanzar(n - 1, {"cuarteles_procesados": cuarteles_procesados, "hileras_creadas": hileras_creadas})
+        
+        try:
+            cuartel_id = cuartel_data.get('id')
+            n_hileras = cuartel_data.get('n_hileras')
+            
+            if not cuartel_id or not n_hileras:
+                errores.append(f"Cuartel {cuartel_id}: Faltan campos requeridos (id, n_hileras)")
+                continue
+            
+            if n_hileras <= 0:
+                errores.append(f"Cuartel {cuartel_id}: n_hileras debe ser mayor a 0")
+                continue
+            
+            # Verificar que el cuartel existe y pertenece al usuario
+            query_verificar = f"""
+                SELECT c.id, c.nombre, c.n_hileras
+                FROM general_dim_cuartel c
+                LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
+                LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
+                WHERE c.id = %s 
+                AND {filtro_suc}
+                AND c.id_estado = 1
+            """
+            
+            cursor.execute(query_verificar, (cuartel_id, *params_suc))
+            cuartel = cursor.fetchone()
+            
+            if not cuartel:
+                errores.append(f"Cuartel {cuartel_id}: No encontrado o sin permisos de acceso")
+                continue
+            
+            # Bloquear el cuartel hasta el commit: dos cargas simultáneas del
+            # mismo cuartel no pueden pasar ambas la verificación de abajo
+            cursor.execute("SELECT id FROM general_dim_cuartel WHERE id = %s FOR UPDATE", (cuartel_id,))
+            cursor.fetchone()
+            
+            # Verificar si ya existen hileras para este cuartel
+            query_hileras_existentes = """
+                SELECT COUNT(*) as total
+                FROM general_dim_hilera
+                WHERE id_cuartel = %s
+            """
+            cursor.execute(query_hileras_existentes, (cuartel_id,))
+            hileras_existentes = cursor.fetchone()['total']
+            
+            if hileras_existentes > 0:
+                errores.append(f"Cuartel {cuartel_id}: Ya tiene {hileras_existentes} hileras existentes")
+                continue
+            
+            # Crear las hileras
+            insertar_en_lotes(
+                cursor, 'general_dim_hilera', ['id_cuartel', 'hilera'],
+                ((cuartel_id, i) for i in range(1, n_hileras + 1)),
+                expresiones={'id_estado': '1'}
+            )
+            
+            # Actualizar el campo n_hileras del cuartel: no tenía hileras, el
+            # valor declarado se reemplaza por las recién creadas
+            cursor.execute("""
+                UPDATE general_dim_cuartel 
+                SET n_hileras = %s
+                WHERE id = %s
+            """, (n_hileras, cuartel_id))
+            
+            cuarteles_procesados += 1
+            hileras_creadas += n_hileras
+            
+            logger.info("Hileras creadas para cuartel %s: %s hileras", cuartel_id, n_hileras, extra=muestreo('catastro_cuartel'))
+        
+        except Exception as e:
+            error_msg = f"Error procesando cuartel {cuartel_data.get('id', 'N/A')}: {str(e)}"
+            errores.append(error_msg)
+            logger.error(error_msg, extra=muestreo('catastro_error'))
+            continue
+    
+    conn.commit()
+    return {
+        "cuarteles_procesados": cuarteles_procesados,
+        "hileras_creadas": hileras_creadas,
+        "errores": errores
+    }
+
 @cuarteles_bp.route('/cuarteles/catastro-masivo', methods=['POST'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def catastro_masivo():
     """
@@ -922,90 +995,25 @@ def catastro_masivo():
                 "message": "El campo 'cuarteles' debe ser una lista no vacía"
             }), 400
         
+        # Con ?async=1 se encola como job y se responde de inmediato
+        if pide_async(request.args):
+            job_id = encolar_job(user_id, 'catastro_masivo', ejecutar_catastro_masivo, user_id, cuarteles_data, total=len(cuarteles_data))
+            return jsonify({
+                "success": True,
+                "message": "Carga encolada",
+                "job_id": job_id,
+                "estado_url": f"/api/jobs/{job_id}"
+            }), 202
+        
         # Obtener conexión a la base de datos
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        cuarteles_procesados = 0
-        hileras_creadas = 0
-        errores = []
-        
-        for cuartel_data in cuarteles_data:
-            try:
-                cuartel_id = cuartel_data.get('id')
-                n_hileras = cuartel_data.get('n_hileras')
-                
-                if not cuartel_id or not n_hileras:
-                    errores.append(f"Cuartel {cuartel_id}: Faltan campos requeridos (id, n_hileras)")
-                    continue
-                
-                if n_hileras <= 0:
-                    errores.append(f"Cuartel {cuartel_id}: n_hileras debe ser mayor a 0")
-                    continue
-                
-                # Verificar que el cuartel existe y pertenece al usuario
-                query_verificar = """
-                    SELECT c.id, c.nombre, c.n_hileras
-                    FROM general_dim_cuartel c
-                    LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
-                    LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
-                    WHERE c.id = %s 
-                    AND ce.id_sucursal IN (
-                        SELECT id_sucursal 
-                        FROM usuario_pivot_sucursal_usuario 
-                        WHERE id_usuario = %s
-                    )
-                    AND c.id_estado = 1
-                """
-                
-                cursor.execute(query_verificar, (cuartel_id, user_id))
-                cuartel = cursor.fetchone()
-                
-                if not cuartel:
-                    errores.append(f"Cuartel {cuartel_id}: No encontrado o sin permisos de acceso")
-                    continue
-                
-                # Verificar si ya existen hileras para este cuartel
-                query_hileras_existentes = """
-                    SELECT COUNT(*) as total
-                    FROM general_dim_hilera
-                    WHERE id_cuartel = %s
-                """
-                cursor.execute(query_hileras_existentes, (cuartel_id,))
-                hileras_existentes = cursor.fetchone()['total']
-                
-                if hileras_existentes > 0:
-                    errores.append(f"Cuartel {cuartel_id}: Ya tiene {hileras_existentes} hileras existentes")
-                    continue
-                
-                # Crear las hileras
-                for i in range(1, n_hileras + 1):
-                    query_crear_hilera = """
-                        INSERT INTO general_dim_hilera (id_cuartel, hilera)
-                        VALUES (%s, %s)
-                    """
-                    cursor.execute(query_crear_hilera, (cuartel_id, i))
-                
-                # Actualizar el campo n_hileras del cuartel
-                query_actualizar_cuartel = """
-                    UPDATE general_dim_cuartel 
-                    SET n_hileras = %s
-                    WHERE id = %s
-                """
-                cursor.execute(query_actualizar_cuartel, (n_hileras, cuartel_id))
-                
-                cuarteles_procesados += 1
-                hileras_creadas += n_hileras
-                
-                logger.info(f"Hileras creadas para cuartel {cuartel_id}: {n_hileras} hileras")
-                
-            except Exception as e:
-                error_msg = f"Error procesando cuartel {cuartel_data.get('id', 'N/A')}: {str(e)}"
-                errores.append(error_msg)
-                logger.error(error_msg)
-                continue
+        resultado = ejecutar_catastro_masivo(conn, cursor, user_id, cuarteles_data)
+        cuarteles_procesados = resultado["cuarteles_procesados"]
+        hileras_creadas = resultado["hileras_creadas"]
+        errores = resultado["errores"]
         
-        conn.commit()
         cursor.close()
         conn.close()
         
@@ -1035,7 +1043,106 @@ def catastro_masivo():
             "message": "Error interno del servidor"
         }), 500
 
+def ejecutar_plantas_masivo(conn, cursor, user_id, plantas_data, progreso=None):
+    """
+    Crea las plantas de cada hilera del lote y retorna el resumen.
+    Se usa en el request o como job (progreso informa el avance).
+    """
+    hileras_procesadas = 0
+    plantas_creadas = 0
+    errores = []
+    
+    # Sucursales del usuario: una sola consulta para todo el lote
+    filtro_suc, params_suc = filtro_sucursales('ce.id_sucursal', sucursales_permitidas(user_id, cursor))
+    
+    for n, planta_data in enumerate(plantas_data, start=1):
+        if progreso:
+            progreso.avanzar(n - 1, {"hileras_procesadas": hileras_procesadas, "plantas_creadas": plantas_creadas})
+        
+        en_savepoint = False
+        try:
+            id_cuartel = planta_data.get('id_cuartel')
+            id_hilera = planta_data.get('id_hilera')
+            n_plantas = planta_data.get('n_plantas')
+            
+            if not id_cuartel or not id_hilera or not n_plantas:
+                errores.append(f"Hilera {id_hilera}: Faltan campos requeridos (id_cuartel, id_hilera, n_plantas)")
+                continue
+            
+            if n_plantas <= 0:
+                errores.append(f"Hilera {id_hilera}: n_plantas debe ser mayor a 0")
+                continue
+                                             
+                                             # Verificar que la hilera existe y pertenece al usuario
+            query_verificar = f"""
+                SELECT h.id, h.hilera, h.id_cuartel, c.nombre as nombre_cuartel
+                FROM general_dim_hilera h
+                INNER JOIN general_dim_cuartel c ON h.id_cuartel = c.id
+                LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
+                LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
+                WHERE h.id = %s 
+                AND h.id_cuartel = %s
+                AND {filtro_suc}
+            """
+            
+            cursor.execute(query_verificar, (id_hilera, id_cuartel, *params_suc))
+            hilera = cursor.fetchone()
+            
+            if not hilera:
+                errores.append(f"Hilera {id_hilera}: No encontrada o sin permisos de acceso")
+                continue
+            
+            # Verificar si ya existen plantas para esta hilera
+            query_plantas_existentes = """
+                SELECT COUNT(*) as total
+                FROM general_dim_planta
+                WHERE id_hilera = %s
+            """
+            cursor.execute(query_plantas_existentes, (id_hilera,))
+            plantas_existentes = cursor.fetchone()['total']
+            
+            if plantas_existentes > 0:
+                errores.append(f"Hilera {id_hilera}: Ya tiene {plantas_existentes} plantas existentes")
+                continue
+            
+            # Crear las plantas dentro de un SAVEPOINT: con más de BULK_INSERT_LOTE
+            # plantas son varios INSERT, y si uno falla se revierte la hilera
+            # completa (plantas y conteo), no solo el lote que falló
+            cursor.execute("SAVEPOINT hilera_plantas")
+            en_savepoint = True
+            insertar_en_lotes(
+                cursor, 'general_dim_planta', ['id_hilera', 'planta'],
+                ((id_hilera, i) for i in range(1, n_plantas + 1)),
+                expresiones={'fecha_creacion': 'NOW()', 'id_estado': '1'}
+            )
+            sumar_plantas(cursor, {id_hilera: n_plantas})
+            cursor.execute("RELEASE SAVEPOINT hilera_plantas")
+            en_savepoint = False
+            
+            hileras_procesadas += 1
+            plantas_creadas += n_plantas
+            
+            logger.info("Plantas creadas para hilera %s: %s plantas", id_hilera, n_plantas, extra=muestreo('plantas_hilera'))
+        
+        except Exception as e:
+            if en_savepoint:
+                # Si el rollback al savepoint falla, la conexión no sirve y se aborta el lote
+                cursor.execute("ROLLBACK TO SAVEPOINT hilera_plantas")
+                cursor.execute("RELEASE SAVEPOINT hilera_plantas")
+            error_msg = f"Error procesando hilera {planta_data.get('id_hilera', 'N/A')}: {str(e)}"
+            errores.append(error_msg)
+            logger.error(error_msg, extra=muestreo('plantas_masivo_error'))
+            continue
+    
+    conn.commit()
+    return {
+        "hileras_procesadas": hileras_procesadas,
+        "plantas_creadas": plantas_creadas,
+        "errores": errores
+    }
+
 @cuarteles_bp.route('/cuarteles/plantas-masivo', methods=['POST'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def plantas_masivo():
     """
@@ -1048,9 +1155,6 @@ def plantas_masivo():
         # Obtener datos del request
         data = request.get_json()
         
-        # Log para debug
-        logger.info(f"Plantas masivo - Datos recibidos: {data}")
-        
         if not data or 'plantas' not in data:
             logger.error(f"Plantas masivo - Error: No se encontró el campo 'plantas' en los datos")
             return jsonify({
@@ -1060,9 +1164,8 @@ def plantas_masivo():
         
         plantas_data = data['plantas']
         
-        logger.info(f"Plantas masivo - Plantas data: {plantas_data}")
-        logger.info(f"Plantas masivo - Tipo de plantas_data: {type(plantas_data)}")
-        logger.info(f"Plantas masivo - Longitud: {len(plantas_data) if isinstance(plantas_data, list) else 'No es lista'}")
+        # Resumen perezoso: con DEBUG apagado no se formatea nada del payload
+        logger.debug("Plantas masivo - plantas: %s", Resumen(plantas_data))
         
         if not isinstance(plantas_data, list) or len(plantas_data) == 0:
             logger.error(f"Plantas masivo - Error: plantas_data no es una lista válida")
@@ -1071,84 +1174,25 @@ def plantas_masivo():
                 "message": "El campo 'plantas' debe ser una lista no vacía"
             }), 400
         
+        # Con ?async=1 se encola como job y se responde de inmediato
+        if pide_async(request.args):
+            job_id = encolar_job(user_id, 'plantas_masivo', ejecutar_plantas_masivo, user_id, plantas_data, total=len(plantas_data))
+            return jsonify({
+                "success": True,
+                "message": "Carga encolada",
+                "job_id": job_id,
+                "estado_url": f"/api/jobs/{job_id}"
+            }), 202
+        
         # Obtener conexión a la base de datos
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        hileras_procesadas = 0
-        plantas_creadas = 0
-        errores = []
-        
-        for planta_data in plantas_data:
-            try:
-                id_cuartel = planta_data.get('id_cuartel')
-                id_hilera = planta_data.get('id_hilera')
-                n_plantas = planta_data.get('n_plantas')
-                
-                if not id_cuartel or not id_hilera or not n_plantas:
-                    errores.append(f"Hilera {id_hilera}: Faltan campos requeridos (id_cuartel, id_hilera, n_plantas)")
-                    continue
-                
-                if n_plantas <= 0:
-                    errores.append(f"Hilera {id_hilera}: n_plantas debe ser mayor a 0")
-                    continue
-                
-                                                 # Verificar que la hilera existe y pertenece al usuario
-                query_verificar = """
-                    SELECT h.id, h.hilera, h.id_cuartel, c.nombre as nombre_cuartel
-                    FROM general_dim_hilera h
-                    INNER JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-                    LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
-                    LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
-                    WHERE h.id = %s 
-                    AND h.id_cuartel = %s
-                    AND ce.id_sucursal IN (
-                        SELECT id_sucursal 
-                        FROM usuario_pivot_sucursal_usuario 
-                        WHERE id_usuario = %s
-                    )
-                """
-                
-                cursor.execute(query_verificar, (id_hilera, id_cuartel, user_id))
-                hilera = cursor.fetchone()
-                
-                if not hilera:
-                    errores.append(f"Hilera {id_hilera}: No encontrada o sin permisos de acceso")
-                    continue
-                
-                # Verificar si ya existen plantas para esta hilera
-                query_plantas_existentes = """
-                    SELECT COUNT(*) as total
-                    FROM general_dim_planta
-                    WHERE id_hilera = %s
-                """
-                cursor.execute(query_plantas_existentes, (id_hilera,))
-                plantas_existentes = cursor.fetchone()['total']
-                
-                if plantas_existentes > 0:
-                    errores.append(f"Hilera {id_hilera}: Ya tiene {plantas_existentes} plantas existentes")
-                    continue
-                
-                # Crear las plantas
-                for i in range(1, n_plantas + 1):
-                    query_crear_planta = """
-                        INSERT INTO general_dim_planta (id_hilera, planta, fecha_creacion)
-                        VALUES (%s, %s, NOW())
-                    """
-                    cursor.execute(query_crear_planta, (id_hilera, i))
-                
-                hileras_procesadas += 1
-                plantas_creadas += n_plantas
-                
-                logger.info(f"Plantas creadas para hilera {id_hilera}: {n_plantas} plantas")
-                
-            except Exception as e:
-                error_msg = f"Error procesando hilera {planta_data.get('id_hilera', 'N/A')}: {str(e)}"
-                errores.append(error_msg)
-                logger.error(error_msg)
-                continue
+        resultado = ejecutar_plantas_masivo(conn, cursor, user_id, plantas_data)
+        hileras_procesadas = resultado["hileras_procesadas"]
+        plantas_creadas = resultado["plantas_creadas"]
+        errores = resultado["errores"]
         
-        conn.commit()
         cursor.close()
         conn.close()
         
@@ -1205,41 +1249,35 @@ def obtener_info_plantas_masivo():
                 "message": "El campo 'cuarteles' debe ser una lista no vacía"
             }), 400
         
+        # Plantas por hilera desde el conteo mantenido (utils/conteo_plantas.py)
+        asegurar_tabla_conteo()
+        
         # Obtener conexión a la base de datos
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
         # Consulta SQL optimizada: una sola consulta para todos los cuarteles
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
         query = """
             SELECT 
                 c.id as cuartel_id,
                 c.nombre as cuartel_nombre,
                 h.id as hilera_id,
                 h.hilera as numero_hilera,
-                COALESCE(p.plantas_existentes, 0) as plantas_existentes
+                {plantas} as plantas_existentes
             FROM general_dim_cuartel c
             LEFT JOIN general_dim_hilera h ON c.id = h.id_cuartel
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
-            LEFT JOIN (
-                SELECT 
-                    id_hilera,
-                    COUNT(*) as plantas_existentes
-                FROM general_dim_planta
-                GROUP BY id_hilera
-            ) p ON h.id = p.id_hilera
+            LEFT JOIN general_fact_conteo_planta_hilera p ON h.id = p.id_hilera
             WHERE c.id IN ({})
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {}
             AND c.id_estado = 1
             ORDER BY c.id, h.hilera
-        """.format(','.join(['%s'] * len(cuarteles_ids)))
+        """.format(','.join(['%s'] * len(cuarteles_ids)), filtro_suc, plantas=SQL_PLANTAS_ACTIVAS)
         
         # Ejecutar consulta con todos los IDs de cuarteles
-        params = cuarteles_ids + [user_id]
+        params = cuarteles_ids + params_suc
         cursor.execute(query, params)
         resultados = cursor.fetchall()
         
@@ -1252,10 +1290,12 @@ def obtener_info_plantas_masivo():
                 cuarteles_info[cuartel_id] = {
                     "id": cuartel_id,
                     "nombre": row['cuartel_nombre'],
+                    "plantas_existentes": 0,
                     "hileras": []
                 }
             
             if row['hilera_id']:  # Solo agregar si hay hilera
+                cuarteles_info[cuartel_id]["plantas_existentes"] += row['plantas_existentes']
                 cuarteles_info[cuartel_id]["hileras"].append({
                     "id": row['hilera_id'],
                     "hilera": row['numero_hilera'],
@@ -1286,6 +1326,7 @@ def obtener_info_plantas_masivo():
         }), 500
 
 @cuarteles_bp.route('/cuarteles/<int:cuartel_id>/plantilla-plantas', methods=['GET'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def descargar_plantilla_plantas(cuartel_id):
     """
@@ -1295,105 +1336,52 @@ def descargar_plantilla_plantas(cuartel_id):
         # Obtener usuario logueado
         user_id = get_jwt_identity()
         
+        # Plantas por hilera desde el conteo mantenido (utils/conteo_plantas.py)
+        asegurar_tabla_conteo()
+        
         # Obtener conexión a la base de datos
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso al cuartel y obtener hileras con conteo de plantas
-        query = """
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        query = f"""
             SELECT 
                 h.id,
                 h.hilera,
                 h.id_cuartel,
                 c.nombre as nombre_cuartel,
-                COALESCE(p.plantas_existentes, 0) as plantas_existentes
+                {SQL_PLANTAS_ACTIVAS} as plantas_existentes
             FROM general_dim_hilera h
             INNER JOIN general_dim_cuartel c ON h.id_cuartel = c.id
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
-            LEFT JOIN (
-                SELECT 
-                    id_hilera,
-                    COUNT(*) as plantas_existentes
-                FROM general_dim_planta
-                GROUP BY id_hilera
-            ) p ON h.id = p.id_hilera
+            LEFT JOIN general_fact_conteo_planta_hilera p ON h.id = p.id_hilera
             WHERE c.id = %s 
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {filtro_suc}
             ORDER BY h.hilera
         """
         
-        cursor.execute(query, (cuartel_id, user_id))
+        cursor.execute(query, (cuartel_id, *params_suc))
         hileras = cursor.fetchall()
+        cursor.close()
+        conn.close()
         
         if not hileras:
-            cursor.close()
-            conn.close()
             return jsonify({
                 "success": False,
                 "message": "No se encontraron hileras para este cuartel"
             }), 404
         
-        # Crear Excel con openpyxl
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill
-        from io import BytesIO
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Plantilla Plantas"
-        
-        # Estilos para headers
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        
-        # Headers
-        headers = ["ID_Cuartel", "Nombre_Cuartel", "ID_Hilera", "Nombre_Hilera", "Plantas_Existentes", "N_Plantas_Nuevas"]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-        
-        # Datos con plantas existentes
-        for row, hilera in enumerate(hileras, 2):
-            ws.cell(row=row, column=1, value=hilera['id_cuartel'])
-            ws.cell(row=row, column=2, value=hilera['nombre_cuartel'])
-            ws.cell(row=row, column=3, value=hilera['id'])
-            ws.cell(row=row, column=4, value=f"Hilera {hilera['hilera']}")
-            ws.cell(row=row, column=5, value=hilera['plantas_existentes'])  # Plantas existentes
-            ws.cell(row=row, column=6, value=0)  # Plantas nuevas a agregar
-        
-        # Ajustar ancho de columnas
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Guardar en BytesIO
-        excel_file = BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
-        
-        cursor.close()
-        conn.close()
-        
-        # Crear respuesta con archivo
-        from flask import send_file
+        # Excel en modo write_only (filas: datos + 0 plantas nuevas a agregar)
+        excel_file = excel_streaming("Plantilla Plantas", ENCABEZADOS_PLANTAS, ANCHOS_PLANTAS, (
+            (h['id_cuartel'], h['nombre_cuartel'], h['id'], f"Hilera {h['hilera']}", h['plantas_existentes'], 0)
+            for h in hileras
+        ))
         
         return send_file(
             excel_file,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            mimetype=MIMETYPE_XLSX,
             as_attachment=True,
             download_name=f'plantilla_plantas_cuartel_{cuartel_id}.xlsx'
         )
@@ -1406,6 +1394,7 @@ def descargar_plantilla_plantas(cuartel_id):
         }), 500
 
 @cuarteles_bp.route('/cuarteles/plantilla-plantas-masiva', methods=['POST'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def descargar_plantilla_plantas_masiva():
     """
@@ -1432,110 +1421,55 @@ def descargar_plantilla_plantas_masiva():
                 "message": "El campo 'cuarteles' debe ser una lista no vacía"
             }), 400
         
+        # Plantas por hilera desde el conteo mantenido (utils/conteo_plantas.py)
+        asegurar_tabla_conteo()
+        
         # Obtener conexión a la base de datos
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
         # Consulta SQL optimizada para múltiples cuarteles
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
         query = """
             SELECT 
                 c.id as cuartel_id,
                 c.nombre as cuartel_nombre,
                 h.id as hilera_id,
                 h.hilera as numero_hilera,
-                COALESCE(p.plantas_existentes, 0) as plantas_existentes
+                {plantas} as plantas_existentes
             FROM general_dim_cuartel c
             LEFT JOIN general_dim_hilera h ON c.id = h.id_cuartel
             LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
             LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
-            LEFT JOIN (
-                SELECT 
-                    id_hilera,
-                    COUNT(*) as plantas_existentes
-                FROM general_dim_planta
-                GROUP BY id_hilera
-            ) p ON h.id = p.id_hilera
+            LEFT JOIN general_fact_conteo_planta_hilera p ON h.id = p.id_hilera
             WHERE c.id IN ({})
-            AND s.id IN (
-                SELECT id_sucursal 
-                FROM usuario_pivot_sucursal_usuario 
-                WHERE id_usuario = %s
-            )
+            AND {}
             AND c.id_estado = 1
             ORDER BY c.id, h.hilera
-        """.format(','.join(['%s'] * len(cuarteles_ids)))
+        """.format(','.join(['%s'] * len(cuarteles_ids)), filtro_suc, plantas=SQL_PLANTAS_ACTIVAS)
         
         # Ejecutar consulta
-        params = cuarteles_ids + [user_id]
+        params = cuarteles_ids + params_suc
         cursor.execute(query, params)
         resultados = cursor.fetchall()
+        cursor.close()
+        conn.close()
         
         if not resultados:
-            cursor.close()
-            conn.close()
             return jsonify({
                 "success": False,
                 "message": "No se encontraron cuarteles válidos"
             }), 404
         
-        # Crear Excel con openpyxl
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill
-        from io import BytesIO
-        
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Plantilla Plantas Masiva"
-        
-        # Estilos para headers
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-        
-        # Headers
-        headers = ["ID_Cuartel", "Nombre_Cuartel", "ID_Hilera", "Nombre_Hilera", "Plantas_Existentes", "N_Plantas_Nuevas"]
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-        
-        # Datos de todos los cuarteles
-        row = 2
-        for resultado in resultados:
-            ws.cell(row=row, column=1, value=resultado['cuartel_id'])
-            ws.cell(row=row, column=2, value=resultado['cuartel_nombre'])
-            ws.cell(row=row, column=3, value=resultado['hilera_id'])
-            ws.cell(row=row, column=4, value=f"Hilera {resultado['numero_hilera']}")
-            ws.cell(row=row, column=5, value=resultado['plantas_existentes'])
-            ws.cell(row=row, column=6, value=0)  # Plantas nuevas a agregar
-            row += 1
-        
-        # Ajustar ancho de columnas
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Guardar en BytesIO
-        excel_file = BytesIO()
-        wb.save(excel_file)
-        excel_file.seek(0)
-        
-        cursor.close()
-        conn.close()
-        
-        # Crear respuesta con archivo
-        from flask import send_file
+        # Excel en modo write_only con los datos de todos los cuarteles
+        excel_file = excel_streaming("Plantilla Plantas Masiva", ENCABEZADOS_PLANTAS, ANCHOS_PLANTAS, (
+            (r['cuartel_id'], r['cuartel_nombre'], r['hilera_id'], f"Hilera {r['numero_hilera']}", r['plantas_existentes'], 0)
+            for r in resultados
+        ))
         
         return send_file(
             excel_file,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            mimetype=MIMETYPE_XLSX,
             as_attachment=True,
             download_name=f'plantilla_plantas_masiva_{len(cuarteles_ids)}_cuarteles.xlsx'
         )
@@ -1546,3 +1480,82 @@ def descargar_plantilla_plantas_masiva():
             "success": False,
             "message": "Error interno del servidor"
         }), 500
+
+@cuarteles_bp.route('/cuarteles/conteo-plantas/reconciliar', methods=['POST'])
+@clase_ruta(RUTA_LARGA)
+@jwt_required()
+def reconciliar_conteo_plantas():
+    """
+    Recalcula el conteo de plantas activas por hilera de los cuarteles del
+    usuario (o de los indicados en 'cuarteles'). Con ?async=1 se encola como job.
+    """
+    try:
+        # Obtener usuario logueado
+        user_id = get_jwt_identity()
+        
+        data = request.get_json(silent=True) or {}
+        cuarteles_ids = data.get('cuarteles')
+        
+        if cuarteles_ids is not None and (not isinstance(cuarteles_ids, list) or len(cuarteles_ids) == 0):
+            return jsonify({
+                "success": False,
+                "message": "El campo 'cuarteles' debe ser una lista no vacía"
+            }), 400
+        
+        asegurar_tabla_conteo()
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        # Solo cuarteles de las sucursales del usuario
+        filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(user_id, cursor))
+        query = f"""
+            SELECT c.id
+            FROM general_dim_cuartel c
+            LEFT JOIN general_dim_ceco ce ON c.id_ceco = ce.id
+            LEFT JOIN general_dim_sucursal s ON ce.id_sucursal = s.id
+            WHERE {filtro_suc}
+        """
+        params = list(params_suc)
+        if cuarteles_ids is not None:
+            query += " AND c.id IN ({})".format(','.join(['%s'] * len(cuarteles_ids)))
+            params += cuarteles_ids
+        cursor.execute(query + " ORDER BY c.id", params)
+        ids_permitidos = [fila['id'] for fila in cursor.fetchall()]
+        
+        if not ids_permitidos:
+            cursor.close()
+            conn.close()
+            return jsonify({
+                "success": False,
+                "message": "No se encontraron cuarteles válidos"
+            }), 404
+        
+        # Con ?async=1 se encola como job y se responde de inmediato
+        if pide_async(request.args):
+            cursor.close()
+            conn.close()
+            job_id = encolar_job(user_id, 'conteo_plantas', reconciliar, ids_permitidos, total=len(ids_permitidos))
+            return jsonify({
+                "success": True,
+                "message": "Reconciliación encolada",
+                "job_id": job_id,
+                "estado_url": f"/api/jobs/{job_id}"
+            }), 202
+        
+        resultado = reconciliar(conn, cursor, ids_permitidos)
+        cursor.close()
+        conn.close()
+        
+        return jsonify({
+            "success": True,
+            "message": f"Conteo de plantas reconciliado para {resultado['cuarteles_recontados']} cuarteles",
+            "data": resultado
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error reconciliando conteo de plantas: {str(e)}")
+        return jsonify({
+            "success": False,
+            "message": "Error interno del servidor"
+        }), 500
@@ -1,6 +1,10 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.db import get_db_connection
+from utils.acceso import sucursales_permitidas, filtro_sucursales
+from utils.bulk import insertar_en_lotes, ids_insertados
+from utils.conteo_hileras import bloquear_cuartel, sumar_hileras
+from utils.servidor import clase_ruta, RUTA_LARGA
 import logging
 
 hileras_bp = Blueprint('hileras_bp', __name__)
@@ -19,18 +23,15 @@ def obtener_hileras():
         cursor = conn.cursor(dictionary=True)
         
         # Obtener hileras de cuarteles accesibles al usuario
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT h.*, c.nombre as cuartel_nombre, c.id_ceco
             FROM general_dim_hilera h
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
+            WHERE {filtro_suc}
             AND h.id_estado = 1
             ORDER BY c.nombre ASC, h.hilera ASC
-        """, (usuario_id,))
+        """, params_suc)
         
         hileras = cursor.fetchall()
         cursor.close()
@@ -55,16 +56,13 @@ def obtener_hilera(hilera_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT h.*, c.nombre as cuartel_nombre, c.id_ceco
             FROM general_dim_hilera h
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (hilera_id, usuario_id))
+            WHERE h.id = %s AND {filtro_suc}
+        """, (hilera_id, *params_suc))
         
         hilera = cursor.fetchone()
         cursor.close()
@@ -100,14 +98,11 @@ def crear_hilera():
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al cuartel
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM general_dim_cuartel c
-            WHERE c.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (data['id_cuartel'], usuario_id))
+            WHERE c.id = %s AND {filtro_suc}
+        """, (data['id_cuartel'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -125,6 +120,9 @@ def crear_hilera():
             conn.close()
             return jsonify({"error": "Ya existe una hilera con este número en el cuartel"}), 400
         
+        # Bloquear el cuartel antes de crear la hilera (utils/conteo_hileras.py)
+        hileras_previas = bloquear_cuartel(cursor, data['id_cuartel'])
+        
         # Insertar la hilera
         cursor.execute("""
             INSERT INTO general_dim_hilera (hilera, id_cuartel, id_estado)
@@ -132,6 +130,7 @@ def crear_hilera():
         """, (data['hilera'], data['id_cuartel'], 1))
         
         hilera_id = cursor.lastrowid
+        sumar_hileras(cursor, data['id_cuartel'], 1, hileras_previas)
         conn.commit()
         cursor.close()
         conn.close()
@@ -160,15 +159,12 @@ def actualizar_hilera(hilera_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT h.*, c.id as cuartel_id FROM general_dim_hilera h
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (hilera_id, usuario_id))
+            WHERE h.id = %s AND {filtro_suc}
+        """, (hilera_id, *params_suc))
         
         hilera_actual = cursor.fetchone()
         if not hilera_actual:
@@ -234,17 +230,15 @@ def eliminar_hilera(hilera_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la hilera
-        cursor.execute("""
-            SELECT 1 FROM general_dim_hilera h
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
+            SELECT h.id_cuartel FROM general_dim_hilera h
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (hilera_id, usuario_id))
+            WHERE h.id = %s AND {filtro_suc}
+        """, (hilera_id, *params_suc))
         
-        if not cursor.fetchone():
+        hilera = cursor.fetchone()
+        if not hilera:
             cursor.close()
             conn.close()
             return jsonify({"error": "Hilera no encontrada o sin acceso"}), 404
@@ -263,12 +257,16 @@ def eliminar_hilera(hilera_id):
                 "error": f"No se puede eliminar la hilera porque tiene {plantas_count} plantas asociadas"
             }), 400
         
+        # Bloquear el cuartel antes de tocar la hilera (utils/conteo_hileras.py)
+        bloquear_cuartel(cursor, hilera['id_cuartel'])
+        
         # Desactivar la hilera (soft delete)
         cursor.execute("""
             UPDATE general_dim_hilera 
             SET id_estado = 0
-            WHERE id = %s
+            WHERE id = %s AND id_estado = 1
         """, (hilera_id,))
+        sumar_hileras(cursor, hilera['id_cuartel'], -cursor.rowcount)
         
         conn.commit()
         cursor.close()
@@ -293,19 +291,16 @@ def obtener_plantas_hilera(hilera_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso a la hilera y obtener plantas
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT p.*
             FROM general_dim_planta p
             JOIN general_dim_hilera h ON p.id_hilera = h.id
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
+            WHERE h.id = %s AND {filtro_suc}
             AND p.id_estado = 1
             ORDER BY p.planta ASC
-        """, (hilera_id, usuario_id))
+        """, (hilera_id, *params_suc))
         
         plantas = cursor.fetchall()
         cursor.close()
@@ -322,6 +317,7 @@ def obtener_plantas_hilera(hilera_id):
 
 # Crear múltiples hileras para un cuartel
 @hileras_bp.route('/bulk', methods=['POST', 'OPTIONS'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def crear_hileras_masivo():
     if request.method == 'OPTIONS':
@@ -342,14 +338,11 @@ def crear_hileras_masivo():
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al cuartel
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM general_dim_cuartel c
-            WHERE c.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (data['id_cuartel'], usuario_id))
+            WHERE c.id = %s AND {filtro_suc}
+        """, (data['id_cuartel'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -374,18 +367,19 @@ def crear_hileras_masivo():
                 "error": f"Las siguientes hileras ya existen: {', '.join(map(str, hileras_existentes))}"
             }), 400
         
+        # Bloquear el cuartel antes de crear las hileras (utils/conteo_hileras.py)
+        hileras_previas = bloquear_cuartel(cursor, data['id_cuartel'])
+        
         # Insertar todas las hileras
-        hileras_creadas = []
-        for hilera_num in data['hileras']:
-            cursor.execute("""
-                INSERT INTO general_dim_hilera (hilera, id_cuartel, id_estado)
-                VALUES (%s, %s, %s)
-            """, (hilera_num, data['id_cuartel'], 1))
-            
-            hileras_creadas.append({
-                "id": cursor.lastrowid,
-                "hilera": hilera_num
-            })
+        resultado = insertar_en_lotes(
+            cursor, 'general_dim_hilera', ['hilera', 'id_cuartel', 'id_estado'],
+            ((hilera_num, data['id_cuartel'], 1) for hilera_num in data['hileras'])
+        )
+        hileras_creadas = [
+            {"id": hilera_id, "hilera": hilera_num}
+            for hilera_id, hilera_num in zip(ids_insertados(resultado), data['hileras'])
+        ]
+        sumar_hileras(cursor, data['id_cuartel'], resultado["filas_insertadas"], hileras_previas)
         
         conn.commit()
         cursor.close()
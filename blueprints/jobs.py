@@ -0,0 +1,39 @@
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from utils.db import get_db_connection
+from utils.jobs import obtener_job, job_publico
+from utils.cache_http import politica_cache, SIN_CACHE
+import logging
+
+jobs_bp = Blueprint('jobs_bp', __name__)
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# JOBS EN SEGUNDO PLANO
+# ============================================================================
+
+# Consultar estado y progreso de un job del usuario logueado
+@jobs_bp.route('/<string:job_id>', methods=['GET', 'OPTIONS'])
+@politica_cache(SIN_CACHE)
+@jwt_required()
+def obtener_estado_job(job_id):
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        usuario_id = get_jwt_identity()
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        job = obtener_job(cursor, job_id, usuario_id)
+        cursor.close()
+        conn.close()
+        
+        if not job:
+            return jsonify({"error": "Job no encontrado"}), 404
+        
+        return jsonify(job_publico(job)), 200
+    
+    except Exception as e:
+        logger.error(f"Error obteniendo job {job_id}: {str(e)}")
+        return jsonify({"error": "Error interno del servidor"}), 500
@@ -1,15 +1,32 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.db import get_db_connection
+from utils.acceso import sucursales_permitidas, filtro_sucursales, tiene_acceso_sucursal
+from utils.bulk import insertar_en_lotes, ids_insertados
+from utils.conteo_plantas import sumar_plantas
+from utils.conteo_hileras import bloquear_cuartel, sumar_hileras
+from utils.jobs import crear_job, obtener_job, actualizar_job, reclamar_job, encolar_job, pide_async
+from utils.importacion import (
+    LectorPlanilla, ArchivoInvalidoError, COLUMNAS_CUARTELES, COLUMNAS_REGISTROS, cuarteles_desde_filas
+)
+from utils.streaming import respuesta_streaming, formato_respuesta
+from utils.imagenes import ImagenInvalidaError, guardar_imagen_base64, get_almacen, es_hash, mimetype_de, decodificar_base64
+from utils.miniaturas import VARIANTES, clave_variante, generar_variantes, encolar_variantes, reducir_variante
+from utils.plantillas import TIPOS_PLANTILLA, MIMETYPE_XLSX, plantilla_estatica
+from utils.catalogos import obtener_catalogo, respuesta_catalogo
+from utils.servidor import clase_ruta, RUTA_LARGA
+from config import Config
 import logging
+import json
+import time
 import uuid
+import hashlib
 from datetime import datetime
+from collections import Counter
 import os
-import tempfile
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+from io import BytesIO
 from flask import send_file
+from werkzeug.wsgi import wrap_file
 
 mapeo_bp = Blueprint('mapeo_bp', __name__)
 logger = logging.getLogger(__name__)
@@ -31,23 +48,17 @@ def obtener_registros_mapeo():
         cursor = conn.cursor(dictionary=True)
         
         # Obtener registros de mapeo de cuarteles accesibles al usuario
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT rm.*, c.nombre as cuartel_nombre, c.id_ceco
             FROM mapeo_fact_registromapeo rm
             JOIN general_dim_cuartel c ON rm.id_cuartel = c.id
-            WHERE c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
+            WHERE {filtro_suc}
             ORDER BY rm.fecha_creacion DESC
-        """, (usuario_id,))
-        
-        registros = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        """, params_suc)
         
-        return jsonify(registros), 200
+        # Se serializa fila a fila mientras se lee el cursor
+        return respuesta_streaming(conn, cursor, formato_respuesta(request))
         
     except Exception as e:
         logger.error(f"Error obteniendo registros de mapeo: {str(e)}")
@@ -66,16 +77,13 @@ def obtener_registro_mapeo(registro_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al registro de mapeo
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT rm.*, c.nombre as cuartel_nombre, c.id_ceco
             FROM mapeo_fact_registromapeo rm
             JOIN general_dim_cuartel c ON rm.id_cuartel = c.id
-            WHERE rm.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (registro_id, usuario_id))
+            WHERE rm.id = %s AND {filtro_suc}
+        """, (registro_id, *params_suc))
         
         registro = cursor.fetchone()
         cursor.close()
@@ -121,14 +129,11 @@ def crear_registro_mapeo():
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al cuartel
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM general_dim_cuartel c
-            WHERE c.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (data['id_cuartel'], usuario_id))
+            WHERE c.id = %s AND {filtro_suc}
+        """, (data['id_cuartel'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -192,15 +197,12 @@ def actualizar_registro_mapeo(registro_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al registro de mapeo
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM mapeo_fact_registromapeo rm
             JOIN general_dim_cuartel c ON rm.id_cuartel = c.id
-            WHERE rm.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (registro_id, usuario_id))
+            WHERE rm.id = %s AND {filtro_suc}
+        """, (registro_id, *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -268,20 +270,17 @@ def obtener_estados_hileras(registro_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar acceso al registro de mapeo y obtener estados de hileras
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT eh.*, h.hilera, c.nombre as cuartel_nombre, u.nombre as usuario_nombre
             FROM mapeo_fact_estado_hilera eh
             JOIN mapeo_fact_registromapeo rm ON eh.id_registro_mapeo = rm.id
             JOIN general_dim_hilera h ON eh.id_hilera = h.id
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
             LEFT JOIN general_dim_usuario u ON eh.id_usuario = u.id
-            WHERE rm.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
+            WHERE rm.id = %s AND {filtro_suc}
             ORDER BY h.hilera ASC
-        """, (registro_id, usuario_id))
+        """, (registro_id, *params_suc))
         
         estados = cursor.fetchall()
         cursor.close()
@@ -319,16 +318,13 @@ def crear_estado_hilera(registro_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al registro de mapeo y la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM mapeo_fact_registromapeo rm
             JOIN general_dim_cuartel c ON rm.id_cuartel = c.id
             JOIN general_dim_hilera h ON h.id_cuartel = c.id
-            WHERE rm.id = %s AND h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (registro_id, data['id_hilera'], usuario_id))
+            WHERE rm.id = %s AND h.id = %s AND {filtro_suc}
+        """, (registro_id, data['id_hilera'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -390,6 +386,24 @@ def crear_estado_hilera(registro_id):
 # REGISTROS INDIVIDUALES
 # ============================================================================
 
+# Columnas de mapeo_fact_registro en las respuestas: la imagen va como URL
+# (hash -> /imagenes/<hash>; base64 antiguo -> /registros/<id>/imagen), no su contenido.
+# imagen_miniatura_url apunta a la variante chica para listados y vistas de cuartel.
+COLUMNAS_REGISTRO = """
+    r.id, r.id_registro_mapeo, r.id_evaluador, r.hora_registro, r.id_planta,
+    r.id_tipoplanta, r.fecha_creacion,
+    CASE
+        WHEN r.imagen IS NULL OR r.imagen = '' THEN NULL
+        WHEN CHAR_LENGTH(r.imagen) = 64 THEN CONCAT('/api/mapeo/imagenes/', r.imagen)
+        ELSE CONCAT('/api/mapeo/registros/', r.id, '/imagen')
+    END AS imagen_url,
+    CASE
+        WHEN r.imagen IS NULL OR r.imagen = '' THEN NULL
+        WHEN CHAR_LENGTH(r.imagen) = 64 THEN CONCAT('/api/mapeo/imagenes/', r.imagen, '?variante=miniatura')
+        ELSE CONCAT('/api/mapeo/registros/', r.id, '/imagen?variante=miniatura')
+    END AS imagen_miniatura_url
+"""
+
 # Obtener registros individuales
 @mapeo_bp.route('/registros', methods=['GET', 'OPTIONS'])
 @jwt_required()
@@ -408,8 +422,9 @@ def obtener_registros():
         evaluador_id = request.args.get('evaluador_id')
         
         # Construir query base
-        query = """
-            SELECT r.*, p.planta, h.hilera, c.nombre as cuartel_nombre, 
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        query = f"""
+            SELECT {COLUMNAS_REGISTRO}, p.planta, h.hilera, c.nombre as cuartel_nombre, 
                    u.nombre as evaluador_nombre, tp.nombre as tipo_planta_nombre
             FROM mapeo_fact_registro r
             JOIN general_dim_planta p ON r.id_planta = p.id
@@ -417,13 +432,9 @@ def obtener_registros():
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
             LEFT JOIN general_dim_usuario u ON r.id_evaluador = u.id
             LEFT JOIN mapeo_dim_tipoplanta tp ON r.id_tipoplanta = tp.id
-            WHERE c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
+            WHERE {filtro_suc}
         """
-        valores = [usuario_id]
+        valores = list(params_suc)
         
         # Agregar filtros
         if registro_mapeo_id:
@@ -441,11 +452,9 @@ def obtener_registros():
         query += " ORDER BY r.hora_registro DESC"
         
         cursor.execute(query, valores)
-        registros = cursor.fetchall()
-        cursor.close()
-        conn.close()
         
-        return jsonify(registros), 200
+        # Se serializa fila a fila mientras se lee el cursor
+        return respuesta_streaming(conn, cursor, formato_respuesta(request))
         
     except Exception as e:
         logger.error(f"Error obteniendo registros: {str(e)}")
@@ -472,22 +481,27 @@ def crear_registro():
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la planta
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM general_dim_planta p
             JOIN general_dim_hilera h ON p.id_hilera = h.id
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE p.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-        """, (data['id_planta'], usuario_id))
+            WHERE p.id = %s AND {filtro_suc}
+        """, (data['id_planta'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
             conn.close()
             return jsonify({"error": "No tienes acceso a esta planta"}), 403
         
+        # La imagen se guarda aparte; en la fila queda su hash
+        try:
+            imagen = guardar_imagen_base64(data.get('imagen'))
+        except ImagenInvalidaError as e:
+            cursor.close()
+            conn.close()
+            return jsonify({"error": str(e)}), 400
+        
         # Generar UUID para el registro
         registro_id = str(uuid.uuid4())
         
@@ -502,13 +516,16 @@ def crear_registro():
             usuario_id,
             data['id_planta'],
             data['id_tipoplanta'],
-            data.get('imagen')
+            imagen
         ))
         
         conn.commit()
         cursor.close()
         conn.close()
         
+        # Miniatura y tamaño medio se generan en segundo plano
+        encolar_variantes([imagen])
+        
         return jsonify({
             "message": "Registro creado exitosamente",
             "id": registro_id
@@ -531,8 +548,9 @@ def obtener_registro(registro_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso al registro
-        cursor.execute("""
-            SELECT r.*, p.planta, h.hilera, c.nombre as cuartel_nombre, 
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
+            SELECT {COLUMNAS_REGISTRO}, p.planta, h.hilera, c.nombre as cuartel_nombre, 
                    u.nombre as evaluador_nombre, tp.nombre as tipo_planta_nombre
             FROM mapeo_fact_registro r
             JOIN general_dim_planta p ON r.id_planta = p.id
@@ -540,12 +558,8 @@ def obtener_registro(registro_id):
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
             LEFT JOIN general_dim_usuario u ON r.id_evaluador = u.id
             LEFT JOIN mapeo_dim_tipoplanta tp ON r.id_tipoplanta = tp.id
-            WHERE r.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-        """, (registro_id, usuario_id))
+            WHERE r.id = %s AND {filtro_suc}
+        """, (registro_id, *params_suc))
         
         registro = cursor.fetchone()
         cursor.close()
@@ -561,13 +575,64 @@ def obtener_registro(registro_id):
         return jsonify({"error": "Error interno del servidor"}), 500
 
 # ============================================================================
-# TIPOS DE PLANTA
+# IMÁGENES DE REGISTROS
 # ============================================================================
 
-# Obtener tipos de planta
-@mapeo_bp.route('/tipos-planta', methods=['GET', 'OPTIONS'])
+def enviar_imagen(clave):
+    """Respuesta con la imagen del almacén (ETag = clave, soporta Range e If-None-Match)"""
+    abierta = get_almacen().abrir(clave)
+    if abierta is None:
+        return jsonify({"error": "Imagen no encontrada"}), 404
+    archivo, tamano = abierta
+    return respuesta_imagen(archivo, tamano, clave)
+
+def respuesta_imagen(archivo, tamano, clave):
+    """Respuesta inmutable con el archivo binario abierto; `clave` es el ETag"""
+    mimetype = mimetype_de(archivo.read(12))
+    archivo.seek(0)
+    
+    respuesta = Response(wrap_file(request.environ, archivo), mimetype=mimetype, direct_passthrough=True)
+    respuesta.set_etag(clave)
+    # El contenido de una clave nunca cambia: se puede cachear indefinidamente
+    respuesta.cache_control.private = True
+    respuesta.cache_control.max_age = Config.IMAGENES_CACHE_SEGUNDOS
+    respuesta.cache_control.immutable = True
+    return respuesta.make_conditional(request, accept_ranges=True, complete_length=tamano)
+
+def enviar_imagen_o_variante(hash_imagen, variante):
+    """Original o variante (?variante=miniatura|media); una variante que falta se genera en el momento"""
+    if not variante:
+        return enviar_imagen(hash_imagen)
+    if variante not in VARIANTES:
+        return jsonify({"error": f"Variante inválida. Variantes válidas: {', '.join(VARIANTES)}"}), 400
+    
+    clave = clave_variante(hash_imagen, variante)
+    if not get_almacen().existe(clave):
+        if not get_almacen().existe(hash_imagen):
+            return jsonify({"error": "Imagen no encontrada"}), 404
+        generar_variantes(hash_imagen, [variante])
+    return enviar_imagen(clave)
+
+# Obtener una imagen por su hash
+@mapeo_bp.route('/imagenes/<string:hash_imagen>', methods=['GET', 'OPTIONS'])
 @jwt_required()
-def obtener_tipos_planta():
+def obtener_imagen(hash_imagen):
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        if not es_hash(hash_imagen):
+            return jsonify({"error": "Imagen no encontrada"}), 404
+        return enviar_imagen_o_variante(hash_imagen, request.args.get('variante'))
+        
+    except Exception as e:
+        logger.error(f"Error enviando imagen {hash_imagen}: {str(e)}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# Obtener la imagen de un registro (también las guardadas como base64 antes del almacén)
+@mapeo_bp.route('/registros/<string:registro_id>/imagen', methods=['GET', 'OPTIONS'])
+@jwt_required()
+def obtener_imagen_registro(registro_id):
     if request.method == 'OPTIONS':
         return '', 200
     
@@ -576,27 +641,86 @@ def obtener_tipos_planta():
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        # Obtener tipos de planta de la empresa del usuario
-        cursor.execute("""
-            SELECT tp.*
-            FROM mapeo_dim_tipoplanta tp
-            JOIN general_dim_usuario u ON tp.id_empresa = (
-                SELECT DISTINCT e.id 
-                FROM general_dim_empresa e
-                JOIN general_dim_sucursal s ON e.id = s.id_empresa
-                JOIN usuario_pivot_sucursal_usuario p ON s.id = p.id_sucursal
-                WHERE p.id_usuario = %s
-                LIMIT 1
-            )
-            WHERE tp.id_estado = 1
-            ORDER BY tp.nombre ASC
-        """, (usuario_id,))
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
+            SELECT r.imagen
+            FROM mapeo_fact_registro r
+            JOIN general_dim_planta p ON r.id_planta = p.id
+            JOIN general_dim_hilera h ON p.id_hilera = h.id
+            JOIN general_dim_cuartel c ON h.id_cuartel = c.id
+            WHERE r.id = %s AND {filtro_suc}
+        """, (registro_id, *params_suc))
+        
+        registro = cursor.fetchone()
+        if not registro or not registro['imagen']:
+            cursor.close()
+            conn.close()
+            return jsonify({"error": "Imagen no encontrada"}), 404
         
-        tipos = cursor.fetchall()
+        imagen = registro['imagen']
         cursor.close()
         conn.close()
         
-        return jsonify(tipos), 200
+        if es_hash(imagen):
+            return enviar_imagen_o_variante(imagen, request.args.get('variante'))
+        
+        # Base64 antiguo: se sirve tal cual, sin tocar la fila. Pasarlo al
+        # almacén es trabajo de migrar_imagenes.py
+        variante = request.args.get('variante')
+        if variante and variante not in VARIANTES:
+            return jsonify({"error": f"Variante inválida. Variantes válidas: {', '.join(VARIANTES)}"}), 400
+        datos = decodificar_base64(imagen)
+        clave = hashlib.sha256(datos).hexdigest()
+        if variante:
+            datos = reducir_variante(datos, variante)
+            clave = clave_variante(clave, variante)
+        return respuesta_imagen(BytesIO(datos), len(datos), clave)
+        
+    except ImagenInvalidaError as e:
+        logger.warning(f"Imagen inválida en registro {registro_id}: {str(e)}")
+        return jsonify({"error": "Imagen no encontrada"}), 404
+    except Exception as e:
+        logger.error(f"Error enviando imagen del registro {registro_id}: {str(e)}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+# ============================================================================
+# TIPOS DE PLANTA
+# ============================================================================
+
+# Tipos de planta y empresa de cada sucursal: catálogos cacheados (utils/catalogos.py)
+def _cargar_tipos_planta(cursor):
+    cursor.execute("""
+        SELECT tp.*
+        FROM mapeo_dim_tipoplanta tp
+        WHERE tp.id_estado = 1
+        ORDER BY tp.nombre ASC
+    """)
+    return cursor.fetchall()
+
+def _cargar_empresa_sucursal(cursor):
+    cursor.execute("SELECT id, id_empresa FROM general_dim_sucursal")
+    return {fila['id']: fila['id_empresa'] for fila in cursor.fetchall()}
+
+# Obtener tipos de planta
+@mapeo_bp.route('/tipos-planta', methods=['GET', 'OPTIONS'])
+@jwt_required()
+def obtener_tipos_planta():
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        usuario_id = get_jwt_identity()
+        
+        # Empresa del usuario: la de su primera sucursal
+        sucursales = sucursales_permitidas(usuario_id)
+        empresas = obtener_catalogo('empresa_sucursal', _cargar_empresa_sucursal).datos
+        id_empresa = next((empresas[s] for s in sorted(sucursales) if s in empresas), None)
+        
+        # Tipos de planta de la empresa del usuario, desde el cache de catálogos
+        catalogo = obtener_catalogo('tipos_planta', _cargar_tipos_planta)
+        tipos = [tp for tp in catalogo.datos if tp['id_empresa'] == id_empresa]
+        
+        return respuesta_catalogo(catalogo, tipos, variante=f"empresa-{id_empresa}")
         
     except Exception as e:
         logger.error(f"Error obteniendo tipos de planta: {str(e)}")
@@ -630,11 +754,7 @@ def validar_coordenadas_gps(ubicacion):
 
 def validar_sucursal_usuario(cursor, usuario_id, id_sucursal):
     """Validar que el usuario tenga acceso a la sucursal"""
-    cursor.execute("""
-        SELECT 1 FROM usuario_pivot_sucursal_usuario 
-        WHERE id_usuario = %s AND id_sucursal = %s
-    """, (usuario_id, id_sucursal))
-    return cursor.fetchone() is not None
+    return tiene_acceso_sucursal(usuario_id, id_sucursal, cursor)
 
 def validar_sucursal_existe(cursor, id_sucursal):
     """Validar que la sucursal existe"""
@@ -662,22 +782,216 @@ def validar_planta_existe(cursor, id_planta, id_hilera):
 
 def validar_tipo_planta_existe(cursor, id_tipoplanta, usuario_id):
     """Validar que el tipo de planta existe y pertenece a la empresa del usuario"""
-    cursor.execute("""
+    filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(usuario_id, cursor))
+    cursor.execute(f"""
         SELECT 1 FROM mapeo_dim_tipoplanta tp
         JOIN general_dim_usuario u ON tp.id_empresa = (
             SELECT DISTINCT e.id 
             FROM general_dim_empresa e
             JOIN general_dim_sucursal s ON e.id = s.id_empresa
-            JOIN usuario_pivot_sucursal_usuario p ON s.id = p.id_sucursal
-            WHERE p.id_usuario = %s
+            WHERE {filtro_suc}
             LIMIT 1
         )
         WHERE tp.id = %s AND tp.id_estado = 1
-    """, (usuario_id, id_tipoplanta))
+    """, (*params_suc, id_tipoplanta))
     return cursor.fetchone() is not None
 
+def clave_id(valor):
+    """Normaliza un ID para comparar: 123, '123' y 123.0 (celda Excel) dan '123'"""
+    if isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    return str(valor).strip()
+
+def plantas_accesibles(cursor, ids_planta, usuario_id):
+    """IDs (como str) de las plantas activas a las que el usuario tiene acceso, en una consulta"""
+    ids = list({clave_id(id_planta) for id_planta in ids_planta})
+    if not ids:
+        return set()
+    filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+    cursor.execute(f"""
+        SELECT p.id FROM general_dim_planta p
+        JOIN general_dim_hilera h ON p.id_hilera = h.id
+        JOIN general_dim_cuartel c ON h.id_cuartel = c.id
+        WHERE p.id IN ({','.join(['%s'] * len(ids))}) AND {filtro_suc} AND p.id_estado = 1
+    """, (*ids, *params_suc))
+    return {str(fila['id']) for fila in cursor.fetchall()}
+
+def tipos_planta_validos(cursor, ids_tipoplanta, usuario_id):
+    """IDs (como str) de los tipos de planta activos de la empresa del usuario, en una consulta"""
+    ids = list({clave_id(id_tipo) for id_tipo in ids_tipoplanta})
+    if not ids:
+        return set()
+    filtro_suc, params_suc = filtro_sucursales('s.id', sucursales_permitidas(usuario_id, cursor))
+    cursor.execute(f"""
+        SELECT tp.id FROM mapeo_dim_tipoplanta tp
+        WHERE tp.id IN ({','.join(['%s'] * len(ids))}) AND tp.id_estado = 1
+        AND tp.id_empresa = (
+            SELECT DISTINCT e.id 
+            FROM general_dim_empresa e
+            JOIN general_dim_sucursal s ON e.id = s.id_empresa
+            WHERE {filtro_suc}
+            LIMIT 1
+        )
+    """, (*ids, *params_suc))
+    return {str(fila['id']) for fila in cursor.fetchall()}
+
+def procesar_cuartel_carga(cursor, usuario_id, fila, cuartel_data, estadisticas):
+    """
+    Valida y crea un cuartel de carga masiva con sus hileras y plantas.
+    Los problemas de la fila se agregan a `estadisticas`; retorna True si se creó.
+    """
+    # Validar datos del cuartel
+    campos_requeridos = ['nombre', 'id_sucursal', 'superficie', 'n_hileras']
+    faltantes = [campo for campo in campos_requeridos if campo not in cuartel_data]
+    for campo in faltantes:
+        estadisticas["errores"].append({
+            "fila": fila,
+            "campo": campo,
+            "error": f"Campo requerido: {campo}"
+        })
+    if faltantes:
+        return False
+    
+    # Validar que la sucursal existe
+    if not validar_sucursal_existe(cursor, cuartel_data['id_sucursal']):
+        estadisticas["errores"].append({
+            "fila": fila,
+            "campo": "id_sucursal",
+            "error": f"Sucursal con ID {cuartel_data['id_sucursal']} no existe"
+        })
+        return False
+    
+    # Validar que el usuario tiene acceso a la sucursal
+    if not validar_sucursal_usuario(cursor, usuario_id, cuartel_data['id_sucursal']):
+        estadisticas["errores"].append({
+            "fila": fila,
+            "campo": "id_sucursal",
+            "error": f"No tienes acceso a la sucursal {cuartel_data['id_sucursal']}"
+        })
+        return False
+    
+    # Crear cuartel
+    cursor.execute("""
+        INSERT INTO general_dim_cuartel (
+            nombre, id_sucursal, superficie, id_variedad, ano_plantacion,
+            dsh, deh, n_hileras, id_estado, fecha_creacion
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+    """, (
+        cuartel_data['nombre'],
+        cuartel_data['id_sucursal'],
+        cuartel_data['superficie'],
+        cuartel_data.get('id_variedad'),
+        cuartel_data.get('ano_plantacion'),
+        cuartel_data.get('dsh'),
+        cuartel_data.get('deh'),
+        cuartel_data['n_hileras'],
+        1  # id_estado activo
+    ))
+    
+    cuartel_id = cursor.lastrowid
+    estadisticas["cuarteles_creados"] += 1
+    
+    # Generar hileras automáticamente según n_hileras (Hilera 1, Hilera 2, ...)
+    n_hileras = cuartel_data['n_hileras']
+    resultado_hileras = insertar_en_lotes(
+        cursor, 'general_dim_hilera', ['hilera', 'id_cuartel', 'id_estado'],
+        ((f"Hilera {j}", cuartel_id, 1) for j in range(1, n_hileras + 1)),  # id_estado activo
+        expresiones={'fecha_creacion': 'NOW()'}
+    )
+    hileras_ids = ids_insertados(resultado_hileras)
+    estadisticas["hileras_creadas"] += resultado_hileras["filas_insertadas"]
+    
+    # Si se especifican plantas para las hileras, se insertan todas juntas
+    filas_plantas = []
+    if 'hileras' in cuartel_data and cuartel_data['hileras']:
+        for j, hilera_id in enumerate(hileras_ids, start=1):
+            # Buscar la hilera correspondiente en los datos
+            hilera_config = next((h for h in cuartel_data['hileras'] if h.get('hilera') == f"Hilera {j}"), None)
+            
+            if hilera_config and 'plantas' in hilera_config:
+                plantas_creadas_en_hilera = set()
+                
+                for k, planta_data in enumerate(hilera_config['plantas']):
+                    if 'planta' not in planta_data:
+                        estadisticas["errores"].append({
+                            "fila": f"{fila}.{j}.{k + 1}",
+                            "campo": "planta",
+                            "error": "Campo requerido: planta"
+                        })
+                        continue
+                    
+                    # Validar coordenadas GPS si se proporcionan
+                    if 'ubicacion' in planta_data:
+                        if not validar_coordenadas_gps(planta_data['ubicacion']):
+                            estadisticas["warnings"].append({
+                                "fila": f"{fila}.{j}.{k + 1}",
+                                "campo": "ubicacion",
+                                "warning": f"Formato de coordenadas inválido: {planta_data['ubicacion']}"
+                            })
+                            planta_data['ubicacion'] = None
+                    
+                    # Verificar duplicados en la hilera
+                    if planta_data['planta'] in plantas_creadas_en_hilera:
+                        estadisticas["warnings"].append({
+                            "fila": f"{fila}.{j}.{k + 1}",
+                            "campo": "planta",
+                            "warning": f"Planta duplicada en Hilera {j}: Planta {planta_data['planta']}"
+                        })
+                        continue
+                    
+                    filas_plantas.append((
+                        planta_data['planta'],
+                        hilera_id,
+                        planta_data.get('ubicacion'),
+                        1  # id_estado activo
+                    ))
+                    plantas_creadas_en_hilera.add(planta_data['planta'])
+    
+    # Crear plantas
+    if filas_plantas:
+        resultado_plantas = insertar_en_lotes(
+            cursor, 'general_dim_planta', ['planta', 'id_hilera', 'ubicacion', 'id_estado'],
+            filas_plantas, expresiones={'fecha_creacion': 'NOW()'}
+        )
+        estadisticas["plantas_creadas"] += resultado_plantas["filas_insertadas"]
+        sumar_plantas(cursor, Counter(fila[1] for fila in filas_plantas))
+    
+    return True
+
+def ejecutar_carga_cuarteles(conn, cursor, usuario_id, cuarteles_data, progreso=None):
+    """
+    Carga de /cuarteles/bulk en una sola transacción. La usa el endpoint
+    directamente o como job en segundo plano (?async=1).
+    """
+    conn.begin()
+    
+    estadisticas = {
+        "cuarteles_creados": 0,
+        "hileras_creadas": 0,
+        "plantas_creadas": 0,
+        "errores": [],
+        "warnings": []
+    }
+    
+    try:
+        for i, cuartel_data in enumerate(cuarteles_data):
+            procesar_cuartel_carga(cursor, usuario_id, i + 1, cuartel_data, estadisticas)
+            if progreso:
+                progreso.avanzar(i + 1, {
+                    "cuarteles_creados": estadisticas["cuarteles_creados"],
+                    "hileras_creadas": estadisticas["hileras_creadas"],
+                    "plantas_creadas": estadisticas["plantas_creadas"]
+                })
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return estadisticas
+
 # Carga masiva de cuarteles con hileras y plantas
 @mapeo_bp.route('/cuarteles/bulk', methods=['POST', 'OPTIONS'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def carga_masiva_cuarteles():
     if request.method == 'OPTIONS':
@@ -694,158 +1008,216 @@ def carga_masiva_cuarteles():
         
         # Validar límite de procesamiento
         if len(cuarteles_data) > 1000:
-            return jsonify({"error": "Máximo 1000 cuarteles por carga masiva"}), 400
+            return jsonify({"error": "Máximo 1000 cuarteles por carga masiva (para más usar /cuarteles/bulk/ndjson)"}), 400
+        
+        # Con ?async=1 se encola como job y se responde de inmediato
+        if pide_async(request.args):
+            job_id = encolar_job(usuario_id, 'carga_cuarteles', ejecutar_carga_cuarteles, usuario_id, cuarteles_data, total=len(cuarteles_data))
+            return jsonify({
+                "success": True,
+                "message": "Carga encolada",
+                "job_id": job_id,
+                "estado_url": f"/api/jobs/{job_id}"
+            }), 202
         
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        # Iniciar transacción
-        conn.begin()
+        try:
+            estadisticas = ejecutar_carga_cuarteles(conn, cursor, usuario_id, cuarteles_data)
+            
+            return jsonify({
+                "success": True,
+                "message": "Carga masiva de cuarteles completada exitosamente",
+                "data": estadisticas
+            }), 201
+            
+        except Exception as e:
+            # Rollback en caso de error
+            conn.rollback()
+            logger.error(f"Error en carga masiva de cuarteles: {str(e)}")
+            return jsonify({
+                "success": False,
+                "message": "Error en la carga masiva",
+                "error": str(e)
+            }), 500
         
-        estadisticas = {
-            "cuarteles_creados": 0,
-            "hileras_creadas": 0,
-            "plantas_creadas": 0,
-            "errores": [],
-            "warnings": []
-        }
+        finally:
+            cursor.close()
+            conn.close()
+        
+    except Exception as e:
+        logger.error(f"Error en carga masiva de cuarteles: {str(e)}")
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+def procesar_cuartel_en_savepoint(cursor, usuario_id, fila, cuartel_data, estadisticas):
+    """
+    Procesa un cuartel dentro de un SAVEPOINT: si la fila falla se revierte
+    solo ella (datos y contadores) y queda como error en el reporte.
+    """
+    contadores = {k: estadisticas[k] for k in ('cuarteles_creados', 'hileras_creadas', 'plantas_creadas')}
+    n_errores = len(estadisticas["errores"])
+    n_warnings = len(estadisticas["warnings"])
+    
+    cursor.execute("SAVEPOINT fila_carga")
+    try:
+        procesar_cuartel_carga(cursor, usuario_id, fila, cuartel_data, estadisticas)
+    except Exception as e:
+        # Si el rollback al savepoint falla, la conexión no sirve y se aborta el lote
+        cursor.execute("ROLLBACK TO SAVEPOINT fila_carga")
+        estadisticas.update(contadores)
+        del estadisticas["errores"][n_errores:]
+        del estadisticas["warnings"][n_warnings:]
+        estadisticas["errores"].append({
+            "fila": fila,
+            "error": f"Error creando cuartel: {str(e)}"
+        })
+    cursor.execute("RELEASE SAVEPOINT fila_carga")
+
+def acotar_reporte(estadisticas):
+    """Mantiene errores/warnings en CARGA_MAX_ERRORES entradas para que el reporte no crezca sin límite"""
+    for clave in ('errores', 'warnings'):
+        exceso = len(estadisticas[clave]) - Config.CARGA_MAX_ERRORES
+        if exceso > 0:
+            del estadisticas[clave][Config.CARGA_MAX_ERRORES:]
+            estadisticas[f"{clave}_omitidos"] = estadisticas.get(f"{clave}_omitidos", 0) + exceso
+
+# Carga masiva de cuarteles en streaming (NDJSON: un cuartel por línea)
+@mapeo_bp.route('/cuarteles/bulk/ndjson', methods=['POST', 'OPTIONS'])
+@clase_ruta(RUTA_LARGA)
+@jwt_required()
+def carga_masiva_cuarteles_ndjson():
+    """
+    Lee el body línea a línea (sin límite de cuarteles) y hace commit cada `lote`
+    líneas (?lote=, default CARGA_STREAM_LOTE). El progreso se guarda en el mismo
+    commit; si la carga se corta, reenviar el mismo archivo con ?token=<token>
+    continúa desde la primera línea no confirmada.
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        usuario_id = get_jwt_identity()
+        lote = request.args.get('lote', Config.CARGA_STREAM_LOTE, type=int)
+        token = request.args.get('token')
+        
+        if not lote or lote <= 0:
+            return jsonify({"error": "El parámetro 'lote' debe ser un entero positivo"}), 400
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        if token:
+            job = obtener_job(cursor, token, usuario_id)
+            if not job or job['tipo'] != 'carga_cuarteles_ndjson':
+                cursor.close()
+                conn.close()
+                return jsonify({"error": "Token de carga no encontrado"}), 404
+            
+            if job['estado'] == 'completado':
+                cursor.close()
+                conn.close()
+                return jsonify({
+                    "success": True,
+                    "message": "La carga ya estaba completada",
+                    "token": token,
+                    "filas_confirmadas": job['filas_confirmadas'],
+                    "data": job['resultado']
+                }), 200
+            
+            # Un job en proceso con avances en los últimos CARGA_REANUDAR_ESPERA
+            # segundos sigue corriendo en otro request. Reclamarlo es un UPDATE
+            # condicional: dos reanudaciones con el mismo token no corren a la vez
+            if not reclamar_job(cursor, token, usuario_id, Config.CARGA_REANUDAR_ESPERA):
+                conn.rollback()
+                cursor.close()
+                conn.close()
+                return jsonify({"error": "La carga sigue en proceso", "token": token}), 409
+            conn.commit()
+            
+            # Releer después del commit: el progreso puede haber avanzado desde la primera lectura
+            job = obtener_job(cursor, token, usuario_id)
+            conn.commit()
+            estadisticas = job['resultado']
+            ya_confirmadas = job['filas_confirmadas']
+            logger.info(f"Reanudando carga {token} desde la línea {ya_confirmadas + 1}")
+        else:
+            estadisticas = {
+                "cuarteles_creados": 0,
+                "hileras_creadas": 0,
+                "plantas_creadas": 0,
+                "errores": [],
+                "warnings": []
+            }
+            token = crear_job(cursor, usuario_id, 'carga_cuarteles_ndjson', estadisticas)
+            conn.commit()
+            ya_confirmadas = 0
+        
+        fila = 0
+        pendientes = 0
         
         try:
-            for i, cuartel_data in enumerate(cuarteles_data):
-                # Validar datos del cuartel
-                campos_requeridos = ['nombre', 'id_sucursal', 'superficie', 'n_hileras']
-                for campo in campos_requeridos:
-                    if campo not in cuartel_data:
-                        estadisticas["errores"].append({
-                            "fila": i + 1,
-                            "campo": campo,
-                            "error": f"Campo requerido: {campo}"
-                        })
-                        continue
-                
-                # Validar que la sucursal existe
-                if not validar_sucursal_existe(cursor, cuartel_data['id_sucursal']):
-                    estadisticas["errores"].append({
-                        "fila": i + 1,
-                        "campo": "id_sucursal",
-                        "error": f"Sucursal con ID {cuartel_data['id_sucursal']} no existe"
-                    })
-                    continue
-                
-                # Validar que el usuario tiene acceso a la sucursal
-                if not validar_sucursal_usuario(cursor, usuario_id, cuartel_data['id_sucursal']):
-                    estadisticas["errores"].append({
-                        "fila": i + 1,
-                        "campo": "id_sucursal",
-                        "error": f"No tienes acceso a la sucursal {cuartel_data['id_sucursal']}"
-                    })
+            conn.begin()
+            
+            for linea in request.stream:
+                fila += 1
+                if fila <= ya_confirmadas:
                     continue
                 
-                # Crear cuartel
-                cursor.execute("""
-                    INSERT INTO general_dim_cuartel (
-                        nombre, id_sucursal, superficie, id_variedad, ano_plantacion,
-                        dsh, deh, n_hileras, id_estado, fecha_creacion
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-                """, (
-                    cuartel_data['nombre'],
-                    cuartel_data['id_sucursal'],
-                    cuartel_data['superficie'],
-                    cuartel_data.get('id_variedad'),
-                    cuartel_data.get('ano_plantacion'),
-                    cuartel_data.get('dsh'),
-                    cuartel_data.get('deh'),
-                    cuartel_data['n_hileras'],
-                    1  # id_estado activo
-                ))
-                
-                cuartel_id = cursor.lastrowid
-                estadisticas["cuarteles_creados"] += 1
-                
-                # Generar hileras automáticamente según n_hileras
-                n_hileras = cuartel_data['n_hileras']
-                for j in range(1, n_hileras + 1):
-                    # Crear hilera con numeración automática
-                    cursor.execute("""
-                        INSERT INTO general_dim_hilera (
-                            hilera, id_cuartel, id_estado, fecha_creacion
-                        ) VALUES (%s, %s, %s, NOW())
-                    """, (
-                        f"Hilera {j}",  # Hilera 1, Hilera 2, Hilera 3, etc.
-                        cuartel_id,
-                        1  # id_estado activo
-                    ))
-                    
-                    hilera_id = cursor.lastrowid
-                    estadisticas["hileras_creadas"] += 1
+                linea = linea.strip()
+                if linea:
+                    try:
+                        cuartel_data = json.loads(linea)
+                    except ValueError:
+                        cuartel_data = None
                     
-                    # Si se especifican plantas para esta hilera, crearlas
-                    if 'hileras' in cuartel_data and cuartel_data['hileras']:
-                        # Buscar la hilera correspondiente en los datos
-                        hilera_config = next((h for h in cuartel_data['hileras'] if h.get('hilera') == f"Hilera {j}"), None)
-                        
-                        if hilera_config and 'plantas' in hilera_config:
-                            plantas_creadas_en_hilera = set()
-                            
-                            for k, planta_data in enumerate(hilera_config['plantas']):
-                                if 'planta' not in planta_data:
-                                    estadisticas["errores"].append({
-                                        "fila": f"{i + 1}.{j}.{k + 1}",
-                                        "campo": "planta",
-                                        "error": "Campo requerido: planta"
-                                    })
-                                    continue
-                                
-                                # Validar coordenadas GPS si se proporcionan
-                                if 'ubicacion' in planta_data:
-                                    if not validar_coordenadas_gps(planta_data['ubicacion']):
-                                        estadisticas["warnings"].append({
-                                            "fila": f"{i + 1}.{j}.{k + 1}",
-                                            "campo": "ubicacion",
-                                            "warning": f"Formato de coordenadas inválido: {planta_data['ubicacion']}"
-                                        })
-                                        planta_data['ubicacion'] = None
-                                
-                                # Verificar duplicados en la hilera
-                                if planta_data['planta'] in plantas_creadas_en_hilera:
-                                    estadisticas["warnings"].append({
-                                        "fila": f"{i + 1}.{j}.{k + 1}",
-                                        "campo": "planta",
-                                        "warning": f"Planta duplicada en Hilera {j}: Planta {planta_data['planta']}"
-                                    })
-                                    continue
-                                
-                                # Crear planta
-                                cursor.execute("""
-                                    INSERT INTO general_dim_planta (
-                                        planta, id_hilera, ubicacion, id_estado, fecha_creacion
-                                    ) VALUES (%s, %s, %s, %s, NOW())
-                                """, (
-                                    planta_data['planta'],
-                                    hilera_id,
-                                    planta_data.get('ubicacion'),
-                                    1  # id_estado activo
-                                ))
-                                
-                                plantas_creadas_en_hilera.add(planta_data['planta'])
-                                estadisticas["plantas_creadas"] += 1
+                    if isinstance(cuartel_data, dict):
+                        procesar_cuartel_en_savepoint(cursor, usuario_id, fila, cuartel_data, estadisticas)
+                    else:
+                        estadisticas["errores"].append({
+                            "fila": fila,
+                            "error": "La línea no es un objeto JSON válido"
+                        })
+                    acotar_reporte(estadisticas)
+                
+                # Commit del lote junto con el progreso
+                pendientes += 1
+                if pendientes >= lote:
+                    actualizar_job(cursor, token, filas_confirmadas=fila, resultado=estadisticas)
+                    conn.commit()
+                    conn.begin()
+                    pendientes = 0
             
-            # Commit de la transacción
+            actualizar_job(cursor, token, estado='completado', filas_confirmadas=max(fila, ya_confirmadas), resultado=estadisticas)
             conn.commit()
             
             return jsonify({
                 "success": True,
                 "message": "Carga masiva de cuarteles completada exitosamente",
+                "token": token,
+                "filas_confirmadas": max(fila, ya_confirmadas),
                 "data": estadisticas
             }), 201
             
         except Exception as e:
-            # Rollback en caso de error
+            # Solo se pierde el lote en curso; los anteriores quedan confirmados
             conn.rollback()
-            logger.error(f"Error en carga masiva de cuarteles: {str(e)}")
+            logger.error(f"Error en carga NDJSON {token} cerca de la línea {fila}: {str(e)}")
+            
+            filas_confirmadas = None
+            try:
+                job = obtener_job(cursor, token)
+                filas_confirmadas = job['filas_confirmadas'] if job else None
+                actualizar_job(cursor, token, estado='interrumpido')
+                conn.commit()
+            except Exception as e_job:
+                logger.error(f"No se pudo marcar la carga {token} como interrumpida: {str(e_job)}")
+            
             return jsonify({
                 "success": False,
-                "message": "Error en la carga masiva",
+                "message": "Carga interrumpida; reenviar el archivo con ?token= para continuar",
+                "token": token,
+                "filas_confirmadas": filas_confirmadas,
                 "error": str(e)
             }), 500
         
@@ -854,11 +1226,123 @@ def carga_masiva_cuarteles():
             conn.close()
         
     except Exception as e:
-        logger.error(f"Error en carga masiva de cuarteles: {str(e)}")
+        logger.error(f"Error en carga NDJSON de cuarteles: {str(e)}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
+def procesar_registros_carga(cursor, usuario_id, registros_data, estadisticas, numeros_fila=None):
+    """
+    Valida e inserta un lote de registros de mapeo en dos fases:
+    1. Valida todos los id_planta e id_tipoplanta con una consulta IN (...) cada uno.
+    2. Arma el reporte por fila en memoria e inserta las filas válidas por lotes.
+    `numeros_fila` permite reportar la fila del archivo de origen (default 1..n).
+    """
+    campos_requeridos = ['id_planta', 'id_tipoplanta']
+    if numeros_fila is None:
+        numeros_fila = range(1, len(registros_data) + 1)
+    
+    # Fase 1: validar plantas y tipos de planta de todo el lote
+    completos = [r for r in registros_data if all(r.get(campo) not in (None, '') for campo in campos_requeridos)]
+    plantas_validas = plantas_accesibles(cursor, [r['id_planta'] for r in completos], usuario_id)
+    tipos_validos = tipos_planta_validos(cursor, [r['id_tipoplanta'] for r in completos], usuario_id)
+    
+    # Fase 2: reporte por fila y filas a insertar
+    filas = []
+    for fila, registro_data in zip(numeros_fila, registros_data):
+        # Validar datos del registro
+        faltantes = [campo for campo in campos_requeridos if registro_data.get(campo) in (None, '')]
+        for campo in faltantes:
+            estadisticas["errores"].append({
+                "fila": fila,
+                "campo": campo,
+                "error": f"Campo requerido: {campo}"
+            })
+        if faltantes:
+            continue
+        
+        # Validar que la planta existe y el usuario tiene acceso
+        if clave_id(registro_data['id_planta']) not in plantas_validas:
+            estadisticas["errores"].append({
+                "fila": fila,
+                "campo": "id_planta",
+                "error": f"Planta con ID {registro_data['id_planta']} no existe o no tienes acceso"
+            })
+            continue
+        
+        # Validar que el tipo de planta existe
+        if clave_id(registro_data['id_tipoplanta']) not in tipos_validos:
+            estadisticas["errores"].append({
+                "fila": fila,
+                "campo": "id_tipoplanta",
+                "error": f"Tipo de planta con ID {registro_data['id_tipoplanta']} no existe"
+            })
+            continue
+        
+        # Validar hora_registro si se proporciona (Excel la entrega ya como datetime)
+        hora_registro = registro_data.get('hora_registro')
+        if hora_registro and not isinstance(hora_registro, datetime):
+            try:
+                hora_registro = datetime.strptime(str(hora_registro), '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                estadisticas["warnings"].append({
+                    "fila": fila,
+                    "campo": "hora_registro",
+                    "warning": f"Formato de hora inválido: {registro_data['hora_registro']}. Usando hora actual."
+                })
+                hora_registro = None
+        
+        # Imagen al almacén de imágenes; en la fila solo va el hash
+        try:
+            imagen = guardar_imagen_base64(registro_data.get('imagen'))
+        except ImagenInvalidaError as e:
+            estadisticas["errores"].append({
+                "fila": fila,
+                "campo": "imagen",
+                "error": str(e)
+            })
+            continue
+        
+        filas.append((
+            str(uuid.uuid4()),
+            registro_data.get('id_evaluador') or usuario_id,
+            hora_registro or datetime.now(),
+            clave_id(registro_data['id_planta']),
+            clave_id(registro_data['id_tipoplanta']),
+            imagen
+        ))
+    
+    # Crear registros
+    resultado = insertar_en_lotes(
+        cursor, 'mapeo_fact_registro',
+        ['id', 'id_evaluador', 'hora_registro', 'id_planta', 'id_tipoplanta', 'imagen'],
+        filas, expresiones={'fecha_creacion': 'NOW()'}
+    )
+    # Las variantes salen del archivo ya guardado, no dependen del commit
+    encolar_variantes(fila_registro[5] for fila_registro in filas)
+    estadisticas["registros_creados"] = estadisticas.get("registros_creados", 0) + resultado["filas_insertadas"]
+    return resultado["filas_insertadas"]
+
+def ejecutar_carga_registros(conn, cursor, usuario_id, registros_data, progreso=None):
+    """Carga de /registros/bulk en una sola transacción (endpoint o job ?async=1)"""
+    conn.begin()
+    
+    estadisticas = {
+        "registros_creados": 0,
+        "errores": [],
+        "warnings": []
+    }
+    
+    try:
+        procesar_registros_carga(cursor, usuario_id, registros_data, estadisticas)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return estadisticas
+
 # Carga masiva de registros de mapeo
 @mapeo_bp.route('/registros/bulk', methods=['POST', 'OPTIONS'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def carga_masiva_registros():
     if request.method == 'OPTIONS':
@@ -877,96 +1361,21 @@ def carga_masiva_registros():
         if len(registros_data) > 1000:
             return jsonify({"error": "Máximo 1000 registros por carga masiva"}), 400
         
+        # Con ?async=1 se encola como job y se responde de inmediato
+        if pide_async(request.args):
+            job_id = encolar_job(usuario_id, 'carga_registros', ejecutar_carga_registros, usuario_id, registros_data, total=len(registros_data))
+            return jsonify({
+                "success": True,
+                "message": "Carga encolada",
+                "job_id": job_id,
+                "estado_url": f"/api/jobs/{job_id}"
+            }), 202
+        
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        # Iniciar transacción
-        conn.begin()
-        
-        estadisticas = {
-            "registros_creados": 0,
-            "errores": [],
-            "warnings": []
-        }
-        
         try:
-            for i, registro_data in enumerate(registros_data):
-                # Validar datos del registro
-                campos_requeridos = ['id_planta', 'id_tipoplanta']
-                for campo in campos_requeridos:
-                    if campo not in registro_data:
-                        estadisticas["errores"].append({
-                            "fila": i + 1,
-                            "campo": campo,
-                            "error": f"Campo requerido: {campo}"
-                        })
-                        continue
-                
-                # Validar que la planta existe y el usuario tiene acceso
-                cursor.execute("""
-                    SELECT p.id, h.id as id_hilera FROM general_dim_planta p
-                    JOIN general_dim_hilera h ON p.id_hilera = h.id
-                    JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-                    WHERE p.id = %s AND c.id_sucursal IN (
-                        SELECT DISTINCT p2.id_sucursal 
-                        FROM usuario_pivot_sucursal_usuario p2 
-                        WHERE p2.id_usuario = %s
-                    ) AND p.id_estado = 1
-                """, (registro_data['id_planta'], usuario_id))
-                
-                planta_info = cursor.fetchone()
-                if not planta_info:
-                    estadisticas["errores"].append({
-                        "fila": i + 1,
-                        "campo": "id_planta",
-                        "error": f"Planta con ID {registro_data['id_planta']} no existe o no tienes acceso"
-                    })
-                    continue
-                
-                # Validar que el tipo de planta existe
-                if not validar_tipo_planta_existe(cursor, registro_data['id_tipoplanta'], usuario_id):
-                    estadisticas["errores"].append({
-                        "fila": i + 1,
-                        "campo": "id_tipoplanta",
-                        "error": f"Tipo de planta con ID {registro_data['id_tipoplanta']} no existe"
-                    })
-                    continue
-                
-                # Validar hora_registro si se proporciona
-                hora_registro = None
-                if 'hora_registro' in registro_data:
-                    try:
-                        hora_registro = datetime.strptime(registro_data['hora_registro'], '%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        estadisticas["warnings"].append({
-                            "fila": i + 1,
-                            "campo": "hora_registro",
-                            "warning": f"Formato de hora inválido: {registro_data['hora_registro']}. Usando hora actual."
-                        })
-                        hora_registro = None
-                
-                # Generar UUID para el registro
-                registro_id = str(uuid.uuid4())
-                
-                # Crear registro
-                cursor.execute("""
-                    INSERT INTO mapeo_fact_registro (
-                        id, id_evaluador, hora_registro, id_planta, id_tipoplanta, 
-                        imagen, fecha_creacion
-                    ) VALUES (%s, %s, %s, %s, %s, %s, NOW())
-                """, (
-                    registro_id,
-                    registro_data.get('id_evaluador', usuario_id),
-                    hora_registro or datetime.now(),
-                    registro_data['id_planta'],
-                    registro_data['id_tipoplanta'],
-                    registro_data.get('imagen')
-                ))
-                
-                estadisticas["registros_creados"] += 1
-            
-            # Commit de la transacción
-            conn.commit()
+            estadisticas = ejecutar_carga_registros(conn, cursor, usuario_id, registros_data)
             
             return jsonify({
                 "success": True,
@@ -992,10 +1401,51 @@ def carga_masiva_registros():
         logger.error(f"Error en carga masiva de registros: {str(e)}")
         return jsonify({"error": "Error interno del servidor"}), 500
 
+def importar_cuarteles(conn, cursor, usuario_id, filas, estadisticas):
+    """Procesa la hoja de cuarteles de a un cuartel, con commit cada CARGA_STREAM_LOTE cuarteles"""
+    pendientes = 0
+    for numero_fila, cuartel_data, errores in cuarteles_desde_filas(filas):
+        estadisticas["errores"].extend(errores)
+        if cuartel_data is not None:
+            procesar_cuartel_en_savepoint(cursor, usuario_id, numero_fila, cuartel_data, estadisticas)
+        acotar_reporte(estadisticas)
+        
+        pendientes += 1
+        if pendientes >= Config.CARGA_STREAM_LOTE:
+            conn.commit()
+            pendientes = 0
+    conn.commit()
+
+def importar_registros(conn, cursor, usuario_id, filas, estadisticas):
+    """Procesa la hoja de registros en lotes de CARGA_STREAM_LOTE filas (validación por conjuntos + INSERT por lotes)"""
+    lote = []
+    numeros = []
+    for numero_fila, registro_data in filas:
+        lote.append(registro_data)
+        numeros.append(numero_fila)
+        if len(lote) >= Config.CARGA_STREAM_LOTE:
+            procesar_registros_carga(cursor, usuario_id, lote, estadisticas, numeros)
+            acotar_reporte(estadisticas)
+            conn.commit()
+            lote, numeros = [], []
+    if lote:
+        procesar_registros_carga(cursor, usuario_id, lote, estadisticas, numeros)
+        acotar_reporte(estadisticas)
+    conn.commit()
+
 # Importar desde Excel/CSV
 @mapeo_bp.route('/import/excel', methods=['POST', 'OPTIONS'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def importar_excel():
+    """
+    Importa la plantilla de carga masiva (.xlsx o .csv) leyéndola en streaming.
+    - plantas: hoja de cuarteles (cuarteles con hileras y plantas)
+    - registros: hoja de registros de mapeo
+    - completo: ambas hojas de la plantilla completa (.xlsx)
+    Aplica las mismas validaciones que /cuarteles/bulk y /registros/bulk y
+    confirma cada CARGA_STREAM_LOTE filas.
+    """
     if request.method == 'OPTIONS':
         return '', 200
     
@@ -1018,19 +1468,71 @@ def importar_excel():
         if tipo_importacion not in ['plantas', 'registros', 'completo']:
             return jsonify({"error": "Tipo de importación inválido. Valores válidos: plantas, registros, completo"}), 400
         
-        # Aquí implementarías la lógica para procesar el archivo Excel/CSV
-        # Por ahora retornamos un mensaje de que la funcionalidad está en desarrollo
+        if tipo_importacion == 'completo' and file.filename.lower().endswith('.csv'):
+            return jsonify({"error": "La importación completa requiere la plantilla .xlsx (un CSV tiene una sola hoja)"}), 400
         
-        return jsonify({
-            "success": True,
-            "message": "Importación desde Excel/CSV en desarrollo",
-            "data": {
-                "archivo": file.filename,
-                "tipo_importacion": tipo_importacion,
-                "tamaño": len(file.read()),
-                "nota": "Esta funcionalidad requiere implementación adicional con pandas/openpyxl"
+        estadisticas = {
+            "cuarteles_creados": 0,
+            "hileras_creadas": 0,
+            "plantas_creadas": 0,
+            "registros_creados": 0,
+            "errores": [],
+            "warnings": []
+        }
+        inicio = time.monotonic()
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        try:
+            with LectorPlanilla(file.stream, file.filename) as lector:
+                if tipo_importacion == 'completo':
+                    for tipo in ('cuarteles', 'registros'):
+                        if not lector.tiene_hoja(tipo):
+                            raise ArchivoInvalidoError(f"Falta la hoja de {tipo} de la plantilla completa")
+                
+                if tipo_importacion in ('plantas', 'completo'):
+                    importar_cuarteles(conn, cursor, usuario_id, lector.filas('cuarteles', COLUMNAS_CUARTELES), estadisticas)
+                if tipo_importacion in ('registros', 'completo'):
+                    importar_registros(conn, cursor, usuario_id, lector.filas('registros', COLUMNAS_REGISTROS), estadisticas)
+                
+                filas_leidas = lector.filas_leidas
+            
+            segundos = time.monotonic() - inicio
+            estadisticas["rendimiento"] = {
+                "filas_leidas": filas_leidas,
+                "segundos": round(segundos, 2),
+                "filas_por_segundo": round(filas_leidas / segundos, 1) if segundos > 0 else None
             }
-        }), 200
+            logger.info(f"Importación {tipo_importacion} de {file.filename}: {filas_leidas} filas en {segundos:.1f}s")
+            
+            return jsonify({
+                "success": True,
+                "message": "Importación completada",
+                "data": {
+                    "archivo": file.filename,
+                    "tipo_importacion": tipo_importacion,
+                    **estadisticas
+                }
+            }), 201
+            
+        except ArchivoInvalidoError as e:
+            conn.rollback()
+            return jsonify({"error": str(e)}), 400
+        
+        except Exception as e:
+            # Los lotes ya confirmados se mantienen; solo se revierte el lote en curso
+            conn.rollback()
+            logger.error(f"Error importando {file.filename}: {str(e)}")
+            return jsonify({
+                "success": False,
+                "message": "Error en la importación; los lotes anteriores quedaron guardados",
+                "error": str(e)
+            }), 500
+        
+        finally:
+            cursor.close()
+            conn.close()
         
     except Exception as e:
         logger.error(f"Error en importación Excel: {str(e)}")
@@ -1066,17 +1568,14 @@ def agregar_hileras_cuartel(cuartel_id):
         
         try:
             # Verificar que el usuario tenga acceso al cuartel
-            cursor.execute("""
+            filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+            cursor.execute(f"""
                 SELECT c.*, COUNT(h.id) as hileras_actuales
                 FROM general_dim_cuartel c
                 LEFT JOIN general_dim_hilera h ON c.id = h.id_cuartel AND h.id_estado = 1
-                WHERE c.id = %s AND c.id_sucursal IN (
-                    SELECT DISTINCT p.id_sucursal 
-                    FROM usuario_pivot_sucursal_usuario p 
-                    WHERE p.id_usuario = %s
-                ) AND c.id_estado = 1
+                WHERE c.id = %s AND {filtro_suc} AND c.id_estado = 1
                 GROUP BY c.id
-            """, (cuartel_id, usuario_id))
+            """, (cuartel_id, *params_suc))
             
             cuartel_info = cursor.fetchone()
             if not cuartel_info:
@@ -1087,35 +1586,23 @@ def agregar_hileras_cuartel(cuartel_id):
             # Obtener el siguiente número de hilera
             siguiente_numero = cuartel_info['hileras_actuales'] + 1
             
-            hileras_creadas = []
+            # Bloquear el cuartel antes de crear las hileras (utils/conteo_hileras.py)
+            hileras_previas = bloquear_cuartel(cursor, cuartel_id)
             
             # Crear las nuevas hileras
-            for i in range(cantidad):
-                numero_hilera = siguiente_numero + i
-                
-                cursor.execute("""
-                    INSERT INTO general_dim_hilera (
-                        hilera, id_cuartel, id_estado, fecha_creacion
-                    ) VALUES (%s, %s, %s, NOW())
-                """, (
-                    f"Hilera {numero_hilera}",
-                    cuartel_id,
-                    1  # id_estado activo
-                ))
-                
-                hilera_id = cursor.lastrowid
-                hileras_creadas.append({
-                    "id": hilera_id,
-                    "hilera": f"Hilera {numero_hilera}"
-                })
+            nombres = [f"Hilera {siguiente_numero + i}" for i in range(cantidad)]
+            resultado = insertar_en_lotes(
+                cursor, 'general_dim_hilera', ['hilera', 'id_cuartel', 'id_estado'],
+                ((nombre, cuartel_id, 1) for nombre in nombres),  # id_estado activo
+                expresiones={'fecha_creacion': 'NOW()'}
+            )
+            hileras_creadas = [
+                {"id": hilera_id, "hilera": nombre}
+                for hilera_id, nombre in zip(ids_insertados(resultado), nombres)
+            ]
             
             # Actualizar el número de hileras en el cuartel
-            nuevo_total = cuartel_info['hileras_actuales'] + cantidad
-            cursor.execute("""
-                UPDATE general_dim_cuartel 
-                SET n_hileras = %s 
-                WHERE id = %s
-            """, (nuevo_total, cuartel_id))
+            nuevo_total = sumar_hileras(cursor, cuartel_id, cantidad, hileras_previas)
             
             # Commit de la transacción
             conn.commit()
@@ -1166,16 +1653,13 @@ def eliminar_hilera_cascada(hilera_id):
         
         try:
             # Verificar que el usuario tenga acceso a la hilera
-            cursor.execute("""
-                SELECT h.*, c.nombre as cuartel_nombre, c.n_hileras
+            filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+            cursor.execute(f"""
+                SELECT h.*, c.nombre as cuartel_nombre
                 FROM general_dim_hilera h
                 JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-                WHERE h.id = %s AND c.id_sucursal IN (
-                    SELECT DISTINCT p.id_sucursal 
-                    FROM usuario_pivot_sucursal_usuario p 
-                    WHERE p.id_usuario = %s
-                ) AND h.id_estado = 1
-            """, (hilera_id, usuario_id))
+                WHERE h.id = %s AND {filtro_suc} AND h.id_estado = 1
+            """, (hilera_id, *params_suc))
             
             hilera_info = cursor.fetchone()
             if not hilera_info:
@@ -1192,27 +1676,26 @@ def eliminar_hilera_cascada(hilera_id):
             
             plantas_count = cursor.fetchone()['total_plantas']
             
+            # Bloquear el cuartel antes de tocar la hilera (utils/conteo_hileras.py)
+            bloquear_cuartel(cursor, hilera_info['id_cuartel'])
+            
             # Eliminar plantas asociadas (soft delete)
             cursor.execute("""
                 UPDATE general_dim_planta 
                 SET id_estado = 0, fecha_baja = NOW()
                 WHERE id_hilera = %s AND id_estado = 1
             """, (hilera_id,))
+            sumar_plantas(cursor, {hilera_id: -cursor.rowcount})
             
             # Eliminar la hilera (soft delete)
             cursor.execute("""
                 UPDATE general_dim_hilera 
                 SET id_estado = 0, fecha_baja = NOW()
-                WHERE id = %s
+                WHERE id = %s AND id_estado = 1
             """, (hilera_id,))
             
             # Actualizar el número de hileras en el cuartel
-            nuevo_total = hilera_info['n_hileras'] - 1
-            cursor.execute("""
-                UPDATE general_dim_cuartel 
-                SET n_hileras = %s 
-                WHERE id = %s
-            """, (nuevo_total, hilera_info['id_cuartel']))
+            nuevo_total = sumar_hileras(cursor, hilera_info['id_cuartel'], -cursor.rowcount)
             
             # Commit de la transacción
             conn.commit()
@@ -1271,14 +1754,11 @@ def actualizar_estado_catastro(cuartel_id):
         
         try:
             # Verificar que el usuario tenga acceso al cuartel
-            cursor.execute("""
+            filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+            cursor.execute(f"""
                 SELECT 1 FROM general_dim_cuartel c
-                WHERE c.id = %s AND c.id_sucursal IN (
-                    SELECT DISTINCT p.id_sucursal 
-                    FROM usuario_pivot_sucursal_usuario p 
-                    WHERE p.id_usuario = %s
-                ) AND c.id_estado = 1
-            """, (cuartel_id, usuario_id))
+                WHERE c.id = %s AND {filtro_suc} AND c.id_estado = 1
+            """, (cuartel_id, *params_suc))
             
             if not cursor.fetchone():
                 cursor.close()
@@ -1321,6 +1801,7 @@ def actualizar_estado_catastro(cuartel_id):
         return jsonify({"error": "Error interno del servidor"}), 500
 
 @mapeo_bp.route('/plantillas/<tipo>', methods=['GET'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def descargar_plantilla_excel(tipo):
     """
@@ -1328,34 +1809,22 @@ def descargar_plantilla_excel(tipo):
     """
     try:
         # Validar tipo de plantilla
-        tipos_validos = ['cuarteles', 'registros', 'completo']
-        if tipo not in tipos_validos:
+        if tipo not in TIPOS_PLANTILLA:
             return jsonify({
                 'success': False,
-                'message': f'Tipo de plantilla inválido. Tipos válidos: {", ".join(tipos_validos)}'
+                'message': f'Tipo de plantilla inválido. Tipos válidos: {", ".join(TIPOS_PLANTILLA)}'
             }), 400
         
-        # Crear workbook
-        wb = Workbook()
+        # Plantilla generada al iniciar la app; con If-None-Match vigente responde 304
+        contenido, etag = plantilla_estatica(tipo)
         
-        if tipo == 'cuarteles':
-            crear_plantilla_cuarteles(wb)
-        elif tipo == 'registros':
-            crear_plantilla_registros(wb)
-        elif tipo == 'completo':
-            crear_plantilla_completa(wb)
-        
-        # Guardar archivo temporal
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-        wb.save(temp_file.name)
-        temp_file.close()
-        
-        # Enviar archivo
         return send_file(
-            temp_file.name,
+            BytesIO(contenido),
             as_attachment=True,
             download_name=f'plantilla_carga_masiva_{tipo}.xlsx',
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            mimetype=MIMETYPE_XLSX,
+            etag=etag,
+            conditional=True
         )
         
     except Exception as e:
@@ -1364,227 +1833,3 @@ def descargar_plantilla_excel(tipo):
             'success': False,
             'message': 'Error generando plantilla Excel'
         }), 500
-
-def crear_plantilla_cuarteles(wb):
-    """Crear plantilla para carga masiva de cuarteles"""
-    ws = wb.active
-    ws.title = "Carga Masiva Cuarteles"
-    
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Headers principales
-    headers_principales = [
-        'A1:Cuartel', 'B1:Nombre', 'C1:ID Sucursal', 'D1:Superficie', 
-        'E1:Número de Hileras', 'F1:ID Variedad', 'G1:Año Plantación', 
-        'H1:DSH', 'I1:DEH'
-    ]
-    
-    for header in headers_principales:
-        cell = ws[header.split(':')[0]]
-        cell.value = header.split(':')[1]
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Headers de hileras y plantas
-    headers_hileras = [
-        'J1:Hilera', 'K1:Planta', 'L1:Ubicación GPS'
-    ]
-    
-    for header in headers_hileras:
-        cell = ws[header.split(':')[0]]
-        cell.value = header.split(':')[1]
-        cell.font = header_font
-        cell.fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Ejemplos de datos
-    ejemplos = [
-        ['Cuartel A', 'Cuartel Principal', 1, 15.5, 10, 1, 2020, 3.5, 1.2, 'Hilera 1', 'Planta 1', '-33.123, -70.456'],
-        ['', '', '', '', '', '', '', '', '', 'Hilera 1', 'Planta 2', '-33.124, -70.457'],
-        ['', '', '', '', '', '', '', '', '', 'Hilera 2', 'Planta 1', '-33.125, -70.458'],
-        ['Cuartel B', 'Cuartel Secundario', 1, 12.0, 8, 2, 2019, 3.0, 1.0, 'Hilera 1', 'Planta 1', '-33.126, -70.459']
-    ]
-    
-    for row_idx, ejemplo in enumerate(ejemplos, start=2):
-        for col_idx, valor in enumerate(ejemplo, start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=valor)
-            cell.border = border
-    
-    # Ajustar ancho de columnas
-    column_widths = [15, 20, 12, 12, 18, 12, 15, 8, 8, 12, 12, 20]
-    for i, width in enumerate(column_widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = width
-    
-    # Agregar hoja de instrucciones
-    ws_instrucciones = wb.create_sheet("Instrucciones")
-    instrucciones = [
-        ["INSTRUCCIONES PARA CARGA MASIVA DE CUARTELES"],
-        [""],
-        ["1. DATOS DEL CUARTEL:"],
-        ["   - Nombre: Nombre del cuartel (requerido)"],
-        ["   - ID Sucursal: ID de la sucursal (requerido)"],
-        ["   - Superficie: Superficie en hectáreas (requerido)"],
-        ["   - Número de Hileras: Cantidad de hileras a generar automáticamente (requerido)"],
-        ["   - ID Variedad: ID de la variedad (opcional)"],
-        ["   - Año Plantación: Año de plantación (opcional)"],
-        ["   - DSH: Distancia entre hileras (opcional)"],
-        ["   - DEH: Distancia entre plantas (opcional)"],
-        [""],
-        ["2. DATOS DE HILERAS Y PLANTAS (OPCIONAL):"],
-        ["   - Hilera: Nombre de la hilera (ej: 'Hilera 1', 'Hilera 2')"],
-        ["   - Planta: Nombre de la planta (ej: 'Planta 1', 'Planta 2')"],
-        ["   - Ubicación GPS: Coordenadas en formato 'lat, lng' (opcional)"],
-        [""],
-        ["3. REGLAS:"],
-        ["   - Las hileras se generan automáticamente según 'Número de Hileras'"],
-        ["   - Si especificas plantas, deben corresponder a hileras existentes"],
-        ["   - Las coordenadas GPS deben estar en formato 'lat, lng'"],
-        ["   - No se permiten plantas duplicadas en la misma hilera"],
-        [""],
-        ["4. EJEMPLO:"],
-        ["   - Cuartel con 10 hileras: Se generan automáticamente Hilera 1 a Hilera 10"],
-        ["   - Si especificas plantas para 'Hilera 1', se crearán en esa hilera"],
-        ["   - Si no especificas plantas, solo se crean las hileras vacías"]
-    ]
-    
-    for row_idx, instruccion in enumerate(instrucciones, start=1):
-        cell = ws_instrucciones.cell(row=row_idx, column=1, value=instruccion[0])
-        if row_idx == 1:
-            cell.font = Font(bold=True, size=14)
-        elif ":" in instruccion[0]:
-            cell.font = Font(bold=True)
-    
-    ws_instrucciones.column_dimensions['A'].width = 80
-
-def crear_plantilla_registros(wb):
-    """Crear plantilla para carga masiva de registros"""
-    ws = wb.active
-    ws.title = "Carga Masiva Registros"
-    
-    # Estilos
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
-    border = Border(
-        left=Side(style='thin'),
-        right=Side(style='thin'),
-        top=Side(style='thin'),
-        bottom=Side(style='thin')
-    )
-    
-    # Headers
-    headers = [
-        'A1:ID Planta', 'B1:ID Tipo Planta', 'C1:ID Evaluador', 
-        'D1:Hora Registro', 'E1:Imagen (Base64)'
-    ]
-    
-    for header in headers:
-        cell = ws[header.split(':')[0]]
-        cell.value = header.split(':')[1]
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-    
-    # Ejemplos
-    ejemplos = [
-        [123, 'uuid-tipo-planta-1', 'user123', '2024-01-15 10:30:00', ''],
-        [124, 'uuid-tipo-planta-2', 'user456', '2024-01-15 10:35:00', ''],
-        [125, 'uuid-tipo-planta-1', 'user123', '2024-01-15 10:40:00', '']
-    ]
-    
-    for row_idx, ejemplo in enumerate(ejemplos, start=2):
-        for col_idx, valor in enumerate(ejemplo, start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=valor)
-            cell.border = border
-    
-    # Ajustar ancho de columnas
-    column_widths = [12, 25, 15, 20, 50]
-    for i, width in enumerate(column_widths, start=1):
-        ws.column_dimensions[get_column_letter(i)].width = width
-    
-    # Agregar hoja de instrucciones
-    ws_instrucciones = wb.create_sheet("Instrucciones")
-    instrucciones = [
-        ["INSTRUCCIONES PARA CARGA MASIVA DE REGISTROS"],
-        [""],
-        ["1. DATOS REQUERIDOS:"],
-        ["   - ID Planta: ID numérico de la planta (requerido)"],
-        ["   - ID Tipo Planta: UUID del tipo de planta (requerido)"],
-        [""],
-        ["2. DATOS OPCIONALES:"],
-        ["   - ID Evaluador: ID del evaluador"],
-        ["   - Hora Registro: Fecha y hora en formato 'YYYY-MM-DD HH:MM:SS'"],
-        ["   - Imagen: Datos de imagen en formato Base64"],
-        [""],
-        ["3. REGLAS:"],
-        ["   - La planta debe existir en el sistema"],
-        ["   - El tipo de planta debe ser válido"],
-        ["   - La fecha debe estar en formato correcto"],
-        ["   - La imagen es opcional"]
-    ]
-    
-    for row_idx, instruccion in enumerate(instrucciones, start=1):
-        cell = ws_instrucciones.cell(row=row_idx, column=1, value=instruccion[0])
-        if row_idx == 1:
-            cell.font = Font(bold=True, size=14)
-        elif ":" in instruccion[0]:
-            cell.font = Font(bold=True)
-    
-    ws_instrucciones.column_dimensions['A'].width = 80
-
-def crear_plantilla_completa(wb):
-    """Crear plantilla completa con todas las opciones"""
-    # Crear hojas para cada tipo
-    crear_plantilla_cuarteles(wb)
-    crear_plantilla_registros(wb)
-    
-    # Renombrar hojas
-    wb['Carga Masiva Cuarteles'].title = "Cuarteles"
-    wb['Carga Masiva Registros'].title = "Registros"
-    
-    # Agregar hoja de índice
-    ws_indice = wb.create_sheet("Índice", 0)
-    ws_indice.title = "Índice"
-    
-    # Contenido del índice
-    contenido_indice = [
-        ["PLANTILLA COMPLETA - CARGA MASIVA"],
-        [""],
-        ["Esta plantilla contiene:"],
-        ["1. Hoja 'Cuarteles': Para carga masiva de cuarteles con hileras y plantas"],
-        ["2. Hoja 'Registros': Para carga masiva de registros de mapeo"],
-        ["3. Hoja 'Instrucciones': Instrucciones detalladas para cada tipo"],
-        [""],
-        ["INSTRUCCIONES GENERALES:"],
-        ["- Cada hoja tiene su propia estructura y validaciones"],
-        ["- Sigue las instrucciones específicas de cada hoja"],
-        ["- Los campos requeridos están marcados en las instrucciones"],
-        ["- Ejemplos de datos están incluidos en cada hoja"],
-        ["- No modifiques la estructura de las columnas"],
-        [""],
-        ["FORMATOS ACEPTADOS:"],
-        ["- Fechas: YYYY-MM-DD HH:MM:SS"],
-        ["- Coordenadas GPS: 'lat, lng' (ej: '-33.123, -70.456')"],
-        ["- Imágenes: Base64 (opcional)"],
-        ["- UUIDs: Formato estándar UUID"]
-    ]
-    
-    for row_idx, contenido in enumerate(contenido_indice, start=1):
-        cell = ws_indice.cell(row=row_idx, column=1, value=contenido[0])
-        if row_idx == 1:
-            cell.font = Font(bold=True, size=16)
-        elif row_idx in [4, 5, 8, 13]:
-            cell.font = Font(bold=True)
-    
-    ws_indice.column_dimensions['A'].width = 80
@@ -1,38 +1,39 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.db import get_db_connection
+from utils.catalogos import obtener_catalogo, respuesta_catalogo, version_catalogo
+from utils.cache_http import version_previa
 #from blueprints.auth import token_requerido
 import uuid
 
 opciones_bp = Blueprint('opciones_bp', __name__)
 
-# Endpoint raíz para el blueprint
+def _cargar_opciones(cursor):
+    cursor.execute("SELECT id, nombre FROM general_dim_labor ORDER BY nombre ASC")
+    labores = cursor.fetchall() or []
+
+    cursor.execute("SELECT id, nombre FROM tarja_dim_unidad WHERE id_estado = 1 ORDER BY nombre ASC")
+    unidades = cursor.fetchall() or []
+
+    cursor.execute("SELECT id, nombre FROM general_dim_cecotipo ORDER BY nombre ASC")
+    tipoCecos = cursor.fetchall() or []
+
+    return {
+        "labores": labores,
+        "unidades": unidades,
+        "tipoCecos": tipoCecos
+    }
+
+# Endpoint raíz para el blueprint (labores, unidades y tipos de ceco desde el cache de catálogos)
 @opciones_bp.route('/', methods=['GET', 'OPTIONS'])
 @jwt_required()
+@version_previa(lambda: version_catalogo(obtener_catalogo('opciones', _cargar_opciones)))
 def opciones_root():
     if request.method == 'OPTIONS':
         return '', 200
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        cursor.execute("SELECT id, nombre FROM general_dim_labor ORDER BY nombre ASC")
-        labores = cursor.fetchall() or []
-
-        cursor.execute("SELECT id, nombre FROM tarja_dim_unidad WHERE id_estado = 1 ORDER BY nombre ASC")
-        unidades = cursor.fetchall() or []
-
-        cursor.execute("SELECT id, nombre FROM general_dim_cecotipo ORDER BY nombre ASC")
-        tipoCecos = cursor.fetchall() or []
-
-        cursor.close()
-        conn.close()
-
-        return jsonify({
-            "labores": labores,
-            "unidades": unidades,
-            "tipoCecos": tipoCecos
-        }), 200
+        catalogo = obtener_catalogo('opciones', _cargar_opciones)
+        return respuesta_catalogo(catalogo, catalogo.datos)
     except Exception as e:
         return jsonify({
             "labores": [],
@@ -1,11 +1,79 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.db import get_db_connection
+from utils.acceso import sucursales_permitidas, filtro_sucursales
+from utils.bulk import insertar_en_lotes, ids_insertados
+from utils.conteo_plantas import sumar_plantas
+from utils.paginacion import ParametroInvalidoError, PaginaKeyset, parametro_limit, proyeccion, condicion_keyset
+from utils.streaming import respuesta_streaming, formato_respuesta, filas_cursor
+from utils.servidor import clase_ruta, RUTA_LARGA
 import logging
 
 plantas_bp = Blueprint('plantas_bp', __name__)
 logger = logging.getLogger(__name__)
 
+# Campos disponibles en `fields=` (campo -> expresión SQL)
+CAMPOS_PLANTA = {
+    'id': 'p.id',
+    'planta': 'p.planta',
+    'id_hilera': 'p.id_hilera',
+    'ubicacion': 'p.ubicacion',
+    'fecha_creacion': 'p.fecha_creacion',
+    'id_estado': 'p.id_estado',
+    'hilera': 'h.hilera',
+    'cuartel_nombre': 'c.nombre',
+    'id_ceco': 'c.id_ceco'
+}
+
+# Orden de las páginas (keyset): cuartel, hilera, planta e id para desempatar
+ORDEN_PLANTAS = ['cuartel_nombre', 'hilera', 'planta', 'id']
+
+
+def pagina_plantas(cursor, usuario_id, args, filtros="", valores_filtros=()):
+    """
+    Página de plantas activas de las sucursales del usuario.
+    Lee `limit`, `cursor` y `fields` de `args`; `filtros` son condiciones
+    extra ("AND ...") con sus valores. Sin OFFSET: la página siguiente parte
+    después de la última fila según ORDEN_PLANTAS.
+    Ejecuta la consulta y retorna un PaginaKeyset que lee el cursor al iterarlo.
+    """
+    limit = parametro_limit(args)
+    campos = proyeccion(args, list(CAMPOS_PLANTA))
+    if campos is None:
+        select = "p.*, h.hilera, c.nombre as cuartel_nombre, c.id_ceco"
+    else:
+        # Las columnas de orden se leen siempre para armar next_cursor
+        columnas = campos + [campo for campo in ORDEN_PLANTAS if campo not in campos]
+        select = ", ".join(f"{CAMPOS_PLANTA[campo]} AS {campo}" for campo in columnas)
+    
+    condicion_cursor, params_cursor = condicion_keyset(
+        [CAMPOS_PLANTA[campo] for campo in ORDEN_PLANTAS], args.get('cursor')
+    )
+    
+    filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+    cursor.execute(f"""
+        SELECT {select}
+        FROM general_dim_planta p
+        JOIN general_dim_hilera h ON p.id_hilera = h.id
+        JOIN general_dim_cuartel c ON h.id_cuartel = c.id
+        WHERE {filtro_suc}
+        AND p.id_estado = 1
+        {filtros}
+        AND {condicion_cursor}
+        ORDER BY c.nombre ASC, h.hilera ASC, p.planta ASC, p.id ASC
+        LIMIT %s
+    """, (*params_suc, *valores_filtros, *params_cursor, limit + 1))
+    
+    return PaginaKeyset(filas_cursor(cursor), limit, ORDEN_PLANTAS, campos)
+
+
+def respuesta_plantas(conn, cursor, pagina_actual):
+    """{"plantas": [...], "next_cursor", "limit"} serializado en streaming"""
+    return respuesta_streaming(
+        conn, cursor, formato_respuesta(request), filas=pagina_actual, clave='plantas',
+        cierre=lambda: {"next_cursor": pagina_actual.next_cursor, "limit": pagina_actual.limit}
+    )
+
 # Obtener todas las plantas del usuario logueado
 @plantas_bp.route('/', methods=['GET', 'OPTIONS'])
 @jwt_required()
@@ -18,27 +86,12 @@ def obtener_plantas():
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
-        # Obtener plantas de cuarteles accesibles al usuario
-        cursor.execute("""
-            SELECT p.*, h.hilera, c.nombre as cuartel_nombre, c.id_ceco
-            FROM general_dim_planta p
-            JOIN general_dim_hilera h ON p.id_hilera = h.id
-            JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-            AND p.id_estado = 1
-            ORDER BY c.nombre ASC, h.hilera ASC, p.planta ASC
-        """, (usuario_id,))
-        
-        plantas = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return jsonify(plantas), 200
+        # Obtener plantas de cuarteles accesibles al usuario (paginadas, en streaming)
+        pagina_actual = pagina_plantas(cursor, usuario_id, request.args)
+        return respuesta_plantas(conn, cursor, pagina_actual)
         
+    except ParametroInvalidoError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error obteniendo plantas: {str(e)}")
         return jsonify({"error": "Error interno del servidor"}), 500
@@ -56,17 +109,14 @@ def obtener_planta(planta_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la planta
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT p.*, h.hilera, c.nombre as cuartel_nombre, c.id_ceco
             FROM general_dim_planta p
             JOIN general_dim_hilera h ON p.id_hilera = h.id
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE p.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-        """, (planta_id, usuario_id))
+            WHERE p.id = %s AND {filtro_suc}
+        """, (planta_id, *params_suc))
         
         planta = cursor.fetchone()
         cursor.close()
@@ -102,15 +152,12 @@ def crear_planta():
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM general_dim_hilera h
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (data['id_hilera'], usuario_id))
+            WHERE h.id = %s AND {filtro_suc}
+        """, (data['id_hilera'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -140,6 +187,7 @@ def crear_planta():
         ))
         
         planta_id = cursor.lastrowid
+        sumar_plantas(cursor, {data['id_hilera']: 1})
         conn.commit()
         cursor.close()
         conn.close()
@@ -168,16 +216,13 @@ def actualizar_planta(planta_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la planta
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT p.*, h.id as hilera_id FROM general_dim_planta p
             JOIN general_dim_hilera h ON p.id_hilera = h.id
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE p.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-        """, (planta_id, usuario_id))
+            WHERE p.id = %s AND {filtro_suc}
+        """, (planta_id, *params_suc))
         
         planta_actual = cursor.fetchone()
         if not planta_actual:
@@ -243,18 +288,16 @@ def eliminar_planta(planta_id):
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la planta
-        cursor.execute("""
-            SELECT 1 FROM general_dim_planta p
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
+            SELECT p.id_hilera FROM general_dim_planta p
             JOIN general_dim_hilera h ON p.id_hilera = h.id
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE p.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-        """, (planta_id, usuario_id))
+            WHERE p.id = %s AND {filtro_suc}
+        """, (planta_id, *params_suc))
         
-        if not cursor.fetchone():
+        planta = cursor.fetchone()
+        if not planta:
             cursor.close()
             conn.close()
             return jsonify({"error": "Planta no encontrada o sin acceso"}), 404
@@ -277,8 +320,9 @@ def eliminar_planta(planta_id):
         cursor.execute("""
             UPDATE general_dim_planta 
             SET id_estado = 0
-            WHERE id = %s
+            WHERE id = %s AND id_estado = 1
         """, (planta_id,))
+        sumar_plantas(cursor, {planta['id_hilera']: -cursor.rowcount})
         
         conn.commit()
         cursor.close()
@@ -292,6 +336,7 @@ def eliminar_planta(planta_id):
 
 # Crear múltiples plantas para una hilera
 @plantas_bp.route('/bulk', methods=['POST', 'OPTIONS'])
+@clase_ruta(RUTA_LARGA)
 @jwt_required()
 def crear_plantas_masivo():
     if request.method == 'OPTIONS':
@@ -312,15 +357,12 @@ def crear_plantas_masivo():
         cursor = conn.cursor(dictionary=True)
         
         # Verificar que el usuario tenga acceso a la hilera
-        cursor.execute("""
+        filtro_suc, params_suc = filtro_sucursales('c.id_sucursal', sucursales_permitidas(usuario_id, cursor))
+        cursor.execute(f"""
             SELECT 1 FROM general_dim_hilera h
             JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE h.id = %s AND c.id_sucursal IN (
-                SELECT DISTINCT p.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p 
-                WHERE p.id_usuario = %s
-            )
-        """, (data['id_hilera'], usuario_id))
+            WHERE h.id = %s AND {filtro_suc}
+        """, (data['id_hilera'], *params_suc))
         
         if not cursor.fetchone():
             cursor.close()
@@ -347,7 +389,7 @@ def crear_plantas_masivo():
             }), 400
         
         # Insertar todas las plantas
-        plantas_creadas = []
+        filas = []
         for planta_data in data['plantas']:
             if isinstance(planta_data, dict):
                 planta_num = planta_data['planta']
@@ -356,15 +398,17 @@ def crear_plantas_masivo():
                 planta_num = planta_data
                 ubicacion = None
             
-            cursor.execute("""
-                INSERT INTO general_dim_planta (planta, id_hilera, ubicacion, fecha_creacion, id_estado)
-                VALUES (%s, %s, %s, CURRENT_DATE, %s)
-            """, (planta_num, data['id_hilera'], ubicacion, 1))
-            
-            plantas_creadas.append({
-                "id": cursor.lastrowid,
-                "planta": planta_num
-            })
+            filas.append((planta_num, data['id_hilera'], ubicacion, 1))
+        
+        resultado = insertar_en_lotes(
+            cursor, 'general_dim_planta', ['planta', 'id_hilera', 'ubicacion', 'id_estado'],
+            filas, expresiones={'fecha_creacion': 'CURRENT_DATE'}
+        )
+        plantas_creadas = [
+            {"id": planta_id, "planta": fila[0]}
+            for planta_id, fila in zip(ids_insertados(resultado), filas)
+        ]
+        sumar_plantas(cursor, {data['id_hilera']: resultado["filas_insertadas"]})
         
         conn.commit()
         cursor.close()
@@ -396,43 +440,27 @@ def buscar_plantas():
         hilera_id = request.args.get('hilera_id')
         planta_num = request.args.get('planta')
         
-        # Construir query base
-        query = """
-            SELECT p.*, h.hilera, c.nombre as cuartel_nombre, c.id_ceco
-            FROM general_dim_planta p
-            JOIN general_dim_hilera h ON p.id_hilera = h.id
-            JOIN general_dim_cuartel c ON h.id_cuartel = c.id
-            WHERE c.id_sucursal IN (
-                SELECT DISTINCT p2.id_sucursal 
-                FROM usuario_pivot_sucursal_usuario p2 
-                WHERE p2.id_usuario = %s
-            )
-            AND p.id_estado = 1
-        """
-        valores = [usuario_id]
-        
-        # Agregar filtros
+        # Filtros opcionales
+        filtros = ""
+        valores = []
+        
         if cuartel_id:
-            query += " AND c.id = %s"
+            filtros += " AND c.id = %s"
             valores.append(cuartel_id)
         
         if hilera_id:
-            query += " AND h.id = %s"
+            filtros += " AND h.id = %s"
             valores.append(hilera_id)
         
         if planta_num:
-            query += " AND p.planta LIKE %s"
+            filtros += " AND p.planta LIKE %s"
             valores.append(f"%{planta_num}%")
         
-        query += " ORDER BY c.nombre ASC, h.hilera ASC, p.planta ASC"
-        
-        cursor.execute(query, valores)
-        plantas = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return jsonify(plantas), 200
+        pagina_actual = pagina_plantas(cursor, usuario_id, request.args, filtros, valores)
+        return respuesta_plantas(conn, cursor, pagina_actual)
         
+    except ParametroInvalidoError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         logger.error(f"Error buscando plantas: {str(e)}")
         return jsonify({"error": "Error interno del servidor"}), 500
@@ -1,7 +1,11 @@
 from flask import Blueprint, jsonify, request
+from config import Config
 from utils.db import get_db_connection
+from utils.acceso import tiene_acceso_sucursal, invalidar_sucursales, revocar_tokens, contexto_acceso
+from utils.bulk import sincronizar_pivote
+from utils.claves import ColaClavesLlenaError, hashear_clave, invalidar_cache_clave
+from utils.streaming import respuesta_streaming, formato_respuesta
 from flask_jwt_extended import jwt_required, get_jwt_identity
-import bcrypt
 from datetime import date
 import uuid
 import logging
@@ -13,6 +17,9 @@ usuarios_bp = Blueprint('usuarios_bp', __name__)
 
 def verificar_admin(usuario_id):
     """Verifica si el usuario tiene perfil de administrador (id_perfil = 3)"""
+    # El usuario del token: el perfil viene en sus claims
+    if str(usuario_id) == str(get_jwt_identity()):
+        return contexto_acceso().es_admin
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     cursor.execute("SELECT id_perfil FROM general_dim_usuario WHERE id = %s", (usuario_id,))
@@ -53,14 +60,108 @@ def listar_usuarios():
             ORDER BY u.nombre, u.apellido_paterno
         """)
         
-        usuarios = cursor.fetchall()
+        # Se serializa fila a fila mientras se lee el cursor
+        return respuesta_streaming(conn, cursor, formato_respuesta(request))
+        
+    except Exception as e:
+        logger.error(f"Error listando usuarios: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def detalle_usuarios(cursor, ids):
+    """
+    Detalle de varios usuarios con una consulta por relación (usuario,
+    sucursales, aplicaciones, permisos). Devuelve {id: detalle} solo con los
+    usuarios que existen.
+    """
+    if not ids:
+        return {}
+    placeholders = ','.join(['%s'] * len(ids))
+    
+    cursor.execute(f"""
+        SELECT 
+            u.*, s.nombre as sucursal_activa_nombre,
+            p.nombre as perfil_nombre
+        FROM general_dim_usuario u
+        LEFT JOIN general_dim_sucursal s ON u.id_sucursalactiva = s.id
+        LEFT JOIN usuario_dim_perfil p ON u.id_perfil = p.id
+        WHERE u.id IN ({placeholders})
+    """, ids)
+    
+    usuarios = {}
+    for usuario in cursor.fetchall():
+        # El hash de la clave no sale de la API
+        usuario.pop('clave', None)
+        usuario['sucursales_permitidas'] = []
+        usuario['apps_permitidas'] = []
+        usuario['permisos_asignados'] = []
+        usuarios[usuario['id']] = usuario
+    if not usuarios:
+        return usuarios
+    
+    # Las relaciones solo de los usuarios encontrados
+    encontrados = list(usuarios)
+    placeholders = ','.join(['%s'] * len(encontrados))
+    
+    cursor.execute(f"""
+        SELECT p.id_usuario, s.id, s.nombre, s.ubicacion
+        FROM general_dim_sucursal s
+        INNER JOIN usuario_pivot_sucursal_usuario p ON s.id = p.id_sucursal
+        WHERE p.id_usuario IN ({placeholders})
+        ORDER BY s.nombre
+    """, encontrados)
+    for fila in cursor.fetchall():
+        usuarios[fila.pop('id_usuario')]['sucursales_permitidas'].append(fila)
+    
+    cursor.execute(f"""
+        SELECT p.id_usuario, a.id, a.nombre, a.descripcion
+        FROM general_dim_app a
+        INNER JOIN usuario_pivot_app_usuario p ON a.id = p.id_app
+        WHERE p.id_usuario IN ({placeholders})
+        ORDER BY a.nombre
+    """, encontrados)
+    for fila in cursor.fetchall():
+        usuarios[fila.pop('id_usuario')]['apps_permitidas'].append(fila)
+    
+    cursor.execute(f"""
+        SELECT up.id_usuario, p.id, p.nombre, p.id_app, a.nombre as app_nombre
+        FROM usuario_dim_permiso p
+        INNER JOIN usuario_pivot_permiso_usuario up ON p.id = up.id_permiso
+        LEFT JOIN general_dim_app a ON p.id_app = a.id
+        WHERE up.id_usuario IN ({placeholders})
+        ORDER BY a.nombre, p.nombre
+    """, encontrados)
+    for fila in cursor.fetchall():
+        usuarios[fila.pop('id_usuario')]['permisos_asignados'].append(fila)
+    
+    return usuarios
+
+# 🔹 Obtener el detalle de varios usuarios (?ids=a,b,c)
+@usuarios_bp.route('/detalle', methods=['GET'])
+@jwt_required()
+def obtener_detalle_usuarios():
+    """Detalle de varios usuarios en una llamada: 4 consultas en total, no 4 por usuario"""
+    try:
+        # Sin repetidos, en el orden pedido
+        ids = list(dict.fromkeys(i.strip() for i in request.args.get('ids', '').split(',') if i.strip()))
+        
+        if not ids:
+            return jsonify({"error": "El parámetro ids es requerido (ids=id1,id2,...)"}), 400
+        if len(ids) > Config.USUARIOS_DETALLE_MAX_IDS:
+            return jsonify({"error": f"Máximo {Config.USUARIOS_DETALLE_MAX_IDS} ids por llamada"}), 400
+        
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        usuarios = detalle_usuarios(cursor, ids)
         cursor.close()
         conn.close()
         
-        return jsonify(usuarios), 200
+        return jsonify({
+            "usuarios": [usuarios[i] for i in ids if i in usuarios],
+            "no_encontrados": [i for i in ids if i not in usuarios]
+        }), 200
         
     except Exception as e:
-        logger.error(f"Error listando usuarios: {str(e)}")
+        logger.error(f"Error obteniendo detalle de usuarios: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 # 🔹 Obtener usuario específico
@@ -77,68 +178,12 @@ def obtener_usuario(usuario_id):
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
-        
-        # Obtener información del usuario
-        cursor.execute("""
-            SELECT 
-                u.*, s.nombre as sucursal_activa_nombre,
-                p.nombre as perfil_nombre
-            FROM general_dim_usuario u
-            LEFT JOIN general_dim_sucursal s ON u.id_sucursalactiva = s.id
-            LEFT JOIN usuario_dim_perfil p ON u.id_perfil = p.id
-            WHERE u.id = %s
-        """, (usuario_id,))
-        
-        usuario = cursor.fetchone()
-        if not usuario:
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Usuario no encontrado"}), 404
-        
-        # Obtener sucursales permitidas
-        cursor.execute("""
-            SELECT s.id, s.nombre, s.ubicacion
-            FROM general_dim_sucursal s
-            INNER JOIN usuario_pivot_sucursal_usuario p ON s.id = p.id_sucursal
-            WHERE p.id_usuario = %s
-            ORDER BY s.nombre
-        """, (usuario_id,))
-        
-        sucursales_permitidas = cursor.fetchall()
-        
-        # Obtener aplicaciones permitidas
-        cursor.execute("""
-            SELECT a.id, a.nombre, a.descripcion
-            FROM general_dim_app a
-            INNER JOIN usuario_pivot_app_usuario p ON a.id = p.id_app
-            WHERE p.id_usuario = %s
-            ORDER BY a.nombre
-        """, (usuario_id,))
-        
-        apps_permitidas = cursor.fetchall()
-        
-        # Obtener permisos asignados
-        cursor.execute("""
-            SELECT p.id, p.nombre, p.id_app, a.nombre as app_nombre
-            FROM usuario_dim_permiso p
-            INNER JOIN usuario_pivot_permiso_usuario up ON p.id = up.id_permiso
-            LEFT JOIN general_dim_app a ON p.id_app = a.id
-            WHERE up.id_usuario = %s
-            ORDER BY a.nombre, p.nombre
-        """, (usuario_id,))
-        
-        permisos_asignados = cursor.fetchall()
-        
+        usuario_completo = detalle_usuarios(cursor, [usuario_id]).get(usuario_id)
         cursor.close()
         conn.close()
         
-        # Construir respuesta completa
-        usuario_completo = {
-            **usuario,
-            'sucursales_permitidas': sucursales_permitidas,
-            'apps_permitidas': apps_permitidas,
-            'permisos_asignados': permisos_asignados
-        }
+        if not usuario_completo:
+            return jsonify({"error": "Usuario no encontrado"}), 404
         
         return jsonify(usuario_completo), 200
         
@@ -186,8 +231,8 @@ def crear_usuario():
         # Generar ID único para el usuario
         usuario_id = str(uuid.uuid4())
         
-        # Encriptar contraseña
-        clave_hash = bcrypt.hashpw(data['clave'].encode('utf-8'), bcrypt.gensalt())
+        # Encriptar contraseña (costo CLAVES_COSTO_BCRYPT)
+        clave_hash = hashear_clave(data['clave'])
         
         # Insertar usuario
         cursor.execute("""
@@ -201,7 +246,7 @@ def crear_usuario():
             data['nombre'],
             data['apellido_paterno'],
             data.get('apellido_materno'),
-            clave_hash.decode('utf-8'),
+            clave_hash,
             data['correo'],
             data.get('id_estado', 1),  # Activo por defecto
             data.get('id_rol', 3),     # Usuario por defecto
@@ -227,6 +272,8 @@ def crear_usuario():
             "usuario": data['usuario']
         }), 201
         
+    except ColaClavesLlenaError:
+        return jsonify({"error": "Servidor ocupado, reintente en unos segundos"}), 503, {'Retry-After': '2'}
     except Exception as e:
         logger.error(f"Error creando usuario: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -272,9 +319,8 @@ def actualizar_usuario(usuario_id):
         
         # Si se proporciona nueva contraseña, encriptarla
         if 'clave' in data:
-            clave_hash = bcrypt.hashpw(data['clave'].encode('utf-8'), bcrypt.gensalt())
             campos_actualizar.append("clave = %s")
-            valores.append(clave_hash.decode('utf-8'))
+            valores.append(hashear_clave(data['clave']))
         
         if not campos_actualizar:
             cursor.close()
@@ -291,7 +337,14 @@ def actualizar_usuario(usuario_id):
         """
         
         cursor.execute(sql, valores)
+        # Perfil, rol o estado cambiados: los tokens emitidos dejan de valer
+        if any(campo in data for campo in ('id_estado', 'id_rol', 'id_perfil')):
+            revocar_tokens(cursor, usuario_id)
         conn.commit()
+        invalidar_sucursales(usuario_id)
+        
+        if 'clave' in data:
+            invalidar_cache_clave(usuario_id)
         
         cursor.close()
         conn.close()
@@ -301,6 +354,8 @@ def actualizar_usuario(usuario_id):
             "id": usuario_id
         }), 200
         
+    except ColaClavesLlenaError:
+        return jsonify({"error": "Servidor ocupado, reintente en unos segundos"}), 503, {'Retry-After': '2'}
     except Exception as e:
         logger.error(f"Error actualizando usuario: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -334,7 +389,9 @@ def eliminar_usuario(usuario_id):
             WHERE id = %s
         """, (usuario_id,))
         
+        revocar_tokens(cursor, usuario_id)
         conn.commit()
+        invalidar_sucursales(usuario_id)
         cursor.close()
         conn.close()
         
@@ -635,24 +692,24 @@ def asignar_permisos(usuario_id):
                 conn.close()
                 return jsonify({"error": "Uno o más permisos no existen o están inactivos"}), 400
         
-        # Eliminar permisos actuales del usuario
-        cursor.execute("DELETE FROM usuario_pivot_permiso_usuario WHERE id_usuario = %s", (usuario_id,))
-        
-        # Asignar nuevos permisos
-        for permiso_id in permisos_ids:
-            cursor.execute("""
-                INSERT INTO usuario_pivot_permiso_usuario (id_usuario, id_permiso)
-                VALUES (%s, %s)
-            """, (usuario_id, permiso_id))
+        # Solo se borran los permisos quitados y se insertan los nuevos
+        cambios = sincronizar_pivote(
+            cursor, 'usuario_pivot_permiso_usuario', 'id_usuario', 'id_permiso', {usuario_id: permisos_ids}
+        )
         
+        if cambios["agregados"] or cambios["eliminados"]:
+            revocar_tokens(cursor, usuario_id)
         conn.commit()
+        invalidar_sucursales(usuario_id)
         cursor.close()
         conn.close()
         
         return jsonify({
             "message": "Permisos asignados correctamente",
             "usuario_id": usuario_id,
-            "permisos_asignados": len(permisos_ids)
+            "permisos_asignados": len(permisos_ids),
+            "agregados": cambios["agregados"],
+            "eliminados": cambios["eliminados"]
         }), 200
         
     except Exception as e:
@@ -701,24 +758,24 @@ def asignar_aplicaciones(usuario_id):
                 conn.close()
                 return jsonify({"error": "Una o más aplicaciones no existen"}), 400
         
-        # Eliminar accesos actuales del usuario
-        cursor.execute("DELETE FROM usuario_pivot_app_usuario WHERE id_usuario = %s", (usuario_id,))
-        
-        # Asignar nuevos accesos
-        for app_id in apps_ids:
-            cursor.execute("""
-                INSERT INTO usuario_pivot_app_usuario (id_usuario, id_app)
-                VALUES (%s, %s)
-            """, (usuario_id, app_id))
+        # Solo se borran los accesos quitados y se insertan los nuevos
+        cambios = sincronizar_pivote(
+            cursor, 'usuario_pivot_app_usuario', 'id_usuario', 'id_app', {usuario_id: apps_ids}
+        )
         
+        if cambios["agregados"] or cambios["eliminados"]:
+            revocar_tokens(cursor, usuario_id)
         conn.commit()
+        invalidar_sucursales(usuario_id)
         cursor.close()
         conn.close()
         
         return jsonify({
             "message": "Acceso a aplicaciones asignado correctamente",
             "usuario_id": usuario_id,
-            "apps_asignadas": len(apps_ids)
+            "apps_asignadas": len(apps_ids),
+            "agregados": cambios["agregados"],
+            "eliminados": cambios["eliminados"]
         }), 200
         
     except Exception as e:
@@ -768,13 +825,7 @@ def actualizar_sucursal_activa():
         cursor = conn.cursor(dictionary=True)
 
         # Verificar que el usuario tenga acceso a la sucursal
-        cursor.execute("""
-            SELECT 1 
-            FROM usuario_pivot_sucursal_usuario 
-            WHERE id_usuario = %s AND id_sucursal = %s
-        """, (usuario_id, nueva_sucursal))
-        
-        if not cursor.fetchone():
+        if not tiene_acceso_sucursal(usuario_id, nueva_sucursal, cursor):
             cursor.close()
             conn.close()
             return jsonify({"error": "No tienes acceso a esta sucursal"}), 403
@@ -930,25 +981,24 @@ def asignar_sucursales_permitidas(usuario_id):
                 conn.close()
                 return jsonify({"error": "Una o más sucursales no existen o no son del tipo correcto"}), 400
 
-        # Eliminar todas las asignaciones actuales del usuario
-        cursor.execute("DELETE FROM usuario_pivot_sucursal_usuario WHERE id_usuario = %s", (usuario_id,))
-        
-        # Insertar las nuevas asignaciones
-        if sucursales_ids:
-            for sucursal_id in sucursales_ids:
-                cursor.execute("""
-                    INSERT INTO usuario_pivot_sucursal_usuario (id_sucursal, id_usuario)
-                    VALUES (%s, %s)
-                """, (sucursal_id, usuario_id))
+        # Solo se borran las sucursales quitadas y se insertan las nuevas
+        cambios = sincronizar_pivote(
+            cursor, 'usuario_pivot_sucursal_usuario', 'id_usuario', 'id_sucursal', {usuario_id: sucursales_ids}
+        )
         
+        if cambios["agregados"] or cambios["eliminados"]:
+            revocar_tokens(cursor, usuario_id)
         conn.commit()
+        invalidar_sucursales(usuario_id)
         cursor.close()
         conn.close()
         
         return jsonify({
             "message": "Sucursales permitidas asignadas correctamente",
             "usuario_id": usuario_id,
-            "sucursales_asignadas": len(sucursales_ids)
+            "sucursales_asignadas": len(sucursales_ids),
+            "agregados": cambios["agregados"],
+            "eliminados": cambios["eliminados"]
         }), 200
         
     except Exception as e:
@@ -978,7 +1028,9 @@ def eliminar_sucursales_permitidas(usuario_id):
         cursor.execute("DELETE FROM usuario_pivot_sucursal_usuario WHERE id_usuario = %s", (usuario_id,))
         filas_eliminadas = cursor.rowcount
         
+        revocar_tokens(cursor, usuario_id)
         conn.commit()
+        invalidar_sucursales(usuario_id)
         cursor.close()
         conn.close()
         
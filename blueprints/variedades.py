@@ -1,11 +1,33 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from utils.db import get_db_connection
+from utils.catalogos import obtener_catalogo, invalidar_catalogos, respuesta_catalogo, version_catalogo, buscar_por_id
+from utils.cache_http import version_previa
 import logging
 
 variedades_bp = Blueprint('variedades_bp', __name__)
 logger = logging.getLogger(__name__)
 
+# Especies y variedades activas: se leen desde el cache de catálogos
+# (utils/catalogos.py) y los endpoints de escritura lo invalidan
+def _cargar_especies(cursor):
+    cursor.execute("""
+        SELECT * FROM general_dim_especie 
+        WHERE id_estado = 1
+        ORDER BY nombre ASC
+    """)
+    return cursor.fetchall()
+
+def _cargar_variedades(cursor):
+    cursor.execute("""
+        SELECT v.*, e.nombre as especie_nombre
+        FROM general_dim_variedad v
+        LEFT JOIN general_dim_especie e ON v.id_especie = e.id
+        WHERE v.id_estado = 1
+        ORDER BY e.nombre ASC, v.nombre ASC
+    """)
+    return cursor.fetchall()
+
 # ============================================================================
 # ESPECIES
 # ============================================================================
@@ -13,25 +35,14 @@ logger = logging.getLogger(__name__)
 # Obtener todas las especies
 @variedades_bp.route('/especies', methods=['GET', 'OPTIONS'])
 @jwt_required()
+@version_previa(lambda: version_catalogo(obtener_catalogo('especies', _cargar_especies)))
 def obtener_especies():
     if request.method == 'OPTIONS':
         return '', 200
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT * FROM general_dim_especie 
-            WHERE id_estado = 1
-            ORDER BY nombre ASC
-        """)
-        
-        especies = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return jsonify(especies), 200
+        catalogo = obtener_catalogo('especies', _cargar_especies)
+        return respuesta_catalogo(catalogo, catalogo.datos)
         
     except Exception as e:
         logger.error(f"Error obteniendo especies: {str(e)}")
@@ -40,27 +51,19 @@ def obtener_especies():
 # Obtener una especie específica
 @variedades_bp.route('/especies/<int:especie_id>', methods=['GET', 'OPTIONS'])
 @jwt_required()
+@version_previa(lambda especie_id: version_catalogo(obtener_catalogo('especies', _cargar_especies), especie_id))
 def obtener_especie(especie_id):
     if request.method == 'OPTIONS':
         return '', 200
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT * FROM general_dim_especie 
-            WHERE id = %s AND id_estado = 1
-        """, (especie_id,))
-        
-        especie = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        catalogo = obtener_catalogo('especies', _cargar_especies)
+        especie = buscar_por_id(catalogo, especie_id)
         
         if not especie:
             return jsonify({"error": "Especie no encontrada"}), 404
             
-        return jsonify(especie), 200
+        return respuesta_catalogo(catalogo, especie, variante=especie_id)
         
     except Exception as e:
         logger.error(f"Error obteniendo especie {especie_id}: {str(e)}")
@@ -108,6 +111,7 @@ def crear_especie():
         
         especie_id = cursor.lastrowid
         conn.commit()
+        invalidar_catalogos('especies', 'especies_todas')
         cursor.close()
         conn.close()
         
@@ -181,6 +185,7 @@ def actualizar_especie(especie_id):
         """, valores)
         
         conn.commit()
+        invalidar_catalogos('especies', 'especies_todas', 'variedades', 'atributos_especie')
         cursor.close()
         conn.close()
         
@@ -234,6 +239,7 @@ def eliminar_especie(especie_id):
         """, (especie_id,))
         
         conn.commit()
+        invalidar_catalogos('especies', 'especies_todas', 'variedades', 'atributos_especie')
         cursor.close()
         conn.close()
         
@@ -250,27 +256,14 @@ def eliminar_especie(especie_id):
 # Obtener todas las variedades
 @variedades_bp.route('/variedades', methods=['GET', 'OPTIONS'])
 @jwt_required()
+@version_previa(lambda: version_catalogo(obtener_catalogo('variedades', _cargar_variedades)))
 def obtener_variedades():
     if request.method == 'OPTIONS':
         return '', 200
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT v.*, e.nombre as especie_nombre
-            FROM general_dim_variedad v
-            LEFT JOIN general_dim_especie e ON v.id_especie = e.id
-            WHERE v.id_estado = 1
-            ORDER BY e.nombre ASC, v.nombre ASC
-        """)
-        
-        variedades = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        return jsonify(variedades), 200
+        catalogo = obtener_catalogo('variedades', _cargar_variedades)
+        return respuesta_catalogo(catalogo, catalogo.datos)
         
     except Exception as e:
         logger.error(f"Error obteniendo variedades: {str(e)}")
@@ -279,29 +272,19 @@ def obtener_variedades():
 # Obtener una variedad específica
 @variedades_bp.route('/variedades/<int:variedad_id>', methods=['GET', 'OPTIONS'])
 @jwt_required()
+@version_previa(lambda variedad_id: version_catalogo(obtener_catalogo('variedades', _cargar_variedades), variedad_id))
 def obtener_variedad(variedad_id):
     if request.method == 'OPTIONS':
         return '', 200
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
-        cursor.execute("""
-            SELECT v.*, e.nombre as especie_nombre
-            FROM general_dim_variedad v
-            LEFT JOIN general_dim_especie e ON v.id_especie = e.id
-            WHERE v.id = %s AND v.id_estado = 1
-        """, (variedad_id,))
-        
-        variedad = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        catalogo = obtener_catalogo('variedades', _cargar_variedades)
+        variedad = buscar_por_id(catalogo, variedad_id)
         
         if not variedad:
             return jsonify({"error": "Variedad no encontrada"}), 404
             
-        return jsonify(variedad), 200
+        return respuesta_catalogo(catalogo, variedad, variante=variedad_id)
         
     except Exception as e:
         logger.error(f"Error obteniendo variedad {variedad_id}: {str(e)}")
@@ -363,6 +346,7 @@ def crear_variedad():
         
         variedad_id = cursor.lastrowid
         conn.commit()
+        invalidar_catalogos('variedades')
         cursor.close()
         conn.close()
         
@@ -436,6 +420,7 @@ def actualizar_variedad(variedad_id):
         """, valores)
         
         conn.commit()
+        invalidar_catalogos('variedades')
         cursor.close()
         conn.close()
         
@@ -489,6 +474,7 @@ def eliminar_variedad(variedad_id):
         """, (variedad_id,))
         
         conn.commit()
+        invalidar_catalogos('variedades')
         cursor.close()
         conn.close()
         
@@ -506,34 +492,15 @@ def obtener_variedades_especie(especie_id):
         return '', 200
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
         # Verificar que la especie existe
-        cursor.execute("""
-            SELECT 1 FROM general_dim_especie 
-            WHERE id = %s AND id_estado = 1
-        """, (especie_id,))
-        
-        if not cursor.fetchone():
-            cursor.close()
-            conn.close()
+        if not buscar_por_id(obtener_catalogo('especies', _cargar_especies), especie_id):
             return jsonify({"error": "Especie no encontrada"}), 404
         
-        # Obtener variedades de la especie
-        cursor.execute("""
-            SELECT v.*, e.nombre as especie_nombre
-            FROM general_dim_variedad v
-            LEFT JOIN general_dim_especie e ON v.id_especie = e.id
-            WHERE v.id_especie = %s AND v.id_estado = 1
-            ORDER BY v.nombre ASC
-        """, (especie_id,))
-        
-        variedades = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        # Variedades de la especie (el catálogo ya viene ordenado por nombre dentro de cada especie)
+        catalogo = obtener_catalogo('variedades', _cargar_variedades)
+        variedades = [v for v in catalogo.datos if v['id_especie'] == especie_id]
         
-        return jsonify(variedades), 200
+        return respuesta_catalogo(catalogo, variedades, variante=f"especie-{especie_id}")
         
     except Exception as e:
         logger.error(f"Error obteniendo variedades de especie {especie_id}: {str(e)}")
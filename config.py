@@ -22,6 +22,93 @@ class Config:
     DB_PASSWORD = os.getenv("DB_PASSWORD", "&8y7c()tu9t/+,6`")
     DB_NAME = os.getenv("DB_NAME", "lahornilla_base_normalizada")
     
+    # Pool de conexiones MySQL (por proceso)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))     # segundos esperando conexión libre
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # segundos de vida de una conexión
+    DB_POOL_PRE_PING = float(os.getenv("DB_POOL_PRE_PING", "10"))   # ping si estuvo inactiva más de N segundos
+    
+    # Cache de sucursales permitidas y versión de token por usuario (segundos)
+    ACCESO_CACHE_TTL = int(os.getenv("ACCESO_CACHE_TTL", "300"))
+    TOKEN_VERSION_TTL = int(os.getenv("TOKEN_VERSION_TTL", "5"))              # demora máxima en rechazar un token revocado
+    
+    # Filas por sentencia en los INSERT masivos (utils/bulk.py)
+    BULK_INSERT_LOTE = int(os.getenv("BULK_INSERT_LOTE", "1000"))
+    
+    # Carga NDJSON en streaming: líneas por commit, máximo de errores/warnings en el reporte y espera para reanudar
+    CARGA_STREAM_LOTE = int(os.getenv("CARGA_STREAM_LOTE", "500"))
+    CARGA_MAX_ERRORES = int(os.getenv("CARGA_MAX_ERRORES", "1000"))
+    CARGA_REANUDAR_ESPERA = int(os.getenv("CARGA_REANUDAR_ESPERA", "300"))   # segundos sin avance para reanudar una carga en_proceso (--timeout de Cloud Run)
+    
+    # Jobs en segundo plano (utils/jobs.py)
+    JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))                     # hilos por proceso
+    JOBS_PROGRESO_SEGUNDOS = float(os.getenv("JOBS_PROGRESO_SEGUNDOS", "2"))  # frecuencia de guardado del avance
+    JOBS_SIN_PROGRESO = int(os.getenv("JOBS_SIN_PROGRESO", "600"))         # segundos sin avance para darlo por interrumpido
+    
+    # Paginación keyset de listados grandes (utils/paginacion.py)
+    PAGINACION_LIMIT_DEFECTO = int(os.getenv("PAGINACION_LIMIT_DEFECTO", "500"))
+    PAGINACION_LIMIT_MAX = int(os.getenv("PAGINACION_LIMIT_MAX", "5000"))
+    
+    # Usuarios por llamada a /api/usuarios/detalle
+    USUARIOS_DETALLE_MAX_IDS = int(os.getenv("USUARIOS_DETALLE_MAX_IDS", "500"))
+    
+    # Filas por fetchmany()/chunk en las respuestas en streaming (utils/streaming.py)
+    STREAM_FILAS_LOTE = int(os.getenv("STREAM_FILAS_LOTE", "200"))
+    
+    # Imágenes de registros de mapeo (utils/imagenes.py), direccionadas por sha256
+    IMAGENES_BACKEND = os.getenv("IMAGENES_BACKEND", "local")              # local o gcs
+    IMAGENES_DIR = os.getenv("IMAGENES_DIR", "")                            # local: volumen compartido y persistente, obligatorio
+    IMAGENES_BUCKET = os.getenv("IMAGENES_BUCKET", "")                      # gcs: bucket de Cloud Storage
+    IMAGENES_MAX_BYTES = int(os.getenv("IMAGENES_MAX_BYTES", str(10 * 1024 * 1024)))
+    IMAGENES_CACHE_SEGUNDOS = int(os.getenv("IMAGENES_CACHE_SEGUNDOS", "31536000"))  # el contenido de un hash no cambia
+    
+    # Variantes reducidas de las imágenes (utils/miniaturas.py)
+    IMAGENES_MINIATURA_PX = int(os.getenv("IMAGENES_MINIATURA_PX", "256"))
+    IMAGENES_MEDIA_PX = int(os.getenv("IMAGENES_MEDIA_PX", "1024"))
+    IMAGENES_FORMATO_VARIANTES = os.getenv("IMAGENES_FORMATO_VARIANTES", "WEBP")  # WEBP o JPEG
+    IMAGENES_WORKERS = int(os.getenv("IMAGENES_WORKERS", "1"))                   # hilos que generan variantes
+    
+    # Cache de catálogos de referencia (utils/catalogos.py): especies, variedades, atributos, opciones
+    CATALOGOS_TTL_SEGUNDOS = int(os.getenv("CATALOGOS_TTL_SEGUNDOS", "300"))
+    
+    # Diagnóstico opcional de endpoints (utils/diagnostico.py): consultas extra solo si está activo
+    DIAGNOSTICO_ACTIVO = os.getenv("DIAGNOSTICO_ACTIVO", "False") == "True"
+    DIAGNOSTICO_MUESTREO = float(os.getenv("DIAGNOSTICO_MUESTREO", "0.05"))       # fracción de requests
+    DIAGNOSTICO_MAX_FILAS = int(os.getenv("DIAGNOSTICO_MAX_FILAS", "10"))          # filas de muestra por log
+    DIAGNOSTICO_MAX_CARACTERES = int(os.getenv("DIAGNOSTICO_MAX_CARACTERES", "4000"))
+    
+    # Logging (utils/registro.py)
+    LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO")
+    LOG_NIVELES = os.getenv("LOG_NIVELES", "mysql.connector=WARNING,urllib3=WARNING")  # modulo=NIVEL,...
+    LOG_MAX_CARACTERES = int(os.getenv("LOG_MAX_CARACTERES", "4000"))          # por mensaje
+    LOG_MAX_CARACTERES_DATO = int(os.getenv("LOG_MAX_CARACTERES_DATO", "500"))  # por Resumen(...) dentro del mensaje
+    LOG_MUESTREO_MAXIMO = int(os.getenv("LOG_MUESTREO_MAXIMO", "20"))           # mensajes por clave de muestreo...
+    LOG_MUESTREO_VENTANA = int(os.getenv("LOG_MUESTREO_VENTANA", "60"))         # ...cada tantos segundos
+    
+    # Métricas por request (utils/metricas.py): Server-Timing y /api/metrics
+    METRICAS_ACTIVAS = os.getenv("METRICAS_ACTIVAS", "True") == "True"
+    METRICAS_SQL_LENTA_MS = int(os.getenv("METRICAS_SQL_LENTA_MS", "1000"))  # se loguean las sentencias más lentas
+    METRICAS_TOKEN = os.getenv("METRICAS_TOKEN", "")                          # /api/metrics exige Bearer <token>; vacío: responde 404
+    
+    # Servidor de producción (gunicorn.conf.py, utils/servidor.py)
+    WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))                  # 0 = uno por CPU, según memoria
+    WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))                  # hilos por worker
+    WEB_MB_POR_WORKER = int(os.getenv("WEB_MB_POR_WORKER", "200"))    # memoria estimada de cada worker
+    WEB_MB_RESERVA = int(os.getenv("WEB_MB_RESERVA", "64"))           # memoria fuera de los workers
+    WEB_TIMEOUT = int(os.getenv("WEB_TIMEOUT", "120"))                # worker colgado (no requests largos)
+    WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "8"))
+    WEB_KEEPALIVE = int(os.getenv("WEB_KEEPALIVE", "75"))
+    LIMITE_RUTA_INTERACTIVA_S = float(os.getenv("LIMITE_RUTA_INTERACTIVA_S", "10"))  # presupuesto por clase de ruta
+    LIMITE_RUTA_LARGA_S = float(os.getenv("LIMITE_RUTA_LARGA_S", "240"))
+    
+    # Verificación de claves (utils/claves.py)
+    CLAVES_PROCESOS = int(os.getenv("CLAVES_PROCESOS", "-1"))               # -1 = uno por CPU, 0 = en el hilo del request
+    CLAVES_COLA_MAXIMA = int(os.getenv("CLAVES_COLA_MAXIMA", "32"))         # pendientes antes de responder 503
+    CLAVES_TIMEOUT = float(os.getenv("CLAVES_TIMEOUT", "10"))               # segundos esperando la verificación
+    CLAVES_CACHE_SEGUNDOS = int(os.getenv("CLAVES_CACHE_SEGUNDOS", "120"))  # 0 = sin cache de verificaciones
+    CLAVES_CACHE_MAXIMO = int(os.getenv("CLAVES_CACHE_MAXIMO", "5000"))
+    CLAVES_COSTO_BCRYPT = int(os.getenv("CLAVES_COSTO_BCRYPT", "12"))       # factor de trabajo de los hashes nuevos
+    
     JWT_SECRET_KEY = 'Inicio01*'  # ✅ Esta clave es usada por Flask-JWT-Extended
     SECRET_KEY = 'Inicio01*'
     DEBUG = True
@@ -0,0 +1,77 @@
+"""
+Genera las variantes reducidas (miniatura, media) de las imágenes de registros
+que ya están en el almacén y todavía no las tienen. Correr después de
+migrar_imagenes.py; se puede cortar y volver a correr, las variantes
+existentes se saltan.
+
+Uso:
+    python generar_miniaturas.py
+    python generar_miniaturas.py --workers 4 --lote 500
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.db import get_db_connection
+from utils.miniaturas import generar_variantes
+
+
+def procesar(hash_imagen):
+    try:
+        return hash_imagen, generar_variantes(hash_imagen), None
+    except Exception as e:
+        return hash_imagen, [], str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lote', type=int, default=500, help='registros leídos por consulta')
+    parser.add_argument('--workers', type=int, default=2, help='imágenes procesadas en paralelo')
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+
+    ultimo_id = ''
+    vistas = set()
+    generadas = 0
+    errores = 0
+    inicio = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            while True:
+                cursor.execute("""
+                    SELECT id, imagen
+                    FROM mapeo_fact_registro
+                    WHERE id > %s
+                    AND CHAR_LENGTH(imagen) = 64
+                    ORDER BY id
+                    LIMIT %s
+                """, (ultimo_id, args.lote))
+                filas = cursor.fetchall()
+                if not filas:
+                    break
+                ultimo_id = filas[-1]['id']
+
+                # La misma foto puede estar en varios registros
+                hashes = [fila['imagen'] for fila in filas if fila['imagen'] not in vistas]
+                vistas.update(hashes)
+
+                for hash_imagen, variantes, error in executor.map(procesar, hashes):
+                    if error:
+                        errores += 1
+                        print(f"⚠️  {hash_imagen}: {error}")
+                    elif variantes:
+                        generadas += 1
+
+                print(f"... {len(vistas)} imágenes revisadas, {generadas} con variantes nuevas ({time.perf_counter() - inicio:.1f}s)")
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"✅ {len(vistas)} imágenes, {generadas} con variantes nuevas, {errores} errores, {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
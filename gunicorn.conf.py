@@ -0,0 +1,57 @@
+"""
+Configuración de gunicorn para producción (Cloud Run). El Dockerfile la usa con:
+    gunicorn --config gunicorn.conf.py app:app
+
+Variables de entorno: PORT, WEB_WORKERS, WEB_THREADS, WEB_MB_POR_WORKER,
+WEB_MB_RESERVA, WEB_KEEPALIVE, WEB_TIMEOUT, WEB_GRACEFUL_TIMEOUT (ver config.py).
+"""
+import os
+
+from config import Config
+from utils.servidor import cpus_disponibles, dimensionar, preparar_fork, reiniciar_tras_fork
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+
+# Hilos por worker: un request lento ocupa un hilo, no todo el proceso
+worker_class = 'gthread'
+workers, threads = dimensionar()
+
+# Un hilo por request más los jobs en segundo plano, salvo que DB_POOL_SIZE venga fijado
+if 'DB_POOL_SIZE' not in os.environ:
+    Config.DB_POOL_SIZE = threads + Config.JOBS_WORKERS
+
+# Procesos de bcrypt (utils/claves.py): las CPUs se reparten entre los workers
+if 'CLAVES_PROCESOS' not in os.environ:
+    Config.CLAVES_PROCESOS = max(1, cpus_disponibles() // workers)
+
+# La app (plantillas Excel, catálogos de módulo) se carga una vez en el master
+# y los workers la heredan; conexiones y hilos se rehacen en cada worker
+preload_app = True
+
+# Con gthread el timeout solo detecta un worker colgado (su loop principal
+# deja de responder), no corta requests largos: ese límite es el --timeout
+# de Cloud Run (300 s en cloudbuild.yaml)
+timeout = Config.WEB_TIMEOUT
+
+# Cloud Run da 10 s entre SIGTERM y SIGKILL
+graceful_timeout = Config.WEB_GRACEFUL_TIMEOUT
+
+# El frontend de Cloud Run reutiliza las conexiones hacia el contenedor:
+# mantenerlas más que su tiempo ocioso evita reconexiones
+keepalive = Config.WEB_KEEPALIVE
+
+# Heartbeat de los workers en memoria, no en el overlay del contenedor
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Los logs de la app ya van por logging (utils/registro.py)
+accesslog = None
+errorlog = '-'
+
+
+def when_ready(server):
+    server.log.info(f"gunicorn: {workers} workers x {threads} threads, pool BD {Config.DB_POOL_SIZE} por worker")
+    preparar_fork()
+
+
+def post_fork(server, worker):
+    reiniciar_tras_fork()
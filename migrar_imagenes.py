@@ -0,0 +1,83 @@
+"""
+Migra las imágenes base64 guardadas en mapeo_fact_registro.imagen al almacén
+de imágenes (utils/imagenes.py): guarda los bytes y deja en la fila su sha256.
+
+Procesa por lotes en orden de id con un commit por lote, así que se puede
+cortar y volver a correr: las filas ya migradas quedan con un hash y no se
+vuelven a leer. Las imágenes que no son base64 válido se informan y se dejan
+como están.
+
+Requiere el almacén definitivo (IMAGENES_BACKEND=gcs con IMAGENES_BUCKET, o
+local con IMAGENES_DIR en un volumen persistente compartido): después de
+migrar, el base64 ya no está en la fila y la imagen solo existe en el almacén.
+
+Uso:
+    python migrar_imagenes.py
+    python migrar_imagenes.py --lote 50 --simular
+"""
+import argparse
+import time
+
+from utils.db import get_db_connection
+from utils.imagenes import ImagenInvalidaError, guardar_imagen_base64, validar_almacen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lote', type=int, default=100, help='filas leídas por consulta')
+    parser.add_argument('--simular', action='store_true', help='solo cuenta, no guarda ni actualiza')
+    args = parser.parse_args()
+    validar_almacen()
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+
+    ultimo_id = ''
+    migradas = 0
+    invalidas = 0
+    inicio = time.perf_counter()
+
+    try:
+        while True:
+            cursor.execute("""
+                SELECT id, imagen
+                FROM mapeo_fact_registro
+                WHERE id > %s
+                AND imagen IS NOT NULL AND imagen <> ''
+                AND CHAR_LENGTH(imagen) <> 64
+                ORDER BY id
+                LIMIT %s
+            """, (ultimo_id, args.lote))
+            filas = cursor.fetchall()
+            if not filas:
+                break
+
+            for fila in filas:
+                ultimo_id = fila['id']
+                if args.simular:
+                    migradas += 1
+                    continue
+                try:
+                    hash_imagen = guardar_imagen_base64(fila['imagen'])
+                except ImagenInvalidaError as e:
+                    invalidas += 1
+                    print(f"⚠️  Registro {fila['id']}: {str(e)}")
+                    continue
+                cursor.execute(
+                    "UPDATE mapeo_fact_registro SET imagen = %s WHERE id = %s",
+                    (hash_imagen, fila['id'])
+                )
+                migradas += 1
+
+            conn.commit()
+            print(f"... {migradas} migradas ({time.perf_counter() - inicio:.1f}s)")
+    finally:
+        cursor.close()
+        conn.close()
+
+    accion = "por migrar" if args.simular else "migradas"
+    print(f"✅ {migradas} imágenes {accion}, {invalidas} inválidas, {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
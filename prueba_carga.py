@@ -0,0 +1,121 @@
+"""
+Prueba de carga: throughput y latencias de la API a varios niveles de concurrencia.
+
+Cada nivel corre `--duracion` segundos con N clientes que repiten las rutas en
+ronda. Sirve para comparar configuraciones de gunicorn.conf.py (WEB_WORKERS,
+WEB_THREADS) contra una instancia local o de Cloud Run.
+
+Uso:
+    python prueba_carga.py --url http://localhost:8080 --token <jwt>
+    python prueba_carga.py --url https://... --usuario u --clave c --concurrencias 1 10 50
+    python prueba_carga.py --rutas /api/opciones/ /api/cuarteles /api/variedades/especies
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+RUTAS_DEFECTO = ['/api/opciones/', '/api/cuarteles', '/api/variedades/especies']
+
+
+def obtener_token(url, usuario, clave):
+    cuerpo = json.dumps({'usuario': usuario, 'clave': clave}).encode('utf-8')
+    pedido = urllib.request.Request(
+        f"{url}/api/auth/login", data=cuerpo, headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(pedido, timeout=30) as respuesta:
+        return json.loads(respuesta.read())['access_token']
+
+
+def duracion_db(server_timing):
+    # Server-Timing: db;dur=12.3;desc="...", conn;dur=...
+    for parte in (server_timing or '').split(','):
+        campos = parte.strip().split(';')
+        if campos[0] == 'db':
+            for campo in campos[1:]:
+                if campo.startswith('dur='):
+                    return float(campo[4:])
+    return None
+
+
+def cliente(url, rutas, headers, hasta, resultados, lock):
+    i = 0
+    while time.monotonic() < hasta:
+        ruta = rutas[i % len(rutas)]
+        i += 1
+        inicio = time.perf_counter()
+        db_ms = None
+        try:
+            pedido = urllib.request.Request(f"{url}{ruta}", headers=headers)
+            with urllib.request.urlopen(pedido, timeout=60) as respuesta:
+                respuesta.read()
+                db_ms = duracion_db(respuesta.headers.get('Server-Timing'))
+            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        segundos = time.perf_counter() - inicio
+        with lock:
+            resultados.append((ok, segundos, db_ms))
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def correr_nivel(url, rutas, headers, concurrencia, duracion):
+    resultados = []
+    lock = threading.Lock()
+    hasta = time.monotonic() + duracion
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        for _ in range(concurrencia):
+            executor.submit(cliente, url, rutas, headers, hasta, resultados, lock)
+    transcurrido = time.perf_counter() - inicio
+
+    latencias = sorted(segundos for ok, segundos, _ in resultados if ok)
+    db = [db_ms for ok, _, db_ms in resultados if ok and db_ms is not None]
+    return {
+        'requests': len(resultados),
+        'errores': sum(1 for ok, _, _ in resultados if not ok),
+        'rps': len(latencias) / transcurrido if transcurrido else 0.0,
+        'p50': percentil(latencias, 0.50) * 1000,
+        'p95': percentil(latencias, 0.95) * 1000,
+        'p99': percentil(latencias, 0.99) * 1000,
+        'db': sum(db) / len(db) if db else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:8080')
+    parser.add_argument('--token', help='JWT ya emitido (si no, --usuario/--clave)')
+    parser.add_argument('--usuario')
+    parser.add_argument('--clave')
+    parser.add_argument('--rutas', nargs='+', default=RUTAS_DEFECTO)
+    parser.add_argument('--concurrencias', type=int, nargs='+', default=[1, 5, 10, 20, 50])
+    parser.add_argument('--duracion', type=float, default=20, help='segundos por nivel')
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    token = args.token
+    if not token and args.usuario:
+        token = obtener_token(url, args.usuario, args.clave)
+    headers = {'Authorization': f"Bearer {token}"} if token else {}
+
+    print(f"🔍 Prueba de carga contra {url} ({args.duracion:.0f} s por nivel)")
+    print(f"   Rutas: {', '.join(args.rutas)}")
+    print(f"{'clientes':>8} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'db ms':>7} | {'errores':>7}")
+    print("-" * 72)
+    for concurrencia in args.concurrencias:
+        r = correr_nivel(url, args.rutas, headers, concurrencia, args.duracion)
+        print(f"{concurrencia:>8} | {r['rps']:8.1f} | {r['p50']:8.1f} | {r['p95']:8.1f} | "
+              f"{r['p99']:8.1f} | {r['db']:7.1f} | {r['errores']:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Recalcula general_fact_conteo_planta_hilera (plantas activas por hilera, ver
+utils/conteo_plantas.py) desde general_dim_planta. Las rutas que crean o dan de
+baja plantas lo mantienen al día y siembran cada hilera en su primer cambio;
+esto completa de una vez las hileras que todavía no tienen fila y corrige
+desvíos por cambios hechos directo en la base de datos. Se puede correr con la
+API funcionando.
+
+Uso:
+    python reconciliar_conteo_plantas.py
+    python reconciliar_conteo_plantas.py --cuarteles 12 15 20
+"""
+import argparse
+import time
+
+from utils.db import get_db_connection
+from utils.conteo_plantas import asegurar_tabla_conteo, reconciliar
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cuarteles', type=int, nargs='+', help='solo estos cuarteles (por defecto todos)')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    asegurar_tabla_conteo()
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        resultado = reconciliar(conn, cursor, args.cuarteles)
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"✅ {resultado['cuarteles_recontados']} cuarteles recontados, {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
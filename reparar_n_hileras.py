@@ -0,0 +1,36 @@
+"""
+Corrige general_dim_cuartel.n_hileras de los cuarteles cuyo valor no coincide
+con sus hileras activas, en una sola sentencia (utils/conteo_hileras.py). Los
+cuarteles sin hileras creadas conservan el valor declarado. Se puede correr
+con la API funcionando.
+
+Uso:
+    python reparar_n_hileras.py
+    python reparar_n_hileras.py --cuarteles 12 15 20
+"""
+import argparse
+import time
+
+from utils.db import get_db_connection
+from utils.conteo_hileras import reparar_n_hileras
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cuarteles', type=int, nargs='+', help='solo estos cuarteles (por defecto todos)')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        resultado = reparar_n_hileras(conn, cursor, args.cuarteles)
+    finally:
+        cursor.close()
+        conn.close()
+
+    print(f"✅ {resultado['cuarteles_corregidos']} cuarteles corregidos, {time.perf_counter() - inicio:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
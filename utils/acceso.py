@@ -0,0 +1,293 @@
+from config import Config
+from utils.db import get_db_connection, db_connection
+from flask import g, has_request_context
+from flask_jwt_extended import get_jwt
+import threading
+import time
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Cache por proceso: usuario_id -> (expira_en, frozenset de id_sucursal)
+_cache_sucursales = {}
+_lock = threading.Lock()
+
+
+def _cargar_sucursales(cursor, usuario_id):
+    cursor.execute("""
+        SELECT id_sucursal
+        FROM usuario_pivot_sucursal_usuario
+        WHERE id_usuario = %s
+    """, (usuario_id,))
+    filas = cursor.fetchall()
+    return frozenset(
+        fila['id_sucursal'] if isinstance(fila, dict) else fila[0]
+        for fila in filas
+    )
+
+
+def sucursales_permitidas(usuario_id, cursor=None):
+    """
+    Devuelve el conjunto de sucursales permitidas del usuario. Si es el
+    usuario del token del request, salen del claim 'suc' sin consultar la BD.
+    Si no, se consulta usuario_pivot_sucursal_usuario una vez y se cachea
+    ACCESO_CACHE_TTL segundos. Si se pasa `cursor` se reutiliza su conexión.
+    """
+    claims = _claims_del_usuario(usuario_id)
+    if claims is not None and 'suc' in claims:
+        return frozenset(claims['suc'])
+
+    clave = str(usuario_id)
+    ahora = time.monotonic()
+
+    with _lock:
+        entrada = _cache_sucursales.get(clave)
+    if entrada and entrada[0] > ahora:
+        return entrada[1]
+
+    if cursor is not None:
+        sucursales = _cargar_sucursales(cursor, usuario_id)
+    else:
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(dictionary=True)
+            sucursales = _cargar_sucursales(cur, usuario_id)
+            cur.close()
+        finally:
+            conn.close()
+
+    with _lock:
+        _cache_sucursales[clave] = (ahora + Config.ACCESO_CACHE_TTL, sucursales)
+    return sucursales
+
+
+def tiene_acceso_sucursal(usuario_id, id_sucursal, cursor=None):
+    """Validar que el usuario tenga acceso a la sucursal"""
+    try:
+        id_sucursal = int(id_sucursal)
+    except (TypeError, ValueError):
+        return False
+    return id_sucursal in sucursales_permitidas(usuario_id, cursor)
+
+
+def invalidar_sucursales(usuario_id=None):
+    """Descarta el cache de un usuario (o de todos si no se indica), incluida su versión de token"""
+    with _lock:
+        if usuario_id is None:
+            _cache_sucursales.clear()
+            _cache_versiones.clear()
+        else:
+            _cache_sucursales.pop(str(usuario_id), None)
+            _cache_versiones.pop(str(usuario_id), None)
+
+
+def filtro_sucursales(columna, sucursales):
+    """
+    Construye el filtro SQL `columna IN (%s, ...)` con sus parámetros.
+    Con un conjunto vacío devuelve una condición que no calza con nada.
+    """
+    if not sucursales:
+        return "1 = 0", []
+    ids = sorted(sucursales)
+    return f"{columna} IN ({','.join(['%s'] * len(ids))})", ids
+
+
+# ============================================================================
+# CONTEXTO DE AUTORIZACIÓN EN EL TOKEN
+# ============================================================================
+
+# Perfil con acceso a la administración de usuarios
+PERFIL_ADMIN = 3
+
+# Versión de los tokens de cada usuario. Cambiar sus accesos (sucursales,
+# aplicaciones, permisos, perfil, estado) la incrementa y los tokens emitidos
+# con la versión anterior dejan de aceptarse: el cliente hace login de nuevo y
+# recibe claims al día. Otros workers e instancias lo notan al vencer
+# TOKEN_VERSION_TTL (unos segundos).
+DDL_TOKEN_VERSION = """
+    CREATE TABLE IF NOT EXISTS usuario_fact_token_version (
+        id_usuario VARCHAR(64) NOT NULL PRIMARY KEY,
+        version INT NOT NULL DEFAULT 0,
+        fecha_actualizacion DATETIME NOT NULL
+    )
+"""
+
+# Cache por proceso: usuario_id -> (expira_en, versión)
+_cache_versiones = {}
+_tabla_versiones_lista = False
+
+
+class ContextoAcceso:
+    """Accesos del usuario del request, tal como vienen en su token"""
+
+    def __init__(self, usuario_id, perfil, sucursales, apps, permisos):
+        self.usuario_id = usuario_id
+        self.perfil = perfil
+        self.sucursales = frozenset(sucursales)
+        self.apps = frozenset(apps)
+        self.permisos = frozenset(permisos)
+
+    @property
+    def es_admin(self):
+        return self.perfil == PERFIL_ADMIN
+
+
+def _claims_del_usuario(usuario_id):
+    """Claims del token del request si es de `usuario_id`, si no None"""
+    if not has_request_context():
+        return None
+    try:
+        claims = get_jwt()
+    except RuntimeError:
+        # El endpoint no pasó por @jwt_required
+        return None
+    if not claims or str(claims.get('sub')) != str(usuario_id):
+        return None
+    return claims
+
+
+def _ids(cursor, sql, usuario_id):
+    cursor.execute(sql, (usuario_id,))
+    return sorted(
+        fila[next(iter(fila))] if isinstance(fila, dict) else fila[0]
+        for fila in cursor.fetchall()
+    )
+
+
+def claims_acceso(cursor, usuario_id, perfil):
+    """
+    Claims de autorización para create_access_token (login y refresh):
+    sucursales, aplicaciones y permisos del usuario, su perfil y la versión
+    de token vigente, leída de la BD y no del cache: un token emitido con
+    una versión vieja quedaría revocado apenas venza el cache.
+    """
+    return {
+        'perfil': perfil,
+        'suc': _ids(cursor, "SELECT id_sucursal FROM usuario_pivot_sucursal_usuario WHERE id_usuario = %s", usuario_id),
+        'apps': _ids(cursor, "SELECT id_app FROM usuario_pivot_app_usuario WHERE id_usuario = %s", usuario_id),
+        'perm': _ids(cursor, "SELECT id_permiso FROM usuario_pivot_permiso_usuario WHERE id_usuario = %s", usuario_id),
+        'ver': version_token(usuario_id, cursor, fresca=True)
+    }
+
+
+def contexto_acceso():
+    """
+    ContextoAcceso del usuario del request (una vez por request). Los tokens
+    emitidos antes de que existieran estos claims se completan desde la BD.
+    """
+    if 'contexto_acceso' in g:
+        return g.contexto_acceso
+    claims = get_jwt()
+    usuario_id = claims['sub']
+    if 'suc' in claims:
+        contexto = ContextoAcceso(usuario_id, claims.get('perfil'), claims['suc'], claims.get('apps', []), claims.get('perm', []))
+    else:
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("SELECT id_perfil FROM general_dim_usuario WHERE id = %s", (usuario_id,))
+            usuario = cursor.fetchone()
+            datos = claims_acceso(cursor, usuario_id, usuario['id_perfil'] if usuario else None)
+            cursor.close()
+        contexto = ContextoAcceso(usuario_id, datos['perfil'], datos['suc'], datos['apps'], datos['perm'])
+    g.contexto_acceso = contexto
+    return contexto
+
+
+def _asegurar_tabla_versiones(cursor=None):
+    """
+    Crea la tabla de versiones (una vez por proceso). El DDL hace commit
+    implícito: con `cursor` solo si su conexión no tiene una transacción
+    abierta; sin él, con una conexión propia.
+    """
+    global _tabla_versiones_lista
+    if _tabla_versiones_lista:
+        return
+    with _lock:
+        if _tabla_versiones_lista:
+            return
+        if cursor is not None:
+            cursor.execute(DDL_TOKEN_VERSION)
+        else:
+            with db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(DDL_TOKEN_VERSION)
+                cursor.close()
+        _tabla_versiones_lista = True
+
+
+def _leer_version(cursor, clave):
+    cursor.execute("SELECT version FROM usuario_fact_token_version WHERE id_usuario = %s", (clave,))
+    fila = cursor.fetchone()
+    if fila is None:
+        return 0
+    return fila['version'] if isinstance(fila, dict) else fila[0]
+
+
+def version_token(usuario_id, cursor=None, fresca=False):
+    """
+    Versión vigente de los tokens del usuario (0 si nunca se revocaron). Si se
+    pasa `cursor` se lee con su conexión: login y refresh ya tienen una del
+    pool y pedir otra puede agotarlo en una ráfaga de logins. Con `fresca`
+    se salta el cache y se guarda el valor leído.
+    """
+    clave = str(usuario_id)
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _cache_versiones.get(clave)
+    if entrada and entrada[0] > ahora and not fresca:
+        return entrada[1]
+
+    if cursor is not None:
+        _asegurar_tabla_versiones(cursor)
+        version = _leer_version(cursor, clave)
+    else:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            _asegurar_tabla_versiones(cursor)
+            version = _leer_version(cursor, clave)
+            cursor.close()
+
+    with _lock:
+        _cache_versiones[clave] = (ahora + Config.TOKEN_VERSION_TTL, version)
+    return version
+
+
+def revocar_tokens(cursor, usuario_id):
+    """
+    Invalida los tokens emitidos al usuario. Va en la transacción que cambia
+    sus accesos, antes del commit; después del commit invalidar_sucursales()
+    descarta lo que otro request haya cacheado entretanto.
+    """
+    # La transacción de quien llama está abierta: si la tabla no existe se
+    # crea con otra conexión (solo la primera vez por proceso)
+    _asegurar_tabla_versiones()
+    cursor.execute("""
+        INSERT INTO usuario_fact_token_version (id_usuario, version, fecha_actualizacion)
+        VALUES (%s, 1, NOW())
+        ON DUPLICATE KEY UPDATE version = version + 1, fecha_actualizacion = NOW()
+    """, (str(usuario_id),))
+    with _lock:
+        _cache_versiones.pop(str(usuario_id), None)
+        _cache_sucursales.pop(str(usuario_id), None)
+
+
+def _token_revocado(jwt_header, jwt_payload):
+    # Los refresh tokens no llevan accesos: /refresh los lee de la BD
+    if jwt_payload.get('type') != 'access':
+        return False
+    return jwt_payload.get('ver', 0) != version_token(jwt_payload['sub'])
+
+
+def _respuesta_revocado(jwt_header, jwt_payload):
+    from flask import jsonify
+    return jsonify({
+        "error": "Los accesos del usuario cambiaron, inicie sesión nuevamente",
+        "codigo": "token_revocado"
+    }), 401
+
+
+def init_jwt(jwt):
+    """Rechaza los tokens con una versión anterior a la vigente del usuario"""
+    jwt.token_in_blocklist_loader(_token_revocado)
+    jwt.revoked_token_loader(_respuesta_revocado)
@@ -0,0 +1,130 @@
+from config import Config
+from itertools import islice
+from utils.registro import muestreo
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+def insertar_en_lotes(cursor, tabla, columnas, filas, expresiones=None, tamano_lote=None):
+    """
+    Inserta filas con sentencias INSERT multi-VALUES de hasta `tamano_lote` filas.
+
+    - `columnas`: columnas que reciben un valor por fila (en el orden de cada tupla).
+    - `filas`: iterable de tuplas; puede ser un generador, se consume por lotes.
+    - `expresiones`: columnas con el mismo SQL para todas las filas,
+      ej. {'fecha_creacion': 'NOW()'}. Solo para constantes del código, nunca input.
+
+    Retorna {"filas_insertadas", "lotes", "rangos_ids", "paso_ids"} donde
+    `rangos_ids` es una lista de (primer_id, ultimo_id) por lote. InnoDB asigna
+    a un INSERT multi-VALUES IDs seguidos separados por @@auto_increment_increment
+    (`paso_ids`, 1 salvo en réplicas multi-primario), así que el rango sale de
+    lastrowid + filas * paso. En tablas sin AUTO_INCREMENT la lista queda vacía.
+    """
+    expresiones = expresiones or {}
+    tamano_lote = tamano_lote or Config.BULK_INSERT_LOTE
+
+    nombres = ', '.join(list(columnas) + list(expresiones.keys()))
+    valores_fila = '(' + ', '.join(['%s'] * len(columnas) + list(expresiones.values())) + ')'
+    prefijo = f"INSERT INTO {tabla} ({nombres}) VALUES "
+
+    resultado = {"filas_insertadas": 0, "lotes": 0, "rangos_ids": [], "paso_ids": 1}
+    paso = None
+    filas = iter(filas)
+
+    while True:
+        lote = list(islice(filas, tamano_lote))
+        if not lote:
+            break
+
+        parametros = [valor for fila in lote for valor in fila]
+        cursor.execute(prefijo + ', '.join([valores_fila] * len(lote)), parametros)
+
+        resultado["filas_insertadas"] += len(lote)
+        resultado["lotes"] += 1
+        if cursor.lastrowid:
+            primer_id = cursor.lastrowid
+            if paso is None:
+                paso = _incremento_auto(cursor)
+                resultado["paso_ids"] = paso
+            resultado["rangos_ids"].append((primer_id, primer_id + (len(lote) - 1) * paso))
+
+    if resultado["lotes"] > 1:
+        logger.info("📦 %s: %s filas en %s lotes", tabla, resultado['filas_insertadas'], resultado['lotes'], extra=muestreo('bulk_lotes'))
+
+    return resultado
+
+
+def _incremento_auto(cursor):
+    """@@auto_increment_increment de la sesión (una lectura por llamada a insertar_en_lotes)"""
+    cursor.execute("SELECT @@auto_increment_increment AS paso")
+    fila = cursor.fetchone()
+    paso = fila['paso'] if isinstance(fila, dict) else fila[0]
+    return int(paso or 1)
+
+
+def ids_insertados(resultado):
+    """Expande los rangos de insertar_en_lotes() a la lista de IDs en orden de inserción"""
+    paso = resultado.get("paso_ids", 1)
+    return [i for primero, ultimo in resultado["rangos_ids"] for i in range(primero, ultimo + 1, paso)]
+
+
+def sincronizar_pivote(cursor, tabla, columna_duenio, columna_valor, asignaciones):
+    """
+    Deja en `tabla` exactamente las filas (dueño, valor) de `asignaciones`
+    ({id_dueño: iterable de valores}) para esos dueños. Compara contra las filas
+    actuales y solo borra las que sobran (un DELETE) e inserta las que faltan
+    (INSERT multi-VALUES): las filas que no cambian no se tocan y el usuario
+    no queda sin accesos a mitad de la transacción.
+
+    Retorna {"agregados", "eliminados", "por_duenio": {id: {"agregados", "eliminados"}}}.
+    Los valores se comparan como texto (el JSON puede traer 5 o "5").
+    """
+    deseados = {
+        duenio: {str(valor): valor for valor in valores}
+        for duenio, valores in asignaciones.items()
+    }
+    resultado = {"agregados": 0, "eliminados": 0, "por_duenio": {}}
+    if not deseados:
+        return resultado
+
+    duenios = list(deseados)
+    placeholders = ','.join(['%s'] * len(duenios))
+    # FOR UPDATE: dos sincronizaciones de los mismos dueños se serializan; con
+    # una lectura simple ambas calcularían los mismos faltantes y los insertarían
+    cursor.execute(f"""
+        SELECT {columna_duenio}, {columna_valor}
+        FROM {tabla}
+        WHERE {columna_duenio} IN ({placeholders})
+        FOR UPDATE
+    """, duenios)
+
+    por_duenio = {str(duenio): duenio for duenio in duenios}
+    actuales = {duenio: {} for duenio in duenios}
+    for fila in cursor.fetchall():
+        duenio, valor = (fila[columna_duenio], fila[columna_valor]) if isinstance(fila, dict) else fila
+        if str(duenio) in por_duenio:
+            actuales[por_duenio[str(duenio)]][str(valor)] = valor
+
+    sobrantes = []
+    faltantes = []
+    for duenio in duenios:
+        quitar = [valor for clave, valor in actuales[duenio].items() if clave not in deseados[duenio]]
+        agregar = [valor for clave, valor in deseados[duenio].items() if clave not in actuales[duenio]]
+        sobrantes.extend((duenio, valor) for valor in quitar)
+        faltantes.extend((duenio, valor) for valor in agregar)
+        resultado["por_duenio"][duenio] = {"agregados": len(agregar), "eliminados": len(quitar)}
+
+    if sobrantes:
+        pares = ', '.join(['(%s, %s)'] * len(sobrantes))
+        cursor.execute(
+            f"DELETE FROM {tabla} WHERE ({columna_duenio}, {columna_valor}) IN ({pares})",
+            [valor for par in sobrantes for valor in par]
+        )
+    if faltantes:
+        insertar_en_lotes(cursor, tabla, (columna_duenio, columna_valor), faltantes)
+
+    resultado["agregados"] = len(faltantes)
+    resultado["eliminados"] = len(sobrantes)
+    return resultado
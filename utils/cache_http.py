@@ -0,0 +1,93 @@
+from flask import current_app, make_response, request
+from functools import wraps
+import hashlib
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# GET condicional para las respuestas JSON. Toda respuesta 200 a un GET lleva
+# ETag (hash del cuerpo, o la versión que haya puesto el endpoint) y el
+# navegador la revalida con If-None-Match: si no cambió recibe 304 sin cuerpo.
+# Cache-Control por ruta con @politica_cache; por defecto POLITICA_DEFECTO.
+
+# Respuestas con token: solo el navegador del usuario las guarda y siempre revalida
+POLITICA_DEFECTO = 'private, no-cache'
+
+# No se guardan (estado que cambia en cada consulta o datos de diagnóstico)
+SIN_CACHE = 'no-store'
+
+
+def politica_cache(valor):
+    """
+    Cache-Control de la ruta. Va justo debajo de @...route(), así queda sobre
+    la función que Flask registra:
+
+        @bp.route('/jobs/<id>')
+        @politica_cache(SIN_CACHE)
+        @jwt_required()
+        def ...
+    """
+    def decorador(vista):
+        vista.politica_cache = valor
+        return vista
+    return decorador
+
+
+def version_previa(calcular_version):
+    """
+    Corta antes de ejecutar el endpoint si el cliente ya tiene la versión
+    vigente. `calcular_version(**view_args)` retorna un string que cambia
+    siempre que cambia la respuesta (o None si no se puede saber). Si calza
+    con If-None-Match responde 304 sin consultar la base de datos; si no,
+    ejecuta el endpoint y usa esa versión como ETag. Va debajo de @jwt_required.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            version = None
+            if request.method == 'GET':
+                try:
+                    version = calcular_version(**kwargs)
+                except Exception as e:
+                    # Sin versión se ejecuta el endpoint, que maneja sus propios errores
+                    logger.warning(f"No se pudo calcular la versión de {request.path}: {str(e)}")
+            if version and request.if_none_match.contains(version):
+                respuesta = current_app.response_class(status=304)
+                respuesta.set_etag(version)
+                return respuesta
+            respuesta = make_response(vista(*args, **kwargs))
+            if version and respuesta.status_code == 200:
+                respuesta.set_etag(version)
+            return respuesta
+        return envoltura
+    return decorador
+
+
+def _politica():
+    vista = current_app.view_functions.get(request.endpoint)
+    return getattr(vista, 'politica_cache', None) or POLITICA_DEFECTO
+
+
+def _aplicar_cache(respuesta):
+    if request.method not in ('GET', 'HEAD'):
+        return respuesta
+
+    if respuesta.status_code == 304 or (respuesta.status_code == 200 and respuesta.is_json):
+        if 'Cache-Control' not in respuesta.headers:
+            respuesta.headers['Cache-Control'] = _politica()
+
+    # Solo JSON completo en memoria: streaming y archivos quedan como están
+    if respuesta.status_code != 200 or not respuesta.is_json or respuesta.is_streamed or respuesta.direct_passthrough:
+        return respuesta
+    if respuesta.cache_control.no_store:
+        return respuesta
+
+    if 'ETag' not in respuesta.headers:
+        respuesta.set_etag(hashlib.sha1(respuesta.get_data()).hexdigest())
+    return respuesta.make_conditional(request)
+
+
+def init_app(app):
+    """Registra ETag / 304 / Cache-Control para todas las respuestas JSON"""
+    app.after_request(_aplicar_cache)
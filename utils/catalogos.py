@@ -0,0 +1,170 @@
+from config import Config
+from utils.db import db_connection
+from flask import jsonify
+from datetime import datetime, timezone
+import hashlib
+import json
+import threading
+import time
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Cache por proceso de tablas de referencia casi estáticas (especies,
+# variedades, atributos, opciones, tipos de planta). Cada catálogo se recarga
+# a los CATALOGOS_TTL_SEGUNDOS o cuando un endpoint de escritura lo invalida.
+# Con varias instancias de Cloud Run la invalidación es local: en las demás
+# el cambio se ve al vencer el TTL.
+_catalogos = {}
+_generacion = 0
+_lock = threading.Lock()
+
+# Resultado de SHOW TABLES por tabla: nombre -> (expira_en, existe)
+_tablas = {}
+
+
+class Catalogo:
+    """Datos de un catálogo con su versión (ETag) y fecha del último cambio"""
+
+    def __init__(self, datos, etag, modificado, expira_en):
+        self.datos = datos
+        self.etag = etag
+        self.modificado = modificado
+        self.expira_en = expira_en
+
+
+def _huella(datos):
+    contenido = json.dumps(datos, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(contenido).hexdigest()
+
+
+def obtener_catalogo(clave, cargar):
+    """
+    Retorna el Catalogo `clave`. Si no está o venció, llama a `cargar(cursor)`
+    con una conexión propia. Los datos se comparten entre requests: no
+    modificarlos, filtrar sobre copias.
+    """
+    ahora = time.monotonic()
+    with _lock:
+        actual = _catalogos.get(clave)
+        generacion = _generacion
+    if actual and actual.expira_en > ahora:
+        return actual
+
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            datos = cargar(cursor)
+        finally:
+            cursor.close()
+
+    etag = _huella(datos)
+    # Last-Modified solo avanza si el contenido cambió
+    if actual and actual.etag == etag:
+        modificado = actual.modificado
+    else:
+        modificado = datetime.now(timezone.utc).replace(microsecond=0)
+    catalogo = Catalogo(datos, etag, modificado, ahora + Config.CATALOGOS_TTL_SEGUNDOS)
+
+    with _lock:
+        # Si hubo una invalidación durante la carga, los datos pueden ser viejos
+        if generacion == _generacion:
+            _catalogos[clave] = catalogo
+    return catalogo
+
+
+def invalidar_catalogos(*claves):
+    """
+    Descarta los catálogos indicados, incluidos los derivados "clave:..."
+    (ej. 'tipos_planta' descarta 'tipos_planta:3'). Sin claves descarta todos.
+    """
+    global _generacion
+    with _lock:
+        _generacion += 1
+        for nombre in list(_catalogos):
+            if not claves or any(nombre == clave or nombre.startswith(f"{clave}:") for clave in claves):
+                del _catalogos[nombre]
+
+
+def respuesta_catalogo(catalogo, cuerpo, variante=None):
+    """
+    jsonify(cuerpo) con ETag y Last-Modified del catálogo. `variante` distingue
+    respuestas derivadas del mismo catálogo (un id, un filtro). El 304 y el
+    Cache-Control los resuelve utils/cache_http.py.
+    """
+    respuesta = jsonify(cuerpo)
+    respuesta.set_etag(version_catalogo(catalogo, variante))
+    respuesta.last_modified = catalogo.modificado
+    return respuesta
+
+
+def version_catalogo(catalogo, variante=None):
+    """ETag de una respuesta armada con el catálogo"""
+    return catalogo.etag if variante is None else f"{catalogo.etag}-{variante}"
+
+
+def tabla_existe(cursor, tabla):
+    """
+    SHOW TABLES LIKE cacheado: una tabla encontrada se da por existente el
+    resto del proceso; una ausente se vuelve a consultar al vencer el TTL.
+    """
+    ahora = time.monotonic()
+    entrada = _tablas.get(tabla)
+    if entrada and entrada[0] > ahora:
+        return entrada[1]
+    cursor.execute("SHOW TABLES LIKE %s", (tabla,))
+    existe = cursor.fetchone() is not None
+    _tablas[tabla] = (float('inf') if existe else ahora + Config.CATALOGOS_TTL_SEGUNDOS, existe)
+    return existe
+
+
+# ============================================================================
+# CATÁLOGOS COMPARTIDOS (rutas raíz y /api/conteo)
+# ============================================================================
+
+def _cargar_atributos(cursor):
+    # None si la tabla todavía no existe
+    if not tabla_existe(cursor, 'conteo_dim_atributocultivo'):
+        return None
+    cursor.execute("""
+        SELECT 
+            id,
+            nombre
+        FROM conteo_dim_atributocultivo
+        ORDER BY nombre
+    """)
+    return cursor.fetchall()
+
+
+def _cargar_especies(cursor):
+    # None si la tabla todavía no existe
+    if not tabla_existe(cursor, 'general_dim_especie'):
+        return None
+    cursor.execute("""
+        SELECT 
+            id,
+            nombre,
+            caja_equivalente
+        FROM general_dim_especie
+        ORDER BY nombre
+    """)
+    return cursor.fetchall()
+
+
+def catalogo_atributos():
+    """Atributos de cultivo (id, nombre); datos None si la tabla no existe"""
+    return obtener_catalogo('atributos', _cargar_atributos)
+
+
+def catalogo_especies():
+    """Todas las especies (id, nombre, caja_equivalente); datos None si la tabla no existe"""
+    return obtener_catalogo('especies_todas', _cargar_especies)
+
+
+def buscar_por_id(catalogo, id_buscado):
+    """Fila del catálogo con ese id, o None"""
+    for fila in catalogo.datos or []:
+        if fila['id'] == id_buscado:
+            return fila
+    return None
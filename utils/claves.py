@@ -0,0 +1,228 @@
+from config import Config
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import hashlib
+import hmac
+import os
+import threading
+import time
+import bcrypt
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Verificación de claves fuera del hilo del request. bcrypt.checkpw cuesta
+# ~250 ms de CPU por login: corre en un pool de CLAVES_PROCESOS procesos con
+# a lo más CLAVES_COLA_MAXIMA verificaciones pendientes. Con más, el login
+# responde 503 en vez de encolar sin límite.
+#
+# Cache opcional de verificaciones exitosas (CLAVES_CACHE_SEGUNDOS, 0 la
+# apaga): por usuario se guarda un HMAC de clave + hash guardado con una llave
+# aleatoria del proceso. Si la clave cambia, el hash guardado cambia y la
+# entrada deja de calzar aunque otra instancia no se haya enterado.
+#
+# Los hashes nuevos usan CLAVES_COSTO_BCRYPT. Un login válido con un hash de
+# otro costo (importaciones antiguas, costo cambiado) lo recalcula en segundo
+# plano: subir o bajar el costo no requiere migración.
+
+
+class ColaClavesLlenaError(Exception):
+    """Hay CLAVES_COLA_MAXIMA verificaciones pendientes"""
+
+
+_executor = None
+_executor_rehash = None
+_lock = threading.Lock()
+_pendientes = 0
+
+# str(usuario_id) -> (huella, expira_en)
+_cache = {}
+_llave_cache = os.urandom(32)
+
+
+def _checkpw(clave, hash_guardado):
+    # Corre en el proceso del pool: solo argumentos serializables
+    return bcrypt.checkpw(clave.encode('utf-8'), hash_guardado.encode('utf-8'))
+
+
+def _hashpw(clave, costo):
+    return bcrypt.hashpw(clave.encode('utf-8'), bcrypt.gensalt(rounds=costo)).decode('utf-8')
+
+
+def costo_hash(hash_guardado):
+    """Factor de trabajo de un hash bcrypt ($2b$12$...), o None si no es bcrypt"""
+    partes = (hash_guardado or '').split('$')
+    if len(partes) < 4 or not partes[2].isdigit():
+        return None
+    return int(partes[2])
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None and Config.CLAVES_PROCESOS != 0:
+            procesos = Config.CLAVES_PROCESOS
+            if procesos < 0:
+                from utils.servidor import cpus_disponibles
+                procesos = cpus_disponibles()
+            # spawn: el worker de gunicorn tiene hilos y fork los copiaría a medias
+            _executor = ProcessPoolExecutor(
+                max_workers=procesos,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executor
+
+
+def reiniciar_executor():
+    """Tras un fork: el pool de procesos del master no pertenece al hijo"""
+    global _executor, _executor_rehash, _lock, _pendientes
+    _executor = None
+    _executor_rehash = None
+    _lock = threading.Lock()
+    _pendientes = 0
+
+
+def pendientes():
+    return _pendientes
+
+
+def _huella(clave, hash_guardado):
+    return hmac.new(_llave_cache, f"{clave}\0{hash_guardado}".encode('utf-8'), hashlib.sha256).digest()
+
+
+def _en_cache(usuario_id, clave, hash_guardado):
+    entrada = _cache.get(str(usuario_id))
+    if not entrada or entrada[1] <= time.monotonic():
+        return False
+    return hmac.compare_digest(entrada[0], _huella(clave, hash_guardado))
+
+
+def _guardar_en_cache(usuario_id, clave, hash_guardado):
+    with _lock:
+        if len(_cache) >= Config.CLAVES_CACHE_MAXIMO:
+            # La más antigua (los dict mantienen el orden de inserción)
+            _cache.pop(next(iter(_cache)), None)
+        _cache.pop(str(usuario_id), None)
+        _cache[str(usuario_id)] = (_huella(clave, hash_guardado), time.monotonic() + Config.CLAVES_CACHE_SEGUNDOS)
+
+
+def invalidar_cache_clave(usuario_id):
+    """Olvida la verificación cacheada del usuario (cambio de clave)"""
+    with _lock:
+        _cache.pop(str(usuario_id), None)
+
+
+def _en_pool(funcion, *args):
+    global _pendientes, _executor
+    with _lock:
+        if _pendientes >= Config.CLAVES_COLA_MAXIMA:
+            raise ColaClavesLlenaError()
+        _pendientes += 1
+    try:
+        executor = _get_executor()
+        if executor is None:
+            return funcion(*args)
+        try:
+            return executor.submit(funcion, *args).result(timeout=Config.CLAVES_TIMEOUT)
+        except BrokenProcessPool:
+            # Un proceso murió (OOM): se rehace el pool y se verifica aquí
+            logger.warning("Pool de verificación de claves roto, se recrea")
+            with _lock:
+                if _executor is executor:
+                    _executor = None
+            executor.shutdown(wait=False)
+            return funcion(*args)
+    finally:
+        with _lock:
+            _pendientes -= 1
+
+
+def hashear_clave(clave):
+    """Hash bcrypt de `clave` con el costo CLAVES_COSTO_BCRYPT, calculado en el pool"""
+    return _en_pool(_hashpw, clave, Config.CLAVES_COSTO_BCRYPT)
+
+
+def verificar_clave(usuario_id, clave, hash_guardado, rehash=False):
+    """
+    True si `clave` corresponde a `hash_guardado`. Usa la cache si está
+    activa; si no, bcrypt en el pool. Lanza ColaClavesLlenaError si el pool
+    está saturado. Con `rehash`, si la clave es válida y el hash guardado no
+    tiene el costo CLAVES_COSTO_BCRYPT, se recalcula en segundo plano.
+    """
+    from utils.metricas import observar, sumar
+
+    if Config.CLAVES_CACHE_SEGUNDOS > 0 and _en_cache(usuario_id, clave, hash_guardado):
+        sumar('portal_claves_verificaciones_total', origen='cache')
+        return True
+
+    costo = costo_hash(hash_guardado)
+    inicio = time.perf_counter()
+    try:
+        valida = _en_pool(_checkpw, clave, hash_guardado)
+    except ColaClavesLlenaError:
+        sumar('portal_claves_rechazadas_total')
+        raise
+    observar('portal_claves_verificacion_segundos', time.perf_counter() - inicio, costo=str(costo))
+    sumar('portal_claves_verificaciones_total', origen='bcrypt')
+
+    if valida and Config.CLAVES_CACHE_SEGUNDOS > 0:
+        _guardar_en_cache(usuario_id, clave, hash_guardado)
+    if valida and rehash and costo != Config.CLAVES_COSTO_BCRYPT:
+        _get_executor_rehash().submit(_rehashear, usuario_id, clave, hash_guardado)
+    return valida
+
+
+# ============================================================================
+# REHASH AL COSTO CONFIGURADO
+# ============================================================================
+
+def _get_executor_rehash():
+    global _executor_rehash
+    with _lock:
+        if _executor_rehash is None:
+            _executor_rehash = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rehash')
+        return _executor_rehash
+
+
+def _rehashear(usuario_id, clave, hash_anterior):
+    """
+    Guarda la clave con el costo actual. Solo reemplaza si el hash guardado
+    sigue siendo el que se verificó: si el usuario cambió la clave entretanto,
+    no se pisa.
+    """
+    from utils.db import db_connection
+    from utils.metricas import sumar
+    try:
+        nuevo_hash = hashear_clave(clave)
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE general_dim_usuario SET clave = %s WHERE id = %s AND clave = %s",
+                (nuevo_hash, usuario_id, hash_anterior)
+            )
+            actualizado = cursor.rowcount
+            conn.commit()
+            cursor.close()
+        if actualizado:
+            invalidar_cache_clave(usuario_id)
+            sumar('portal_claves_rehash_total')
+            logger.info(f"Clave del usuario {usuario_id} rehasheada de costo {costo_hash(hash_anterior)} a {Config.CLAVES_COSTO_BCRYPT}")
+    except ColaClavesLlenaError:
+        # Se reintenta en el próximo login
+        pass
+    except Exception as e:
+        logger.warning(f"No se pudo rehashear la clave del usuario {usuario_id}: {str(e)}")
+
+
+def _registrar_metricas():
+    from utils.metricas import registrar_metrica
+    registrar_metrica('portal_claves_pendientes', 'gauge', 'Verificaciones de clave en curso o en cola', pendientes)
+    registrar_metrica('portal_claves_verificacion_segundos', 'histogram', 'Espera + bcrypt de cada verificación de clave, por costo del hash')
+    registrar_metrica('portal_claves_verificaciones_total', 'counter', 'Verificaciones de clave por origen (cache o bcrypt)')
+    registrar_metrica('portal_claves_rechazadas_total', 'counter', 'Logins rechazados con 503 por cola de verificación llena')
+    registrar_metrica('portal_claves_rehash_total', 'counter', 'Claves recalculadas al costo CLAVES_COSTO_BCRYPT tras un login')
+
+
+_registrar_metricas()
@@ -0,0 +1,89 @@
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# general_dim_cuartel.n_hileras se mantiene con actualizaciones relativas en la
+# misma transacción que crea o da de baja la hilera. Nunca se escribe un total
+# calculado en Python a partir de una lectura previa: con varios usuarios
+# editando el mismo cuartel, esa lectura queda vieja y el contador se desvía.
+
+# Recalcula n_hileras en una sola pasada. Solo toca cuarteles que ya tienen
+# hileras creadas: en los demás n_hileras es el valor declarado antes del
+# catastro (ver /cuarteles/catastro-masivo).
+_REPARAR = """
+    UPDATE general_dim_cuartel c
+    INNER JOIN (
+        SELECT id_cuartel, SUM(id_estado = 1) as total
+        FROM general_dim_hilera
+        {}
+        GROUP BY id_cuartel
+    ) h ON h.id_cuartel = c.id
+    SET c.n_hileras = h.total
+    WHERE NOT (c.n_hileras <=> h.total)
+"""
+
+
+def bloquear_cuartel(cursor, id_cuartel):
+    """
+    Bloquea la fila del cuartel hasta el commit y retorna cuántas hileras
+    activas tiene (None si no existe). Va al inicio de toda transacción que
+    crea o da de baja hileras, antes de tocar general_dim_hilera: así esas
+    transacciones se ordenan por el cuartel y no se cruzan bloqueando
+    hileras. El conteo es una lectura con bloqueo para ver lo último
+    confirmado y no la foto de la transacción.
+    """
+    cursor.execute("SELECT id FROM general_dim_cuartel WHERE id = %s FOR UPDATE", (id_cuartel,))
+    if not cursor.fetchone():
+        return None
+    cursor.execute("""
+        SELECT COUNT(*) AS activas
+        FROM general_dim_hilera
+        WHERE id_cuartel = %s AND id_estado = 1
+        LOCK IN SHARE MODE
+    """, (id_cuartel,))
+    fila = cursor.fetchone()
+    return fila['activas'] if isinstance(fila, dict) else fila[0]
+
+
+def sumar_hileras(cursor, id_cuartel, delta, hileras_previas=None):
+    """
+    Suma `delta` (positivo o negativo) a n_hileras del cuartel y retorna el
+    nuevo valor. El UPDATE deja bloqueada la fila del cuartel hasta el commit,
+    así que la lectura siguiente ve el valor que quedará confirmado.
+
+    `hileras_previas` es lo que retornó bloquear_cuartel(). Si era 0, las
+    hileras agregadas son las primeras y n_hileras pasa a `delta`: el valor
+    declarado antes del catastro no se suma a las hileras reales.
+    """
+    if delta > 0 and hileras_previas == 0:
+        cursor.execute("UPDATE general_dim_cuartel SET n_hileras = %s WHERE id = %s", (delta, id_cuartel))
+    elif delta:
+        cursor.execute("""
+            UPDATE general_dim_cuartel
+            SET n_hileras = GREATEST(COALESCE(n_hileras, 0) + %s, 0)
+            WHERE id = %s
+        """, (delta, id_cuartel))
+    cursor.execute("SELECT n_hileras FROM general_dim_cuartel WHERE id = %s", (id_cuartel,))
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    return fila['n_hileras'] if isinstance(fila, dict) else fila[0]
+
+
+def reparar_n_hileras(conn, cursor, id_cuarteles=None, progreso=None):
+    """
+    Corrige n_hileras contando las hileras activas. Sin `id_cuarteles` repara
+    todos los cuarteles en una sola sentencia. Sirve como job (encolar_job)
+    y desde reparar_n_hileras.py.
+    """
+    if id_cuarteles:
+        filtro = "WHERE id_cuartel IN ({})".format(', '.join(['%s'] * len(id_cuarteles)))
+        cursor.execute(_REPARAR.format(filtro), list(id_cuarteles))
+    else:
+        cursor.execute(_REPARAR.format(""))
+    corregidos = cursor.rowcount
+    conn.commit()
+
+    logger.info(f"🔧 n_hileras corregido en {corregidos} cuarteles")
+    return {"cuarteles_corregidos": corregidos}
@@ -0,0 +1,159 @@
+from utils.db import db_connection
+import threading
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Plantas activas (id_estado = 1) por hilera. Lo mantienen las rutas que crean o
+# dan de baja plantas, en la misma transacción, para que los endpoints de
+# plantillas/info no tengan que hacer COUNT(*) ... GROUP BY sobre toda
+# general_dim_planta. El total por cuartel es la suma de sus hileras.
+TABLA_CONTEO = 'general_fact_conteo_planta_hilera'
+
+DDL_CONTEO = f"""
+    CREATE TABLE IF NOT EXISTS {TABLA_CONTEO} (
+        id_hilera INT NOT NULL PRIMARY KEY,
+        plantas_activas INT NOT NULL DEFAULT 0,
+        fecha_actualizacion DATETIME NOT NULL
+    )
+"""
+
+# Recuenta las hileras de un grupo de cuarteles (incluye las que quedaron en 0)
+_RECONTAR = f"""
+    INSERT INTO {TABLA_CONTEO} (id_hilera, plantas_activas, fecha_actualizacion)
+    SELECT h.id, COUNT(p.id), NOW()
+    FROM general_dim_hilera h
+    LEFT JOIN general_dim_planta p ON p.id_hilera = h.id AND p.id_estado = 1
+    WHERE h.id_cuartel IN ({{}})
+    GROUP BY h.id
+    ON DUPLICATE KEY UPDATE
+        plantas_activas = VALUES(plantas_activas),
+        fecha_actualizacion = VALUES(fecha_actualizacion)
+"""
+
+# Recuenta hileras sueltas que todavía no tienen fila (ver sumar_plantas)
+_SEMBRAR = f"""
+    INSERT INTO {TABLA_CONTEO} (id_hilera, plantas_activas, fecha_actualizacion)
+    SELECT h.id, COUNT(p.id), NOW()
+    FROM general_dim_hilera h
+    LEFT JOIN general_dim_planta p ON p.id_hilera = h.id AND p.id_estado = 1
+    WHERE h.id IN ({{}})
+    GROUP BY h.id
+    ON DUPLICATE KEY UPDATE
+        plantas_activas = VALUES(plantas_activas),
+        fecha_actualizacion = VALUES(fecha_actualizacion)
+"""
+
+# Columna de lectura "plantas activas de la hilera h" con el conteo unido como p.
+# Una hilera sin fila (antes del primer recuento) se cuenta en el momento: el
+# COALESCE solo evalúa la subconsulta cuando falta la fila.
+SQL_PLANTAS_ACTIVAS = """COALESCE(p.plantas_activas, (
+                    SELECT COUNT(*) FROM general_dim_planta pl
+                    WHERE pl.id_hilera = h.id AND pl.id_estado = 1
+                ))"""
+
+# Cuarteles por sentencia de recuento
+LOTE_CUARTELES = 200
+
+_tabla_lista = False
+_lock = threading.Lock()
+
+
+def asegurar_tabla_conteo():
+    """
+    Crea la tabla de conteo si no existe (una vez por proceso). Usa una
+    conexión propia: el CREATE TABLE hace commit implícito y no debe cortar la
+    transacción de quien llama. No la llena: cada hilera se siembra con su
+    recuento en su primer cambio (sumar_plantas) y las lecturas cuentan las
+    que faltan (SQL_PLANTAS_ACTIVAS). reconciliar_conteo_plantas.py la
+    completa de una vez.
+    """
+    global _tabla_lista
+    if _tabla_lista:
+        return
+    with _lock:
+        if _tabla_lista:
+            return
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(DDL_CONTEO)
+            cursor.close()
+        _tabla_lista = True
+
+
+def sumar_plantas(cursor, deltas):
+    """
+    Aplica `deltas` ({id_hilera: +n / -n}) al conteo. Se llama con el cursor
+    de la escritura de plantas, después de escribirlas y antes de su commit.
+    Una hilera que todavía no tiene fila se siembra con su recuento, que en
+    esta transacción ya incluye el cambio: nunca queda una fila con solo el
+    delta.
+    """
+    deltas = {id_hilera: delta for id_hilera, delta in deltas.items() if id_hilera and delta}
+    if not deltas:
+        return
+    asegurar_tabla_conteo()
+
+    # En orden de id_hilera para que dos cargas concurrentes bloqueen en el mismo orden
+    ids = sorted(deltas)
+    cursor.execute(f"""
+        SELECT id_hilera FROM {TABLA_CONTEO}
+        WHERE id_hilera IN ({', '.join(['%s'] * len(ids))})
+        ORDER BY id_hilera
+        FOR UPDATE
+    """, ids)
+    existentes = {fila['id_hilera'] if isinstance(fila, dict) else fila[0] for fila in cursor.fetchall()}
+
+    nuevas = [id_hilera for id_hilera in ids if id_hilera not in existentes]
+    if nuevas:
+        cursor.execute(_SEMBRAR.format(', '.join(['%s'] * len(nuevas))), nuevas)
+
+    altas = [(id_hilera, deltas[id_hilera]) for id_hilera in ids if id_hilera in existentes and deltas[id_hilera] > 0]
+    bajas = [(id_hilera, -deltas[id_hilera]) for id_hilera in ids if id_hilera in existentes and deltas[id_hilera] < 0]
+
+    if altas:
+        cursor.execute(f"""
+            INSERT INTO {TABLA_CONTEO} (id_hilera, plantas_activas, fecha_actualizacion)
+            VALUES {', '.join(['(%s, %s, NOW())'] * len(altas))}
+            ON DUPLICATE KEY UPDATE
+                plantas_activas = plantas_activas + VALUES(plantas_activas),
+                fecha_actualizacion = VALUES(fecha_actualizacion)
+        """, [valor for alta in altas for valor in alta])
+
+    for id_hilera, cantidad in bajas:
+        cursor.execute(f"""
+            UPDATE {TABLA_CONTEO}
+            SET plantas_activas = GREATEST(plantas_activas - %s, 0), fecha_actualizacion = NOW()
+            WHERE id_hilera = %s
+        """, (cantidad, id_hilera))
+
+
+def reconciliar(conn, cursor, id_cuarteles=None, progreso=None):
+    """
+    Recalcula el conteo desde general_dim_planta, por lotes de LOTE_CUARTELES
+    con un commit por lote. Sin `id_cuarteles` recorre todos los cuarteles.
+    Sirve como job (encolar_job) y desde reconciliar_conteo_plantas.py.
+    """
+    if id_cuarteles is None:
+        cursor.execute("SELECT DISTINCT id_cuartel FROM general_dim_hilera ORDER BY id_cuartel")
+        id_cuarteles = [fila['id_cuartel'] for fila in cursor.fetchall()]
+
+    for inicio in range(0, len(id_cuarteles), LOTE_CUARTELES):
+        lote = id_cuarteles[inicio:inicio + LOTE_CUARTELES]
+        # REPEATABLE READ: el INSERT ... SELECT es una lectura con bloqueo de
+        # general_dim_planta. Espera a que las cargas en curso sobre esas
+        # hileras hagan commit y las cuenta, y las que empiecen después
+        # esperan a este commit. Con una lectura sin bloqueo (READ COMMITTED)
+        # no se verían las plantas de una carga sin commit y su +n se
+        # perdería al sobrescribir la fila. El orden es el mismo de las
+        # cargas (plantas primero, después el conteo), así no se cruzan.
+        conn.commit()
+        cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        cursor.execute(_RECONTAR.format(', '.join(['%s'] * len(lote))), lote)
+        conn.commit()
+        if progreso:
+            progreso.avanzar(inicio + len(lote), {"cuarteles_recontados": inicio + len(lote)})
+
+    logger.info(f"📊 Conteo de plantas reconciliado para {len(id_cuarteles)} cuarteles")
+    return {"cuarteles_recontados": len(id_cuarteles)}
@@ -1,32 +1,40 @@
 import mysql.connector
 from config import Config
+from utils.metricas import CursorMedido, registrar_espera_conexion
+from contextlib import contextmanager
 import os
 import re
+import queue
+import threading
+import time
 import logging
 
 # Configurar logging
 logger = logging.getLogger(__name__)
 
-def get_db_connection():
+
+# ============================================================================
+# PARSEO DE DATABASE_URL (una sola vez al importar)
+# ============================================================================
+
+def _parse_database_url():
+    """Convierte la configuración en los parámetros de mysql.connector.connect()"""
     # Usar DATABASE_URL si está disponible (como la API de tickets)
     if hasattr(Config, 'DATABASE_URL') and Config.DATABASE_URL:
-        logger.info(f"🔍 DATABASE_URL: {Config.DATABASE_URL}")
-        
+        # La URL trae la clave: no se loguea (ver utils/registro.py)
+
         # Parsear DATABASE_URL con formato de Cloud SQL
         # Formato: mysql+pymysql://user:password@/database?unix_socket=/cloudsql/instance
         url = Config.DATABASE_URL
-        
+
         # Extraer componentes usando regex corregido
         pattern = r'mysql\+pymysql://([^:]+):([^@]+)@/([^?]+)\?unix_socket=([^/]+)/(.+)'
         match = re.match(pattern, url)
-        
+
         if match:
             user, password, database, socket_prefix, instance = match.groups()
-            logger.info(f"✅ Parseado correctamente:")
-            logger.info(f"   User: {user}")
-            logger.info(f"   Database: {database}")
-            logger.info(f"   Instance: {instance}")
-            
+            logger.info(f"✅ DATABASE_URL parseada: usuario={user} base={database} instancia={instance}")
+
             # Para Cloud SQL con unix_socket, usar localhost
             connection_params = {
                 'host': 'localhost',
@@ -36,27 +44,26 @@ def get_db_connection():
                 'port': 3306,
                 'unix_socket': f'/cloudsql/{instance}'
             }
-            logger.info(f"🔗 Parámetros de conexión: {connection_params}")
-            
-            return mysql.connector.connect(**connection_params)
+
+            return connection_params
         else:
-            logger.error(f"❌ No se pudo parsear DATABASE_URL: {url}")
+            logger.error(f"❌ No se pudo parsear DATABASE_URL (formato Cloud SQL esperado)")
             logger.error(f"❌ Pattern no coincidió")
-            
+
             # Intentar parsear manualmente
             try:
                 # Remover mysql+pymysql://
                 url_clean = url.replace('mysql+pymysql://', '')
-                
+
                 # Separar credenciales y resto
                 if '@/' in url_clean:
                     credentials, rest = url_clean.split('@/', 1)
                     user, password = credentials.split(':', 1)
-                    
+
                     # Separar database y parámetros
                     if '?' in rest:
                         database, params = rest.split('?', 1)
-                        
+
                         # Extraer unix_socket
                         if 'unix_socket=' in params:
                             socket_part = params.split('unix_socket=', 1)[1]
@@ -65,12 +72,9 @@ def get_db_connection():
                                 instance = socket_part.replace('/cloudsql/', '')
                             else:
                                 instance = socket_part
-                            
-                            logger.info(f"✅ Parseado manualmente:")
-                            logger.info(f"   User: {user}")
-                            logger.info(f"   Database: {database}")
-                            logger.info(f"   Instance: {instance}")
-                            
+
+                            logger.info(f"✅ DATABASE_URL parseada manualmente: usuario={user} base={database} instancia={instance}")
+
                             connection_params = {
                                 'host': 'localhost',
                                 'user': user,
@@ -79,50 +83,310 @@ def get_db_connection():
                                 'port': 3306,
                                 'unix_socket': f'/cloudsql/{instance}'
                             }
-                            logger.info(f"🔗 Parámetros de conexión: {connection_params}")
-                            
-                            return mysql.connector.connect(**connection_params)
-                
+
+                            return connection_params
+
                 logger.error(f"❌ Parseado manual también falló")
-                
+
             except Exception as e:
                 logger.error(f"❌ Error en parseado manual: {str(e)}")
-            
+
             # Fallback para formato simple
             url = url.replace('mysql+pymysql://', '')
             if '@' in url:
                 credentials, rest = url.split('@', 1)
                 user, password = credentials.split(':', 1)
                 host, database = rest.split('/', 1)
-                
+
                 logger.info(f"🔄 Usando fallback con host: {host}")
-                return mysql.connector.connect(
-                    host=host,
-                    user=user,
-                    password=password,
-                    database=database,
-                    port=3306
-                )
+                return {
+                    'host': host,
+                    'user': user,
+                    'password': password,
+                    'database': database,
+                    'port': 3306
+                }
             else:
                 # Formato sin host (localhost implícito)
                 credentials, database = url.split('/', 1)
                 user, password = credentials.split(':', 1)
-                
+
                 logger.info(f"🔄 Usando fallback localhost")
-                return mysql.connector.connect(
-                    host='localhost',
-                    user=user,
-                    password=password,
-                    database=database,
-                    port=3306
-                )
+                return {
+                    'host': 'localhost',
+                    'user': user,
+                    'password': password,
+                    'database': database,
+                    'port': 3306
+                }
     else:
         logger.info("🔄 Usando configuración anterior (sin DATABASE_URL)")
         # Fallback a la configuración anterior
-        return mysql.connector.connect(
-            host=Config.DB_HOST,
-            user=Config.DB_USER,
-            password=Config.DB_PASSWORD,
-            database=Config.DB_NAME,
-            port=Config.DB_PORT
-        )
+        return {
+            'host': Config.DB_HOST,
+            'user': Config.DB_USER,
+            'password': Config.DB_PASSWORD,
+            'database': Config.DB_NAME,
+            'port': Config.DB_PORT
+        }
+
+
+CONNECTION_PARAMS = _parse_database_url()
+
+
+# ============================================================================
+# POOL DE CONEXIONES
+# ============================================================================
+
+class PoolAgotadoError(Exception):
+    """No se obtuvo una conexión libre dentro de DB_POOL_TIMEOUT segundos"""
+
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión del pool. Se comporta como la conexión de
+    mysql.connector, pero close() la devuelve al pool en vez de cerrarla.
+    """
+
+    def __init__(self, pool, conn, creada_en):
+        self._pool = pool
+        self._conn = conn
+        self._creada_en = creada_en
+        self._devuelta = False
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        """Cursor de la conexión, medido si METRICAS_ACTIVAS (utils/metricas.py)"""
+        cursor = self._conn.cursor(*args, **kwargs)
+        if Config.METRICAS_ACTIVAS:
+            return CursorMedido(cursor)
+        return cursor
+
+    def begin(self):
+        """Compatibilidad con la API de PyMySQL usada en los blueprints"""
+        if not self._conn.in_transaction:
+            self._conn.start_transaction()
+
+    def close(self):
+        if self._devuelta:
+            return
+        self._devuelta = True
+        self._pool._devolver(self._conn, self._creada_en)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            try:
+                self._conn.rollback()
+            except Exception:
+                pass
+        self.close()
+        return False
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones MySQL por proceso.
+
+    - `size`: máximo de conexiones abiertas simultáneamente.
+    - `timeout`: segundos a esperar por una conexión libre.
+    - `recycle`: segundos de vida de una conexión antes de reemplazarla.
+    - `pre_ping`: segundos de inactividad tras los cuales se hace ping al sacarla.
+    """
+
+    def __init__(self, params, size=5, timeout=30, recycle=1800, pre_ping=10):
+        self._params = params
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._libres = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._abiertas = 0
+
+    def _crear(self):
+        conn = mysql.connector.connect(**self._params)
+        return conn, time.monotonic()
+
+    def _descartar(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._abiertas -= 1
+
+    def _reservar_cupo(self):
+        with self._lock:
+            if self._abiertas < self.size:
+                self._abiertas += 1
+                return True
+            return False
+
+    def _sana(self, conn, creada_en, liberada_en):
+        """Valida una conexión libre antes de entregarla"""
+        ahora = time.monotonic()
+        if self.recycle and ahora - creada_en > self.recycle:
+            return False
+        if self.pre_ping is not None and ahora - liberada_en >= self.pre_ping:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def obtener(self):
+        """Entrega una conexión del pool (o crea una nueva si hay cupo)"""
+        limite = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn, creada_en, liberada_en = self._libres.get_nowait()
+            except queue.Empty:
+                if self._reservar_cupo():
+                    try:
+                        conn, creada_en = self._crear()
+                    except Exception:
+                        with self._lock:
+                            self._abiertas -= 1
+                        raise
+                    return PooledConnection(self, conn, creada_en)
+
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    raise PoolAgotadoError(
+                        f"No hay conexiones disponibles (pool de {self.size})"
+                    )
+                try:
+                    conn, creada_en, liberada_en = self._libres.get(timeout=restante)
+                except queue.Empty:
+                    continue
+
+            if self._sana(conn, creada_en, liberada_en):
+                return PooledConnection(self, conn, creada_en)
+
+            # Conexión vencida o caída: se descarta y se intenta con otra
+            logger.info("🔄 Reciclando conexión del pool")
+            self._descartar(conn)
+
+    def _devolver(self, conn, creada_en):
+        """Limpia el estado de la conexión y la deja libre para otro request"""
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            # Descarta cualquier transacción que el endpoint no confirmó
+            conn.rollback()
+        except Exception as e:
+            logger.warning(f"Conexión descartada al devolverla al pool: {str(e)}")
+            self._descartar(conn)
+            return
+        self._libres.put((conn, creada_en, time.monotonic()))
+
+    def cerrar_todas(self):
+        """Cierra las conexiones libres (las prestadas se cierran al devolverse)"""
+        while True:
+            try:
+                conn, _, _ = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+    def estado(self):
+        return {
+            "tamano": self.size,
+            "abiertas": self._abiertas,
+            "libres": self._libres.qsize()
+        }
+
+
+def _crear_pool():
+    return ConnectionPool(
+        CONNECTION_PARAMS,
+        size=Config.DB_POOL_SIZE,
+        timeout=Config.DB_POOL_TIMEOUT,
+        recycle=Config.DB_POOL_RECYCLE,
+        pre_ping=Config.DB_POOL_PRE_PING
+    )
+
+
+_pool = _crear_pool()
+
+
+def get_pool():
+    return _pool
+
+
+def reiniciar_pool():
+    """
+    Pool nuevo y vacío. Se llama en cada worker de gunicorn después del fork:
+    las conexiones heredadas del master comparten el socket con él y no se
+    pueden usar ni cerrar desde el hijo.
+    """
+    global _pool
+    _pool = _crear_pool()
+
+
+def get_db_connection():
+    """
+    Obtiene una conexión del pool. Llamar a conn.close() la devuelve al pool.
+    Dentro de un request, las conexiones no devueltas se liberan en el teardown.
+    """
+    inicio = time.monotonic()
+    conn = _pool.obtener()
+    registrar_espera_conexion(time.monotonic() - inicio)
+    try:
+        from flask import g, has_app_context
+        if has_app_context():
+            g.setdefault('_db_conexiones', []).append(conn)
+    except ImportError:
+        pass
+    return conn
+
+
+@contextmanager
+def db_connection():
+    """
+    Uso:
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            ...
+    La conexión vuelve al pool al salir del bloque, incluso con return o excepción.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
+
+
+def desvincular_del_request(conn):
+    """
+    Saca la conexión de las que se liberan en el teardown del request. La usa
+    quien la siga ocupando después de retornar la respuesta (streaming) y se
+    encarga de cerrarla.
+    """
+    from flask import g, has_app_context
+    if has_app_context():
+        conexiones = g.get('_db_conexiones', [])
+        if conn in conexiones:
+            conexiones.remove(conn)
+
+
+def _liberar_conexiones_request(exc=None):
+    from flask import g
+    for conn in g.pop('_db_conexiones', []):
+        conn.close()
+
+
+def init_app(app):
+    """Registra la devolución automática de conexiones al terminar cada request"""
+    app.teardown_appcontext(_liberar_conexiones_request)
@@ -0,0 +1,37 @@
+from config import Config
+from flask import g, has_request_context
+import json
+import random
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Consultas y logs de diagnóstico fuera del camino normal de los endpoints.
+# Solo corren con DIAGNOSTICO_ACTIVO=True y en una fracción
+# DIAGNOSTICO_MUESTREO de los requests; el log va en una línea JSON acotada.
+
+
+def diagnostico_activo():
+    """True si este request está muestreado para diagnóstico (se decide una vez por request)"""
+    if not Config.DIAGNOSTICO_ACTIVO:
+        return False
+    if not has_request_context():
+        return random.random() < Config.DIAGNOSTICO_MUESTREO
+    if '_diagnostico' not in g:
+        g._diagnostico = random.random() < Config.DIAGNOSTICO_MUESTREO
+    return g._diagnostico
+
+
+def resumen_filas(filas):
+    """Total y las primeras DIAGNOSTICO_MAX_FILAS filas"""
+    filas = list(filas or [])
+    return {"total": len(filas), "muestra": filas[:Config.DIAGNOSTICO_MAX_FILAS]}
+
+
+def registrar_diagnostico(evento, **datos):
+    """Una línea JSON con el evento y sus datos, cortada a DIAGNOSTICO_MAX_CARACTERES"""
+    linea = json.dumps({"diagnostico": evento, **datos}, default=str, ensure_ascii=False)
+    if len(linea) > Config.DIAGNOSTICO_MAX_CARACTERES:
+        linea = linea[:Config.DIAGNOSTICO_MAX_CARACTERES] + '...(truncado)'
+    logger.info(linea)
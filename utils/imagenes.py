@@ -0,0 +1,202 @@
+from config import Config
+from io import BytesIO
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# En mapeo_fact_registro.imagen queda el sha256 (hex) de la imagen; las filas
+# antiguas pueden tener todavía el base64 completo (ver migrar_imagenes.py)
+PATRON_HASH = re.compile(r'^[0-9a-f]{64}$')
+
+# Firma de los primeros bytes -> mimetype
+_FIRMAS = [
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif')
+]
+
+
+class ImagenInvalidaError(ValueError):
+    """El valor recibido no es un base64 válido o excede IMAGENES_MAX_BYTES"""
+
+
+def es_hash(valor):
+    return isinstance(valor, str) and PATRON_HASH.match(valor) is not None
+
+
+def mimetype_de(cabecera):
+    """Mimetype según los primeros bytes del archivo"""
+    for firma, mimetype in _FIRMAS:
+        if cabecera.startswith(firma):
+            return mimetype
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def decodificar_base64(valor):
+    """Acepta base64 plano o data URL ('data:image/jpeg;base64,...')"""
+    if valor.startswith('data:'):
+        valor = valor.split(',', 1)[-1]
+    valor = ''.join(valor.split())
+    if len(valor) * 3 // 4 > Config.IMAGENES_MAX_BYTES:
+        raise ImagenInvalidaError(f"La imagen supera el máximo de {Config.IMAGENES_MAX_BYTES} bytes")
+    try:
+        datos = base64.b64decode(valor, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImagenInvalidaError("La imagen no es un base64 válido")
+    if not datos:
+        raise ImagenInvalidaError("La imagen está vacía")
+    return datos
+
+
+# ============================================================================
+# ALMACENAMIENTO
+# ============================================================================
+
+class AlmacenLocal:
+    """
+    Imágenes direccionadas por contenido en un directorio: <raiz>/ab/cd/<clave>.
+    La clave es el sha256 del original o "<sha256>_<variante>" para sus derivadas.
+    IMAGENES_DIR debe ser un volumen compartido por todas las instancias y que
+    sobreviva a los reinicios: en Cloud Run el disco del contenedor es memoria.
+    """
+
+    def __init__(self, raiz):
+        self.raiz = raiz
+
+    def ruta(self, clave):
+        return os.path.join(self.raiz, clave[:2], clave[2:4], clave)
+
+    def existe(self, clave):
+        return os.path.exists(self.ruta(clave))
+
+    def guardar(self, clave, datos):
+        if self.existe(clave):
+            return
+        destino = self.ruta(clave)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        # Escritura atómica: nunca queda visible un archivo a medio escribir
+        fd, temporal = tempfile.mkstemp(dir=os.path.dirname(destino), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as archivo:
+                archivo.write(datos)
+            os.replace(temporal, destino)
+        except Exception:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+
+    def abrir(self, clave):
+        """(archivo binario abierto, tamaño en bytes), o None si la imagen no está"""
+        try:
+            archivo = open(self.ruta(clave), 'rb')
+        except FileNotFoundError:
+            return None
+        return archivo, os.fstat(archivo.fileno()).st_size
+
+
+class AlmacenGCS:
+    """
+    Las mismas claves como objetos de un bucket de Cloud Storage, compartido
+    por todas las instancias. Requiere google-cloud-storage; las credenciales
+    son las de la cuenta de servicio de Cloud Run.
+    """
+
+    def __init__(self, bucket):
+        from google.cloud import storage
+        from google.api_core import exceptions
+        self._exceptions = exceptions
+        self.bucket = storage.Client().bucket(bucket)
+
+    def existe(self, clave):
+        return self.bucket.blob(clave).exists()
+
+    def guardar(self, clave, datos):
+        try:
+            # Solo si no existe: el contenido de una clave nunca cambia
+            self.bucket.blob(clave).upload_from_string(datos, if_generation_match=0)
+        except self._exceptions.PreconditionFailed:
+            pass
+
+    def abrir(self, clave):
+        """(archivo binario en memoria, tamaño en bytes), o None si la imagen no está"""
+        try:
+            datos = self.bucket.blob(clave).download_as_bytes()
+        except self._exceptions.NotFound:
+            return None
+        return BytesIO(datos), len(datos)
+
+
+_BACKENDS = {
+    'local': lambda: AlmacenLocal(Config.IMAGENES_DIR),
+    'gcs': lambda: AlmacenGCS(Config.IMAGENES_BUCKET)
+}
+
+_almacen = None
+_lock = threading.Lock()
+
+
+def validar_almacen():
+    """
+    Falla al arrancar si el almacén no está configurado. Sin IMAGENES_DIR el
+    backend local escribiría en el disco del contenedor, que en Cloud Run se
+    pierde al reiniciar y no lo ven las otras instancias.
+    """
+    if Config.IMAGENES_BACKEND not in _BACKENDS:
+        raise RuntimeError(f"IMAGENES_BACKEND desconocido: {Config.IMAGENES_BACKEND}")
+    if Config.IMAGENES_BACKEND == 'local' and not Config.IMAGENES_DIR:
+        raise RuntimeError("IMAGENES_BACKEND=local requiere IMAGENES_DIR (un volumen persistente compartido)")
+    if Config.IMAGENES_BACKEND == 'gcs' and not Config.IMAGENES_BUCKET:
+        raise RuntimeError("IMAGENES_BACKEND=gcs requiere IMAGENES_BUCKET")
+
+
+def get_almacen():
+    """Backend configurado en IMAGENES_BACKEND (una instancia por proceso)"""
+    global _almacen
+    if _almacen is None:
+        with _lock:
+            if _almacen is None:
+                validar_almacen()
+                _almacen = _BACKENDS[Config.IMAGENES_BACKEND]()
+    return _almacen
+
+
+def reiniciar_almacen():
+    """Tras un fork: el cliente de Cloud Storage del master no se comparte"""
+    global _almacen, _lock
+    _almacen = None
+    _lock = threading.Lock()
+
+
+def guardar_imagen(datos):
+    """Guarda los bytes y retorna su sha256 (hex)"""
+    hash_imagen = hashlib.sha256(datos).hexdigest()
+    get_almacen().guardar(hash_imagen, datos)
+    return hash_imagen
+
+
+def guardar_imagen_base64(valor):
+    """
+    Decodifica la imagen recibida en base64 una sola vez y la guarda.
+    Retorna el hash a guardar en la fila (None si no vino imagen). Un hash de
+    una imagen ya guardada se acepta tal cual.
+    """
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        return None
+    if not isinstance(valor, str):
+        raise ImagenInvalidaError("La imagen debe venir como texto base64")
+    if es_hash(valor):
+        if not get_almacen().existe(valor):
+            raise ImagenInvalidaError("La imagen referenciada no existe")
+        return valor
+    return guardar_imagen(decodificar_base64(valor))
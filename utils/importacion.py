@@ -0,0 +1,243 @@
+from openpyxl import load_workbook
+import codecs
+import csv
+import unicodedata
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Encabezados de las plantillas (normalizados) -> campo de la carga masiva
+COLUMNAS_CUARTELES = {
+    'cuartel': 'cuartel',
+    'nombre': 'nombre',
+    'id sucursal': 'id_sucursal',
+    'superficie': 'superficie',
+    'numero de hileras': 'n_hileras',
+    'id variedad': 'id_variedad',
+    'ano plantacion': 'ano_plantacion',
+    'dsh': 'dsh',
+    'deh': 'deh',
+    'hilera': 'hilera',
+    'planta': 'planta',
+    'ubicacion gps': 'ubicacion'
+}
+
+COLUMNAS_REGISTROS = {
+    'id planta': 'id_planta',
+    'id tipo planta': 'id_tipoplanta',
+    'id evaluador': 'id_evaluador',
+    'hora registro': 'hora_registro',
+    'imagen (base64)': 'imagen',
+    'imagen': 'imagen'
+}
+
+# Nombres de hoja aceptados por tipo (plantilla simple y plantilla completa)
+HOJAS = {
+    'cuarteles': ['Carga Masiva Cuarteles', 'Cuarteles'],
+    'registros': ['Carga Masiva Registros', 'Registros']
+}
+
+
+class ArchivoInvalidoError(Exception):
+    """El archivo no tiene el formato o las hojas esperadas"""
+
+
+def normalizar_encabezado(texto):
+    """'Número de Hileras' -> 'numero de hileras'"""
+    texto = unicodedata.normalize('NFKD', str(texto or '')).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(texto.lower().split())
+
+
+def _vacia(fila):
+    return all(valor is None or str(valor).strip() == '' for valor in fila)
+
+
+def _filas_con_encabezado(filas, columnas):
+    """
+    Toma la primera fila como encabezado y entrega (numero_fila, dict) por fila
+    con datos, usando solo las columnas conocidas. Las celdas vacías quedan en None.
+    """
+    filas = iter(filas)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return
+
+    indices = {}
+    for idx, titulo in enumerate(encabezado):
+        campo = columnas.get(normalizar_encabezado(titulo))
+        if campo and campo not in indices.values():
+            indices[idx] = campo
+    if not indices:
+        raise ArchivoInvalidoError("El archivo no tiene los encabezados de la plantilla")
+
+    for numero_fila, fila in enumerate(filas, start=2):
+        if _vacia(fila):
+            continue
+        registro = {}
+        for idx, campo in indices.items():
+            valor = fila[idx] if idx < len(fila) else None
+            if isinstance(valor, str):
+                valor = valor.strip() or None
+            registro[campo] = valor
+        yield numero_fila, registro
+
+
+class LectorPlanilla:
+    """
+    Lector en streaming de .xlsx (openpyxl read_only) o .csv (csv.reader sobre el stream).
+    Uso:
+        with LectorPlanilla(file.stream, file.filename) as lector:
+            for numero_fila, fila in lector.filas('cuarteles', COLUMNAS_CUARTELES):
+                ...
+    """
+
+    def __init__(self, stream, nombre_archivo):
+        self.stream = stream
+        self.extension = nombre_archivo.lower().rsplit('.', 1)[-1]
+        self.libro = None
+        self.filas_leidas = 0
+
+        if self.extension == 'xls':
+            raise ArchivoInvalidoError("Formato .xls no soportado: guardar el archivo como .xlsx o .csv")
+        if self.extension not in ('xlsx', 'csv'):
+            raise ArchivoInvalidoError("Solo se permiten archivos Excel (.xlsx) o CSV")
+
+    def __enter__(self):
+        if self.extension == 'xlsx':
+            try:
+                self.libro = load_workbook(self.stream, read_only=True, data_only=True)
+            except Exception as e:
+                raise ArchivoInvalidoError(f"No se pudo leer el Excel: {str(e)}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.libro is not None:
+            self.libro.close()
+        return False
+
+    @property
+    def es_csv(self):
+        return self.extension == 'csv'
+
+    def tiene_hoja(self, tipo):
+        if self.es_csv:
+            return True
+        return any(nombre in self.libro.sheetnames for nombre in HOJAS[tipo])
+
+    def filas(self, tipo, columnas):
+        """Itera (numero_fila, dict) de la hoja del tipo pedido sin cargarla completa"""
+        if self.es_csv:
+            # Decodifica línea a línea; Excel en español suele exportar CSV con ';'
+            lineas = codecs.iterdecode(self.stream, 'utf-8-sig')
+            primera = next(lineas, '')
+            delimitador = ';' if primera.count(';') > primera.count(',') else ','
+            filas = csv.reader(_con_primera_linea(primera, lineas), delimiter=delimitador)
+        else:
+            nombre = next((n for n in HOJAS[tipo] if n in self.libro.sheetnames), None)
+            hoja = self.libro[nombre] if nombre else self.libro.worksheets[0]
+            filas = hoja.iter_rows(values_only=True)
+
+        for numero_fila, fila in _filas_con_encabezado(filas, columnas):
+            self.filas_leidas += 1
+            yield numero_fila, fila
+
+
+def _con_primera_linea(primera, resto):
+    yield primera
+    yield from resto
+
+
+# Campos numéricos de la plantilla de cuarteles
+_TIPOS_CUARTEL = {
+    'id_sucursal': int,
+    'superficie': float,
+    'n_hileras': int,
+    'id_variedad': int,
+    'ano_plantacion': int,
+    'dsh': float,
+    'deh': float
+}
+
+
+def _convertir(valor, tipo):
+    if valor is None:
+        return None
+    if tipo is int:
+        numero = float(str(valor).replace(',', '.'))
+        if not numero.is_integer():
+            raise ValueError(valor)
+        return int(numero)
+    return float(str(valor).replace(',', '.'))
+
+
+def _nombre_hilera(valor):
+    """La plantilla usa 'Hilera N'; una celda con solo el número también sirve"""
+    if isinstance(valor, (int, float)) or str(valor).strip().isdigit():
+        return f"Hilera {int(float(valor))}"
+    return str(valor).strip()
+
+
+def cuarteles_desde_filas(filas):
+    """
+    Agrupa las filas de la plantilla de cuarteles en el formato de /cuarteles/bulk.
+    Una fila con Cuartel o Nombre abre un cuartel; las siguientes con esas
+    columnas vacías solo agregan Hilera/Planta/Ubicación al cuartel abierto.
+
+    Entrega (numero_fila, cuartel_data, errores) de a un cuartel, para que la
+    memoria dependa del tamaño de un cuartel y no del archivo. `cuartel_data`
+    es None cuando la fila no se puede usar; `errores` trae los problemas de
+    conversión como {"fila", "campo", "error"}.
+    """
+    actual = None
+
+    def cerrar(cuartel):
+        numero_fila, datos, hileras, errores = cuartel
+        if hileras:
+            datos['hileras'] = [
+                {"hilera": nombre, "plantas": plantas} for nombre, plantas in hileras.items()
+            ]
+        return numero_fila, (None if errores else datos), errores
+
+    for numero_fila, fila in filas:
+        if fila.get('cuartel') is not None or fila.get('nombre') is not None:
+            if actual:
+                yield cerrar(actual)
+
+            datos = {}
+            errores = []
+            for campo, tipo in _TIPOS_CUARTEL.items():
+                try:
+                    valor = _convertir(fila.get(campo), tipo)
+                except ValueError:
+                    errores.append({
+                        "fila": numero_fila,
+                        "campo": campo,
+                        "error": f"Valor numérico inválido: {fila.get(campo)}"
+                    })
+                    continue
+                if valor is not None:
+                    datos[campo] = valor
+            if fila.get('nombre') is not None:
+                datos['nombre'] = str(fila['nombre'])
+            actual = (numero_fila, datos, {}, errores)
+
+        elif actual is None:
+            yield numero_fila, None, [{
+                "fila": numero_fila,
+                "campo": "nombre",
+                "error": "Fila de hilera/planta sin un cuartel antes"
+            }]
+            continue
+
+        # Hilera y planta (en la fila del cuartel o en las de continuación)
+        if fila.get('hilera') is not None:
+            plantas = actual[2].setdefault(_nombre_hilera(fila['hilera']), [])
+            if fila.get('planta') is not None:
+                planta = {"planta": fila['planta']}
+                if fila.get('ubicacion') is not None:
+                    planta['ubicacion'] = str(fila['ubicacion'])
+                plantas.append(planta)
+
+    if actual:
+        yield cerrar(actual)
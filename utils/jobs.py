@@ -0,0 +1,239 @@
+from config import Config
+from utils.db import db_connection
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import json
+import threading
+import time
+import uuid
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Jobs y progreso de cargas largas. Se guardan en MySQL para que un token sirva
+# desde cualquier instancia de Cloud Run.
+DDL_JOBS = """
+    CREATE TABLE IF NOT EXISTS general_fact_job (
+        id CHAR(36) NOT NULL PRIMARY KEY,
+        id_usuario VARCHAR(36) NOT NULL,
+        tipo VARCHAR(50) NOT NULL,
+        estado VARCHAR(20) NOT NULL,
+        filas_confirmadas INT NOT NULL DEFAULT 0,
+        resultado MEDIUMTEXT NULL,
+        fecha_creacion DATETIME NOT NULL,
+        fecha_actualizacion DATETIME NOT NULL,
+        KEY idx_job_usuario (id_usuario)
+    )
+"""
+
+_tabla_lista = False
+_lock = threading.Lock()
+_executor = None
+
+
+def asegurar_tabla(cursor):
+    """Crea general_fact_job si no existe (una vez por proceso)"""
+    global _tabla_lista
+    if _tabla_lista:
+        return
+    with _lock:
+        if not _tabla_lista:
+            cursor.execute(DDL_JOBS)
+            _tabla_lista = True
+
+
+def crear_job(cursor, usuario_id, tipo, resultado=None, estado='en_proceso'):
+    """Registra un job nuevo y retorna su id (el token que ve el cliente)"""
+    asegurar_tabla(cursor)
+    job_id = str(uuid.uuid4())
+    ahora = datetime.now()
+    cursor.execute("""
+        INSERT INTO general_fact_job (
+            id, id_usuario, tipo, estado, filas_confirmadas, resultado,
+            fecha_creacion, fecha_actualizacion
+        ) VALUES (%s, %s, %s, %s, 0, %s, %s, %s)
+    """, (job_id, str(usuario_id), tipo, estado, json.dumps(resultado or {}, default=str), ahora, ahora))
+    return job_id
+
+
+def obtener_job(cursor, job_id, usuario_id=None):
+    """Retorna el job como dict (con `resultado` ya decodificado) o None"""
+    asegurar_tabla(cursor)
+    query = "SELECT * FROM general_fact_job WHERE id = %s"
+    params = [job_id]
+    if usuario_id is not None:
+        query += " AND id_usuario = %s"
+        params.append(str(usuario_id))
+    cursor.execute(query, params)
+    fila = cursor.fetchone()
+    if not fila:
+        return None
+    if not isinstance(fila, dict):
+        fila = dict(zip(cursor.column_names, fila))
+    fila['resultado'] = json.loads(fila['resultado']) if fila.get('resultado') else {}
+    return fila
+
+
+def actualizar_job(cursor, job_id, estado=None, filas_confirmadas=None, resultado=None):
+    """
+    Actualiza estado/progreso del job. Se llama con el mismo cursor de la carga,
+    antes del commit del lote, para que progreso y datos se confirmen juntos.
+    """
+    campos = ["fecha_actualizacion = %s"]
+    valores = [datetime.now()]
+    if estado is not None:
+        campos.append("estado = %s")
+        valores.append(estado)
+    if filas_confirmadas is not None:
+        campos.append("filas_confirmadas = %s")
+        valores.append(filas_confirmadas)
+    if resultado is not None:
+        campos.append("resultado = %s")
+        valores.append(json.dumps(resultado, default=str))
+    valores.append(job_id)
+    cursor.execute(f"UPDATE general_fact_job SET {', '.join(campos)} WHERE id = %s", valores)
+
+
+def reclamar_job(cursor, job_id, usuario_id, espera_segundos):
+    """
+    Pasa el job a en_proceso si no está completado y nadie lo está
+    procesando (sin avances en `espera_segundos`). Es un solo UPDATE
+    condicional: de dos requests con el mismo token solo uno lo obtiene.
+    Retorna True si este lo reclamó; se confirma con el commit de quien llama.
+    """
+    ahora = datetime.now()
+    cursor.execute("""
+        UPDATE general_fact_job
+        SET estado = 'en_proceso', fecha_actualizacion = %s
+        WHERE id = %s AND id_usuario = %s
+        AND estado <> 'completado'
+        AND (estado <> 'en_proceso' OR fecha_actualizacion < %s)
+    """, (ahora, job_id, str(usuario_id), ahora - timedelta(seconds=espera_segundos)))
+    return cursor.rowcount == 1
+
+
+def job_publico(job):
+    """Formato de respuesta de /api/jobs/<id>"""
+    estado = job['estado']
+    # Un job en proceso sin avances en mucho tiempo quedó huérfano (reinicio de
+    # la instancia). Uno pendiente solo espera un hilo libre de JOBS_WORKERS:
+    # su fecha_actualizacion es la de creación y no mide avance.
+    if estado == 'en_proceso' and \
+            datetime.now() - job['fecha_actualizacion'] > timedelta(seconds=Config.JOBS_SIN_PROGRESO):
+        estado = 'interrumpido'
+    resultado = job['resultado'] or {}
+    return {
+        "id": job['id'],
+        "tipo": job['tipo'],
+        "estado": estado,
+        "total": resultado.get('total'),
+        "procesados": resultado.get('procesados', job['filas_confirmadas']),
+        "resultado": resultado,
+        "fecha_creacion": job['fecha_creacion'].isoformat() if job.get('fecha_creacion') else None,
+        "fecha_actualizacion": job['fecha_actualizacion'].isoformat() if job.get('fecha_actualizacion') else None
+    }
+
+
+# ============================================================================
+# EJECUCIÓN EN SEGUNDO PLANO
+# ============================================================================
+
+def reiniciar_executor():
+    """Tras un fork: los hilos del executor heredado no existen en el hijo"""
+    global _executor, _lock
+    _executor = None
+    _lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.JOBS_WORKERS, thread_name_prefix='job')
+        return _executor
+
+
+def _guardar(job_id, **campos):
+    """Actualiza el job con una conexión propia, fuera de la transacción del trabajo"""
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        actualizar_job(cursor, job_id, **campos)
+        conn.commit()
+        cursor.close()
+
+
+class ProgresoJob:
+    """
+    Lo recibe la función del job para informar avance. Escribe en la tabla
+    como máximo cada JOBS_PROGRESO_SEGUNDOS para no agregar carga a la BD.
+    """
+
+    def __init__(self, job_id, total=None):
+        self.job_id = job_id
+        self.total = total
+        self.procesados = 0
+        self._ultimo_guardado = 0
+
+    def avanzar(self, procesados, estadisticas=None, forzar=False):
+        self.procesados = procesados
+        ahora = time.monotonic()
+        if not forzar and ahora - self._ultimo_guardado < Config.JOBS_PROGRESO_SEGUNDOS:
+            return
+        self._ultimo_guardado = ahora
+        resultado = dict(estadisticas or {}, total=self.total, procesados=procesados)
+        try:
+            _guardar(self.job_id, filas_confirmadas=procesados, resultado=resultado)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el progreso del job {self.job_id}: {str(e)}")
+
+
+def _ejecutar(job_id, funcion, args, total):
+    progreso = ProgresoJob(job_id, total)
+    inicio = time.monotonic()
+    try:
+        _guardar(job_id, estado='en_proceso')
+        with db_connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            try:
+                resultado = funcion(conn, cursor, *args, progreso=progreso)
+            finally:
+                cursor.close()
+
+        resultado = dict(resultado or {}, total=total, procesados=total if total is not None else progreso.procesados)
+        _guardar(job_id, estado='completado', filas_confirmadas=resultado['procesados'], resultado=resultado)
+        logger.info(f"Job {job_id} completado en {time.monotonic() - inicio:.1f}s")
+
+    except Exception as e:
+        logger.error(f"Job {job_id} falló: {str(e)}")
+        try:
+            _guardar(job_id, estado='error', resultado={
+                "total": total,
+                "procesados": progreso.procesados,
+                "error": str(e)
+            })
+        except Exception as e_guardar:
+            logger.error(f"No se pudo marcar el job {job_id} como fallido: {str(e_guardar)}")
+
+
+def pide_async(args):
+    """True si el request pidió ejecución en segundo plano (?async=1)"""
+    return str(args.get('async', '')).lower() in ('1', 'true', 'si')
+
+
+def encolar_job(usuario_id, tipo, funcion, *args, total=None):
+    """
+    Registra el job y lo ejecuta en un hilo del pool JOBS_WORKERS.
+    `funcion(conn, cursor, *args, progreso=ProgresoJob)` recibe una conexión
+    propia, hace sus commits y retorna el dict de resultado.
+    Retorna el id del job para consultar en /api/jobs/<id>.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        job_id = crear_job(cursor, usuario_id, tipo, {"total": total, "procesados": 0}, estado='pendiente')
+        conn.commit()
+        cursor.close()
+
+    _get_executor().submit(_ejecutar, job_id, funcion, args, total)
+    logger.info(f"Job {job_id} ({tipo}) encolado")
+    return job_id
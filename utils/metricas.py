@@ -0,0 +1,294 @@
+from config import Config
+from flask import current_app, g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+from utils.registro import muestreo
+from utils.servidor import limite_ruta
+import threading
+import time
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Tiempos por request: consultas SQL (cantidad, filas, duración), espera por
+# una conexión del pool, serialización JSON y total. Cada respuesta los lleva
+# en el header Server-Timing y se acumulan por endpoint en histogramas que
+# /api/metrics expone en formato de texto de Prometheus. Un endpoint con
+# consultas dentro de un loop (N+1) se ve en portal_sql_consultas_por_request.
+
+# Límites superiores de los buckets (el último, +Inf, se agrega al exponer)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BUCKETS_CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+_lock = threading.Lock()
+_histogramas = {}
+_contadores = {}
+_gauges = {}
+
+
+class MedicionRequest:
+    """Acumulado del request en curso (vive en flask.g)"""
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.sql_consultas = 0
+        self.sql_filas = 0
+        self.sql_segundos = 0.0
+        self.conexion_segundos = 0.0
+        self.json_segundos = 0.0
+
+
+def medicion_actual():
+    """MedicionRequest del request en curso, o None (jobs, scripts, sin métricas)"""
+    if not Config.METRICAS_ACTIVAS or not has_request_context():
+        return None
+    return g.get('_medicion')
+
+
+def registrar_consulta(sql, segundos, filas=0, nueva=True):
+    """Suma tiempo y filas de una sentencia al request en curso y loguea las lentas"""
+    medicion = medicion_actual()
+    if medicion is not None:
+        if nueva:
+            medicion.sql_consultas += 1
+        medicion.sql_filas += filas
+        medicion.sql_segundos += segundos
+    if nueva and segundos * 1000 >= Config.METRICAS_SQL_LENTA_MS:
+        texto = ' '.join(str(sql).split())
+        logger.warning(
+            "🐢 Consulta lenta (%.0f ms) en %s: %.300s",
+            segundos * 1000, request.endpoint if has_request_context() else 'segundo plano', texto,
+            extra=muestreo('sql_lenta')
+        )
+
+
+def registrar_espera_conexion(segundos):
+    medicion = medicion_actual()
+    if medicion is not None:
+        medicion.conexion_segundos += segundos
+
+
+class CursorMedido:
+    """
+    Envoltorio del cursor de mysql.connector que mide cada execute y los
+    fetch de su resultado. El resto de atributos (lastrowid, rowcount,
+    with_rows, close...) pasan directo al cursor original.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._sql = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._sql = operation
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            duracion = time.perf_counter() - inicio
+            # En escrituras cuenta las filas afectadas; en SELECT, las que se lean
+            filas = 0 if self._cursor.with_rows else max(self._cursor.rowcount or 0, 0)
+            registrar_consulta(operation, duracion, filas)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        self._sql = operation
+        inicio = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            registrar_consulta(operation, time.perf_counter() - inicio, max(self._cursor.rowcount or 0, 0))
+
+    def _medir_fetch(self, metodo, *args):
+        inicio = time.perf_counter()
+        resultado = metodo(*args)
+        if resultado is None:
+            filas = 0
+        elif isinstance(resultado, list):
+            filas = len(resultado)
+        else:
+            filas = 1
+        registrar_consulta(self._sql, time.perf_counter() - inicio, filas, nueva=False)
+        return resultado
+
+    def fetchone(self):
+        return self._medir_fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._medir_fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args):
+        return self._medir_fetch(self._cursor.fetchmany, *args)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._cursor.close()
+        return False
+
+
+class ProveedorJSONMedido(DefaultJSONProvider):
+    """jsonify() con el tiempo de serialización sumado al request en curso"""
+
+    def dumps(self, obj, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            medicion = medicion_actual()
+            if medicion is not None:
+                medicion.json_segundos += time.perf_counter() - inicio
+
+
+# ============================================================================
+# AGREGADOS POR ENDPOINT
+# ============================================================================
+
+def _observar(nombre, etiquetas, valor, buckets):
+    clave = (nombre, etiquetas)
+    with _lock:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = {'buckets': buckets, 'conteos': [0] * len(buckets), 'suma': 0.0, 'total': 0}
+        for i, limite in enumerate(buckets):
+            if valor <= limite:
+                histograma['conteos'][i] += 1
+        histograma['suma'] += valor
+        histograma['total'] += 1
+
+
+def _sumar(nombre, etiquetas, valor=1):
+    clave = (nombre, etiquetas)
+    with _lock:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def registrar_metrica(nombre, tipo, ayuda, valor_actual=None):
+    """
+    Agrega una métrica de otro módulo a /api/metrics. tipo 'counter' o
+    'histogram' (se alimentan con sumar/observar) o 'gauge' con
+    `valor_actual()`, que se consulta al exponer.
+    """
+    _AYUDA.setdefault(nombre, (tipo, ayuda))
+    if valor_actual is not None:
+        _gauges[nombre] = valor_actual
+
+
+def sumar(nombre, valor=1, **etiquetas):
+    _sumar(nombre, tuple(sorted(etiquetas.items())), valor)
+
+
+def observar(nombre, valor, buckets=BUCKETS_SEGUNDOS, **etiquetas):
+    _observar(nombre, tuple(sorted(etiquetas.items())), valor, buckets)
+
+
+def _iniciar_medicion():
+    if Config.METRICAS_ACTIVAS:
+        g._medicion = MedicionRequest()
+
+
+def _cerrar_medicion(respuesta):
+    medicion = g.pop('_medicion', None)
+    if medicion is None:
+        return respuesta
+    total = time.perf_counter() - medicion.inicio
+
+    respuesta.headers['Server-Timing'] = ', '.join([
+        f'db;dur={medicion.sql_segundos * 1000:.1f};desc="{medicion.sql_consultas} consultas, {medicion.sql_filas} filas"',
+        f'conn;dur={medicion.conexion_segundos * 1000:.1f}',
+        f'json;dur={medicion.json_segundos * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}'
+    ])
+
+    endpoint = (('endpoint', request.endpoint or 'sin_ruta'), ('metodo', request.method))
+    _sumar('portal_requests_total', endpoint + (('estado', str(respuesta.status_code)),))
+    _observar('portal_request_duracion_segundos', endpoint, total, BUCKETS_SEGUNDOS)
+    _observar('portal_sql_consultas_por_request', endpoint, medicion.sql_consultas, BUCKETS_CONSULTAS)
+    _sumar('portal_sql_segundos_total', endpoint, medicion.sql_segundos)
+    _sumar('portal_sql_filas_total', endpoint, medicion.sql_filas)
+    _sumar('portal_db_conexion_espera_segundos_total', endpoint, medicion.conexion_segundos)
+    _sumar('portal_json_segundos_total', endpoint, medicion.json_segundos)
+
+    # Presupuesto de la clase de ruta (utils/servidor.py): se informa, no se corta
+    clase, limite = limite_ruta(current_app.view_functions.get(request.endpoint))
+    if limite and total > limite:
+        _sumar('portal_requests_fuera_de_limite_total', endpoint + (('clase', clase),))
+        logger.warning(
+            "⏱️ %s %s tardó %.1f s (límite %s: %.0f s)", request.method, request.path, total, clase, limite,
+            extra=muestreo('fuera_de_limite')
+        )
+    return respuesta
+
+
+def _etiquetas(etiquetas, extra=()):
+    pares = []
+    for nombre, valor in etiquetas + extra:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"')
+        pares.append(f'{nombre}="{valor}"')
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+_AYUDA = {
+    'portal_requests_total': ('counter', 'Requests atendidos por endpoint, método y estado HTTP'),
+    'portal_request_duracion_segundos': ('histogram', 'Duración total del request (sin el envío de respuestas en streaming)'),
+    'portal_sql_consultas_por_request': ('histogram', 'Sentencias SQL ejecutadas por request'),
+    'portal_sql_segundos_total': ('counter', 'Tiempo en execute/fetch de SQL'),
+    'portal_sql_filas_total': ('counter', 'Filas leídas o afectadas por SQL'),
+    'portal_db_conexion_espera_segundos_total': ('counter', 'Tiempo esperando una conexión del pool'),
+    'portal_json_segundos_total': ('counter', 'Tiempo serializando respuestas JSON'),
+    'portal_requests_fuera_de_limite_total': ('counter', 'Requests que pasaron el presupuesto de su clase de ruta'),
+}
+
+
+def texto_prometheus(pool=None):
+    """Agregados acumulados desde que arrancó el proceso, en formato de texto de Prometheus"""
+    with _lock:
+        histogramas = {clave: dict(h, conteos=list(h['conteos'])) for clave, h in _histogramas.items()}
+        contadores = dict(_contadores)
+
+    lineas = []
+    for nombre, (tipo, ayuda) in _AYUDA.items():
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        if tipo == 'gauge':
+            if nombre in _gauges:
+                lineas.append(f'{nombre} {_gauges[nombre]():g}')
+            continue
+        if tipo == 'counter':
+            for (metrica, etiquetas), valor in sorted(contadores.items()):
+                if metrica == nombre:
+                    lineas.append(f'{nombre}{_etiquetas(etiquetas)} {valor:g}')
+            continue
+        for (metrica, etiquetas), h in sorted(histogramas.items()):
+            if metrica != nombre:
+                continue
+            for limite, conteo in zip(h['buckets'], h['conteos']):
+                lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas, (("le", f"{limite:g}"),))} {conteo}')
+            lineas.append(f'{nombre}_bucket{_etiquetas(etiquetas, (("le", "+Inf"),))} {h["total"]}')
+            lineas.append(f'{nombre}_sum{_etiquetas(etiquetas)} {h["suma"]:g}')
+            lineas.append(f'{nombre}_count{_etiquetas(etiquetas)} {h["total"]}')
+
+    if pool is not None:
+        for clave, valor in pool.estado().items():
+            lineas.append(f'# TYPE portal_db_pool_{clave} gauge')
+            lineas.append(f'portal_db_pool_{clave} {valor}')
+    return '\n'.join(lineas) + '\n'
+
+
+def init_app(app):
+    """
+    Mide cada request y agrega Server-Timing. Se registra antes que
+    utils/cache_http para que su after_request corra último y vea el estado
+    final (200 o 304).
+    """
+    if not Config.METRICAS_ACTIVAS:
+        return
+    app.json = ProveedorJSONMedido(app)
+    app.before_request(_iniciar_medicion)
+    app.after_request(_cerrar_medicion)
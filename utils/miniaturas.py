@@ -0,0 +1,102 @@
+from config import Config
+from utils.imagenes import get_almacen
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from io import BytesIO
+import threading
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Variantes reducidas de las imágenes de registros: nombre -> lado máximo (px) y calidad
+VARIANTES = {
+    'miniatura': {'lado': Config.IMAGENES_MINIATURA_PX, 'calidad': 70},
+    'media': {'lado': Config.IMAGENES_MEDIA_PX, 'calidad': 80}
+}
+
+# Formato de las variantes (WEBP o JPEG)
+_FORMATO = Config.IMAGENES_FORMATO_VARIANTES.upper()
+
+_executor = None
+_lock = threading.Lock()
+
+
+def clave_variante(hash_imagen, variante):
+    return f"{hash_imagen}_{variante}"
+
+
+def _reducir(original, lado, calidad):
+    """Bytes de la imagen reducida para que su lado mayor no pase de `lado`"""
+    with Image.open(BytesIO(original)) as imagen:
+        # En JPEG decodifica directo a una escala cercana (mucho menos memoria que la foto completa)
+        imagen.draft('RGB', (lado, lado))
+        # Las fotos de celular vienen rotadas por EXIF; se aplica antes de reducir
+        imagen = ImageOps.exif_transpose(imagen)
+        if imagen.mode not in ('RGB', 'L'):
+            imagen = imagen.convert('RGB')
+        imagen.thumbnail((lado, lado), Image.LANCZOS)
+        salida = BytesIO()
+        imagen.save(salida, format=_FORMATO, quality=calidad)
+    return salida.getvalue()
+
+
+def reducir_variante(original, variante):
+    """Bytes de la variante a partir de los bytes del original, sin pasar por el almacén"""
+    opciones = VARIANTES[variante]
+    return _reducir(original, opciones['lado'], opciones['calidad'])
+
+
+def generar_variantes(hash_imagen, variantes=None):
+    """
+    Genera las variantes que falten de una imagen del almacén.
+    Retorna la lista de variantes generadas (vacía si ya estaban todas).
+    """
+    almacen = get_almacen()
+    pendientes = [
+        nombre for nombre in (variantes or VARIANTES)
+        if not almacen.existe(clave_variante(hash_imagen, nombre))
+    ]
+    if not pendientes:
+        return []
+
+    abierta = almacen.abrir(hash_imagen)
+    if abierta is None:
+        raise FileNotFoundError(f"Imagen {hash_imagen} no está en el almacén")
+    archivo, _ = abierta
+    with archivo:
+        original = archivo.read()
+
+    for nombre in pendientes:
+        opciones = VARIANTES[nombre]
+        almacen.guardar(clave_variante(hash_imagen, nombre), _reducir(original, opciones['lado'], opciones['calidad']))
+    return pendientes
+
+
+def _generar_en_segundo_plano(hash_imagen):
+    try:
+        generar_variantes(hash_imagen)
+    except Exception as e:
+        logger.warning(f"No se pudieron generar las variantes de {hash_imagen}: {str(e)}")
+
+
+def reiniciar_executor():
+    """Tras un fork: los hilos del executor heredado no existen en el hijo"""
+    global _executor, _lock
+    _executor = None
+    _lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.IMAGENES_WORKERS, thread_name_prefix='miniaturas')
+        return _executor
+
+
+def encolar_variantes(hashes):
+    """Genera las variantes de las imágenes en el pool IMAGENES_WORKERS, sin esperar"""
+    executor = _get_executor()
+    for hash_imagen in set(h for h in hashes if h):
+        executor.submit(_generar_en_segundo_plano, hash_imagen)
@@ -0,0 +1,106 @@
+from config import Config
+import base64
+import json
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+
+class ParametroInvalidoError(ValueError):
+    """limit, cursor o fields inválidos (el endpoint responde 400)"""
+
+
+def parametro_limit(args):
+    """`limit` del query string acotado a PAGINACION_LIMIT_MAX"""
+    valor = args.get('limit')
+    if valor in (None, ''):
+        return Config.PAGINACION_LIMIT_DEFECTO
+    try:
+        limit = int(valor)
+    except ValueError:
+        raise ParametroInvalidoError("limit debe ser un número entero")
+    if limit <= 0:
+        raise ParametroInvalidoError("limit debe ser mayor a 0")
+    return min(limit, Config.PAGINACION_LIMIT_MAX)
+
+
+def codificar_cursor(valores):
+    """Valores de orden de la última fila -> token opaco para `next_cursor`"""
+    crudo = json.dumps(list(valores), default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(crudo.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(token, n_columnas):
+    """Inverso de codificar_cursor; valida que traiga un valor por columna de orden"""
+    try:
+        relleno = '=' * (-len(token) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(token + relleno).decode('utf-8'))
+    except Exception:
+        raise ParametroInvalidoError("cursor inválido")
+    if not isinstance(valores, list) or len(valores) != n_columnas:
+        raise ParametroInvalidoError("cursor inválido")
+    return valores
+
+
+def condicion_keyset(columnas, token):
+    """
+    Condición "(col1, col2, ...) > (%s, %s, ...)" para continuar después del cursor.
+    Retorna (sql, params); sin cursor retorna ("1=1", []).
+    """
+    if not token:
+        return "1=1", []
+    valores = decodificar_cursor(token, len(columnas))
+    return f"({', '.join(columnas)}) > ({', '.join(['%s'] * len(columnas))})", valores
+
+
+def proyeccion(args, campos):
+    """
+    Lee `fields=a,b,c` y retorna la lista de campos pedidos (en el orden de
+    `campos`, un dict campo -> expresión SQL). Sin `fields` retorna None.
+    """
+    valor = args.get('fields')
+    if not valor:
+        return None
+    pedidos = {campo.strip() for campo in valor.split(',') if campo.strip()}
+    desconocidos = pedidos - set(campos)
+    if desconocidos:
+        raise ParametroInvalidoError(
+            f"Campos no disponibles: {', '.join(sorted(desconocidos))}. Disponibles: {', '.join(campos)}"
+        )
+    return [campo for campo in campos if campo in pedidos]
+
+
+class PaginaKeyset:
+    """
+    Itera hasta `limit` filas de un resultado pedido con LIMIT limit + 1 (la
+    fila extra indica que hay más). Al terminar deja `next_cursor` con los
+    valores de orden de la última fila entregada. Si hay proyección, quita de
+    cada fila las columnas de orden que no se pidieron.
+    Sirve para serializar en streaming sin juntar la página en una lista.
+    """
+
+    def __init__(self, filas, limit, claves_orden, campos=None):
+        self.filas = filas
+        self.limit = limit
+        self.claves_orden = claves_orden
+        self.campos = campos
+        self.next_cursor = None
+
+    def __iter__(self):
+        sobrantes = [] if self.campos is None else [c for c in self.claves_orden if c not in self.campos]
+        ultima = None
+        for n, fila in enumerate(self.filas):
+            if n >= self.limit:
+                self.next_cursor = codificar_cursor(ultima)
+                return
+            ultima = [fila[clave] for clave in self.claves_orden]
+            for clave in sobrantes:
+                fila.pop(clave, None)
+            yield fila
+
+
+def pagina(filas, limit, claves_orden, campos=None):
+    """Versión en lista de PaginaKeyset: retorna (filas de la página, next_cursor)"""
+    actual = PaginaKeyset(filas, limit, claves_orden, campos)
+    return list(actual), actual.next_cursor
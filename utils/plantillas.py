@@ -0,0 +1,334 @@
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.utils import get_column_letter
+from io import BytesIO
+import hashlib
+import threading
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Plantillas de plantas por hilera (/cuarteles/.../plantilla-plantas*).
+# Anchos fijos: en modo write_only se fijan antes de escribir filas, sin recorrer celdas.
+ENCABEZADOS_PLANTAS = ["ID_Cuartel", "Nombre_Cuartel", "ID_Hilera", "Nombre_Hilera", "Plantas_Existentes", "N_Plantas_Nuevas"]
+ANCHOS_PLANTAS = [12, 30, 11, 15, 20, 18]
+
+
+# ============================================================================
+# PLANTILLAS DINÁMICAS (write_only)
+# ============================================================================
+
+def excel_streaming(titulo, encabezados, anchos, filas):
+    """
+    Arma un .xlsx de una hoja con openpyxl write_only: cada fila se escribe
+    al iterar `filas` (tuplas) sin mantener las celdas en memoria.
+    Retorna un BytesIO listo para send_file.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo)
+    
+    for i, ancho in enumerate(anchos, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = ancho
+    
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    encabezado = []
+    for texto in encabezados:
+        cell = WriteOnlyCell(ws, value=texto)
+        cell.font = header_font
+        cell.fill = header_fill
+        encabezado.append(cell)
+    ws.append(encabezado)
+    
+    for fila in filas:
+        ws.append(fila)
+    
+    excel_file = BytesIO()
+    wb.save(excel_file)
+    excel_file.seek(0)
+    return excel_file
+
+
+# ============================================================================
+# PLANTILLAS ESTÁTICAS DE CARGA MASIVA (cache en memoria)
+# ============================================================================
+
+TIPOS_PLANTILLA = ['cuarteles', 'registros', 'completo']
+
+_plantillas = {}
+_lock = threading.Lock()
+
+
+def _huella(wb):
+    """ETag a partir del contenido de las hojas (el .xlsx trae fechas del momento en que se guardó)"""
+    h = hashlib.sha1()
+    for ws in wb.worksheets:
+        h.update(ws.title.encode('utf-8'))
+        for fila in ws.iter_rows(values_only=True):
+            h.update(repr(fila).encode('utf-8'))
+    return h.hexdigest()[:20]
+
+
+def _generar_plantilla(tipo):
+    wb = Workbook()
+    if tipo == 'cuarteles':
+        crear_plantilla_cuarteles(wb)
+    elif tipo == 'registros':
+        crear_plantilla_registros(wb)
+    elif tipo == 'completo':
+        crear_plantilla_completa(wb)
+    
+    excel_file = BytesIO()
+    wb.save(excel_file)
+    return excel_file.getvalue(), _huella(wb)
+
+
+def plantilla_estatica(tipo):
+    """Retorna (bytes, etag) de la plantilla; se genera una sola vez por proceso"""
+    plantilla = _plantillas.get(tipo)
+    if plantilla is None:
+        with _lock:
+            plantilla = _plantillas.get(tipo)
+            if plantilla is None:
+                plantilla = _generar_plantilla(tipo)
+                _plantillas[tipo] = plantilla
+    return plantilla
+
+
+def precargar_plantillas():
+    """Genera las plantillas al iniciar la app para que la primera descarga no pague el costo"""
+    for tipo in TIPOS_PLANTILLA:
+        try:
+            plantilla_estatica(tipo)
+        except Exception as e:
+            logger.error(f"No se pudo generar la plantilla {tipo}: {str(e)}")
+
+
+def crear_plantilla_cuarteles(wb):
+    """Crear plantilla para carga masiva de cuarteles"""
+    ws = wb.active
+    ws.title = "Carga Masiva Cuarteles"
+    
+    # Estilos
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    
+    # Headers principales
+    headers_principales = [
+        'A1:Cuartel', 'B1:Nombre', 'C1:ID Sucursal', 'D1:Superficie', 
+        'E1:Número de Hileras', 'F1:ID Variedad', 'G1:Año Plantación', 
+        'H1:DSH', 'I1:DEH'
+    ]
+    
+    for header in headers_principales:
+        cell = ws[header.split(':')[0]]
+        cell.value = header.split(':')[1]
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.border = border
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+    
+    # Headers de hileras y plantas
+    headers_hileras = [
+        'J1:Hilera', 'K1:Planta', 'L1:Ubicación GPS'
+    ]
+    
+    for header in headers_hileras:
+        cell = ws[header.split(':')[0]]
+        cell.value = header.split(':')[1]
+        cell.font = header_font
+        cell.fill = PatternFill(start_color="70AD47", end_color="70AD47", fill_type="solid")
+        cell.border = border
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+    
+    # Ejemplos de datos
+    ejemplos = [
+        ['Cuartel A', 'Cuartel Principal', 1, 15.5, 10, 1, 2020, 3.5, 1.2, 'Hilera 1', 'Planta 1', '-33.123, -70.456'],
+        ['', '', '', '', '', '', '', '', '', 'Hilera 1', 'Planta 2', '-33.124, -70.457'],
+        ['', '', '', '', '', '', '', '', '', 'Hilera 2', 'Planta 1', '-33.125, -70.458'],
+        ['Cuartel B', 'Cuartel Secundario', 1, 12.0, 8, 2, 2019, 3.0, 1.0, 'Hilera 1', 'Planta 1', '-33.126, -70.459']
+    ]
+    
+    for row_idx, ejemplo in enumerate(ejemplos, start=2):
+        for col_idx, valor in enumerate(ejemplo, start=1):
+            cell = ws.cell(row=row_idx, column=col_idx, value=valor)
+            cell.border = border
+    
+    # Ajustar ancho de columnas
+    column_widths = [15, 20, 12, 12, 18, 12, 15, 8, 8, 12, 12, 20]
+    for i, width in enumerate(column_widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+    
+    # Agregar hoja de instrucciones
+    ws_instrucciones = wb.create_sheet("Instrucciones")
+    instrucciones = [
+        ["INSTRUCCIONES PARA CARGA MASIVA DE CUARTELES"],
+        [""],
+        ["1. DATOS DEL CUARTEL:"],
+        ["   - Nombre: Nombre del cuartel (requerido)"],
+        ["   - ID Sucursal: ID de la sucursal (requerido)"],
+        ["   - Superficie: Superficie en hectáreas (requerido)"],
+        ["   - Número de Hileras: Cantidad de hileras a generar automáticamente (requerido)"],
+        ["   - ID Variedad: ID de la variedad (opcional)"],
+        ["   - Año Plantación: Año de plantación (opcional)"],
+        ["   - DSH: Distancia entre hileras (opcional)"],
+        ["   - DEH: Distancia entre plantas (opcional)"],
+        [""],
+        ["2. DATOS DE HILERAS Y PLANTAS (OPCIONAL):"],
+        ["   - Hilera: Nombre de la hilera (ej: 'Hilera 1', 'Hilera 2')"],
+        ["   - Planta: Nombre de la planta (ej: 'Planta 1', 'Planta 2')"],
+        ["   - Ubicación GPS: Coordenadas en formato 'lat, lng' (opcional)"],
+        [""],
+        ["3. REGLAS:"],
+        ["   - Las hileras se generan automáticamente según 'Número de Hileras'"],
+        ["   - Si especificas plantas, deben corresponder a hileras existentes"],
+        ["   - Las coordenadas GPS deben estar en formato 'lat, lng'"],
+        ["   - No se permiten plantas duplicadas en la misma hilera"],
+        [""],
+        ["4. EJEMPLO:"],
+        ["   - Cuartel con 10 hileras: Se generan automáticamente Hilera 1 a Hilera 10"],
+        ["   - Si especificas plantas para 'Hilera 1', se crearán en esa hilera"],
+        ["   - Si no especificas plantas, solo se crean las hileras vacías"]
+    ]
+    
+    for row_idx, instruccion in enumerate(instrucciones, start=1):
+        cell = ws_instrucciones.cell(row=row_idx, column=1, value=instruccion[0])
+        if row_idx == 1:
+            cell.font = Font(bold=True, size=14)
+        elif ":" in instruccion[0]:
+            cell.font = Font(bold=True)
+    
+    ws_instrucciones.column_dimensions['A'].width = 80
+
+def crear_plantilla_registros(wb):
+    """Crear plantilla para carga masiva de registros"""
+    ws = wb.active
+    ws.title = "Carga Masiva Registros"
+    
+    # Estilos
+    header_font = Font(bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    border = Border(
+        left=Side(style='thin'),
+        right=Side(style='thin'),
+        top=Side(style='thin'),
+        bottom=Side(style='thin')
+    )
+    
+    # Headers
+    headers = [
+        'A1:ID Planta', 'B1:ID Tipo Planta', 'C1:ID Evaluador', 
+        'D1:Hora Registro', 'E1:Imagen (Base64)'
+    ]
+    
+    for header in headers:
+        cell = ws[header.split(':')[0]]
+        cell.value = header.split(':')[1]
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.border = border
+        cell.alignment = Alignment(horizontal='center', vertical='center')
+    
+    # Ejemplos
+    ejemplos = [
+        [123, 'uuid-tipo-planta-1', 'user123', '2024-01-15 10:30:00', ''],
+        [124, 'uuid-tipo-planta-2', 'user456', '2024-01-15 10:35:00', ''],
+        [125, 'uuid-tipo-planta-1', 'user123', '2024-01-15 10:40:00', '']
+    ]
+    
+    for row_idx, ejemplo in enumerate(ejemplos, start=2):
+        for col_idx, valor in enumerate(ejemplo, start=1):
+            cell = ws.cell(row=row_idx, column=col_idx, value=valor)
+            cell.border = border
+    
+    # Ajustar ancho de columnas
+    column_widths = [12, 25, 15, 20, 50]
+    for i, width in enumerate(column_widths, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+    
+    # Agregar hoja de instrucciones
+    ws_instrucciones = wb.create_sheet("Instrucciones")
+    instrucciones = [
+        ["INSTRUCCIONES PARA CARGA MASIVA DE REGISTROS"],
+        [""],
+        ["1. DATOS REQUERIDOS:"],
+        ["   - ID Planta: ID numérico de la planta (requerido)"],
+        ["   - ID Tipo Planta: UUID del tipo de planta (requerido)"],
+        [""],
+        ["2. DATOS OPCIONALES:"],
+        ["   - ID Evaluador: ID del evaluador"],
+        ["   - Hora Registro: Fecha y hora en formato 'YYYY-MM-DD HH:MM:SS'"],
+        ["   - Imagen: Datos de imagen en formato Base64"],
+        [""],
+        ["3. REGLAS:"],
+        ["   - La planta debe existir en el sistema"],
+        ["   - El tipo de planta debe ser válido"],
+        ["   - La fecha debe estar en formato correcto"],
+        ["   - La imagen es opcional"]
+    ]
+    
+    for row_idx, instruccion in enumerate(instrucciones, start=1):
+        cell = ws_instrucciones.cell(row=row_idx, column=1, value=instruccion[0])
+        if row_idx == 1:
+            cell.font = Font(bold=True, size=14)
+        elif ":" in instruccion[0]:
+            cell.font = Font(bold=True)
+    
+    ws_instrucciones.column_dimensions['A'].width = 80
+
+def crear_plantilla_completa(wb):
+    """Crear plantilla completa con todas las opciones"""
+    # Crear hojas para cada tipo (registros va en una hoja nueva, no sobre la activa)
+    crear_plantilla_cuarteles(wb)
+    wb.active = wb.create_sheet("Carga Masiva Registros")
+    crear_plantilla_registros(wb)
+    
+    # Renombrar hojas
+    wb['Carga Masiva Cuarteles'].title = "Cuarteles"
+    wb['Carga Masiva Registros'].title = "Registros"
+    
+    # Agregar hoja de índice
+    ws_indice = wb.create_sheet("Índice", 0)
+    ws_indice.title = "Índice"
+    
+    # Contenido del índice
+    contenido_indice = [
+        ["PLANTILLA COMPLETA - CARGA MASIVA"],
+        [""],
+        ["Esta plantilla contiene:"],
+        ["1. Hoja 'Cuarteles': Para carga masiva de cuarteles con hileras y plantas"],
+        ["2. Hoja 'Registros': Para carga masiva de registros de mapeo"],
+        ["3. Hoja 'Instrucciones': Instrucciones detalladas para cada tipo"],
+        [""],
+        ["INSTRUCCIONES GENERALES:"],
+        ["- Cada hoja tiene su propia estructura y validaciones"],
+        ["- Sigue las instrucciones específicas de cada hoja"],
+        ["- Los campos requeridos están marcados en las instrucciones"],
+        ["- Ejemplos de datos están incluidos en cada hoja"],
+        ["- No modifiques la estructura de las columnas"],
+        [""],
+        ["FORMATOS ACEPTADOS:"],
+        ["- Fechas: YYYY-MM-DD HH:MM:SS"],
+        ["- Coordenadas GPS: 'lat, lng' (ej: '-33.123, -70.456')"],
+        ["- Imágenes: Base64 (opcional)"],
+        ["- UUIDs: Formato estándar UUID"]
+    ]
+    
+    for row_idx, contenido in enumerate(contenido_indice, start=1):
+        cell = ws_indice.cell(row=row_idx, column=1, value=contenido[0])
+        if row_idx == 1:
+            cell.font = Font(bold=True, size=16)
+        elif row_idx in [4, 5, 8, 13]:
+            cell.font = Font(bold=True)
+    
+    ws_indice.column_dimensions['A'].width = 80
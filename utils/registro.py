@@ -0,0 +1,154 @@
+from config import Config
+import logging
+import re
+import threading
+import time
+
+# Configuración del logging de la aplicación. Todos los módulos usan
+# logging.getLogger(__name__) (blueprints.*, utils.*); aquí se fija el nivel de
+# cada uno desde LOG_NIVELES y se instala en los handlers un filtro que, solo
+# para los mensajes que se van a escribir:
+#   - oculta claves, contraseñas, tokens y credenciales de URLs
+#   - corta el mensaje a LOG_MAX_CARACTERES
+#   - muestrea los mensajes marcados con extra=muestreo('clave')
+# Para mensajes con datos grandes usar %s y Resumen(valor): el texto solo se
+# arma si el nivel está habilitado.
+
+FORMATO = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+_OCULTO = '***'
+
+_SECRETOS = [
+    # 'clave': 'x', "password": "x", token=x, clave: x
+    (re.compile(
+        r"(?i)\b(password|passwd|pass|clave|contrase[ñn]a|secret|secret_key|token|access_token|refresh_token)"
+        r"(['\"]?\s*[:=]\s*)(?:'[^']*'|\"[^\"]*\"|[^\s,&}\)]+)"
+    ), rf"\1\2'{_OCULTO}'"),
+    # usuario:clave@host en URLs de conexión
+    (re.compile(r"(://[^:/@\s]+:)[^@\s]+@"), rf"\1{_OCULTO}@"),
+    # Authorization: Bearer <jwt> y JWT sueltos
+    (re.compile(r"(?i)(bearer\s+)\S+"), rf"\1{_OCULTO}"),
+    (re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]+"), _OCULTO),
+    # Hashes bcrypt
+    (re.compile(r"\$2[aby]?\$\d{2}\$[./A-Za-z0-9]{53}"), _OCULTO),
+]
+
+
+def ocultar_secretos(texto):
+    """Reemplaza claves, tokens y credenciales del texto por ***"""
+    for patron, reemplazo in _SECRETOS:
+        texto = patron.sub(reemplazo, texto)
+    return texto
+
+
+def truncar(texto, max_caracteres):
+    if len(texto) <= max_caracteres:
+        return texto
+    return f"{texto[:max_caracteres]}... (+{len(texto) - max_caracteres} caracteres)"
+
+
+class Resumen:
+    """
+    Argumento perezoso para logs con datos grandes (payloads, listas de filas):
+    el repr se arma y se corta a `max_caracteres` solo si el mensaje se escribe.
+
+        logger.debug("Datos recibidos: %s", Resumen(data))
+    """
+
+    def __init__(self, valor, max_caracteres=None):
+        self.valor = valor
+        self.max_caracteres = max_caracteres or Config.LOG_MAX_CARACTERES_DATO
+
+    def __str__(self):
+        if isinstance(self.valor, (list, tuple)) and len(self.valor) > 3:
+            texto = f"{len(self.valor)} elementos, primeros: {self.valor[:3]!r}"
+        else:
+            texto = repr(self.valor)
+        return truncar(texto, self.max_caracteres)
+
+
+def muestreo(clave):
+    """
+    extra= para mensajes de alto volumen (uno por fila, por hilera, por lote).
+    De cada `clave` se escriben los primeros LOG_MUESTREO_MAXIMO por ventana de
+    LOG_MUESTREO_VENTANA segundos; el siguiente que pase informa los omitidos.
+
+        logger.info("Plantas creadas para hilera %s", id_hilera, extra=muestreo('plantas_hilera'))
+    """
+    return {'muestreo': clave}
+
+
+class FiltroRegistro(logging.Filter):
+    """Muestreo, ocultación de secretos y tamaño máximo. Va en los handlers."""
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._ventanas = {}
+
+    def _pasa_muestreo(self, clave):
+        ahora = time.monotonic()
+        with self._lock:
+            inicio, escritos, omitidos = self._ventanas.get(clave, (ahora, 0, 0))
+            if ahora - inicio >= Config.LOG_MUESTREO_VENTANA:
+                inicio, escritos = ahora, 0
+            if escritos >= Config.LOG_MUESTREO_MAXIMO:
+                self._ventanas[clave] = (inicio, escritos, omitidos + 1)
+                return False, 0
+            self._ventanas[clave] = (inicio, escritos + 1, 0)
+            return True, omitidos
+
+    def filter(self, record):
+        if getattr(record, '_registro_listo', False):
+            return True
+
+        omitidos = 0
+        clave = getattr(record, 'muestreo', None)
+        if clave:
+            pasa, omitidos = self._pasa_muestreo(clave)
+            if not pasa:
+                return False
+
+        mensaje = truncar(ocultar_secretos(record.getMessage()), Config.LOG_MAX_CARACTERES)
+        if omitidos:
+            mensaje = f"{mensaje} [{omitidos} mensajes '{clave}' omitidos]"
+        record.msg = mensaje
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = ocultar_secretos(logging.Formatter().formatException(record.exc_info))
+        # Con varios handlers el record se procesa una sola vez
+        record._registro_listo = True
+        return True
+
+
+_filtro = FiltroRegistro()
+
+
+def _niveles_por_modulo(valor):
+    """'utils.db=WARNING,blueprints.auth=DEBUG' -> {'utils.db': 'WARNING', ...}"""
+    niveles = {}
+    for parte in (valor or '').split(','):
+        if '=' not in parte:
+            continue
+        nombre, nivel = parte.split('=', 1)
+        niveles[nombre.strip()] = nivel.strip().upper()
+    return niveles
+
+
+def configurar_logging():
+    """Nivel general, niveles por módulo y filtro en los handlers del logger raíz"""
+    raiz = logging.getLogger()
+    if not raiz.handlers:
+        logging.basicConfig(format=FORMATO)
+    raiz.setLevel(Config.LOG_NIVEL.upper())
+
+    for nombre, nivel in _niveles_por_modulo(Config.LOG_NIVELES).items():
+        try:
+            logging.getLogger(nombre).setLevel(nivel)
+        except ValueError:
+            raiz.warning(f"Nivel de log inválido para {nombre}: {nivel}")
+
+    # Una sola instancia para todos los handlers: el muestreo se cuenta una vez
+    for handler in raiz.handlers:
+        if _filtro not in handler.filters:
+            handler.addFilter(_filtro)
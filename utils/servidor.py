@@ -0,0 +1,115 @@
+from config import Config
+import os
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+# Modelo de proceso en producción (gunicorn.conf.py): workers gthread con
+# varios hilos cada uno, dimensionados desde la CPU y memoria del contenedor.
+# Un request largo (Excel, carga masiva, bcrypt) ocupa un hilo, no el proceso.
+
+# Clases de ruta: presupuesto de duración de cada una. Un hilo no se puede
+# cortar sin dejar la transacción a medias, así que el límite no aborta el
+# request: se registra en /api/metrics y en el log. El corte duro es el
+# --timeout del servicio en Cloud Run.
+RUTA_INTERACTIVA = 'interactiva'
+RUTA_LARGA = 'larga'          # exportaciones Excel, cargas masivas, importaciones
+
+
+def clase_ruta(clase):
+    """
+    Clase de la ruta (default RUTA_INTERACTIVA). Va justo debajo de @...route(),
+    como @politica_cache.
+    """
+    def decorador(vista):
+        vista.clase_ruta = clase
+        return vista
+    return decorador
+
+
+def limite_ruta(vista):
+    """(clase, segundos de presupuesto) de la función de vista"""
+    clase = getattr(vista, 'clase_ruta', None) or RUTA_INTERACTIVA
+    if clase == RUTA_LARGA:
+        return clase, Config.LIMITE_RUTA_LARGA_S
+    return clase, Config.LIMITE_RUTA_INTERACTIVA_S
+
+
+# ============================================================================
+# DIMENSIONAMIENTO
+# ============================================================================
+
+def _leer(ruta):
+    try:
+        with open(ruta) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpus_disponibles():
+    """CPUs del contenedor: cuota de cgroup si hay, si no las del proceso"""
+    cuota = _leer('/sys/fs/cgroup/cpu.max')                       # cgroup v2: "cuota periodo"
+    if cuota and not cuota.startswith('max'):
+        limite, periodo = cuota.split()
+        return max(1, round(int(limite) / int(periodo)))
+    limite = _leer('/sys/fs/cgroup/cpu/cpu.cfs_quota_us')          # cgroup v1
+    periodo = _leer('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if limite and periodo and int(limite) > 0:
+        return max(1, round(int(limite) / int(periodo)))
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def memoria_disponible_mb():
+    """Memoria del contenedor en MB (límite de cgroup o memoria física)"""
+    for ruta in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        valor = _leer(ruta)
+        # Sin límite, cgroup v1 informa un número enorme
+        if valor and valor.isdigit() and int(valor) < 1 << 50:
+            return int(valor) // (1024 * 1024)
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 512
+
+
+def dimensionar():
+    """
+    (workers, threads). Workers: uno por CPU, mientras quepan en memoria
+    (WEB_MB_POR_WORKER cada uno, con WEB_MB_RESERVA para el resto del
+    contenedor). Threads: WEB_THREADS por worker. WEB_WORKERS fija el número.
+    """
+    threads = max(1, Config.WEB_THREADS)
+    if Config.WEB_WORKERS:
+        return Config.WEB_WORKERS, threads
+    por_memoria = (memoria_disponible_mb() - Config.WEB_MB_RESERVA) // Config.WEB_MB_POR_WORKER
+    return max(1, min(cpus_disponibles(), por_memoria)), threads
+
+
+# ============================================================================
+# FORK (preload_app)
+# ============================================================================
+
+def preparar_fork():
+    """En el master, antes de crear los workers: no heredar conexiones abiertas"""
+    from utils.db import get_pool
+    get_pool().cerrar_todas()
+
+
+def reiniciar_tras_fork():
+    """
+    En cada worker recién creado. Sockets, hilos y locks del master no sirven
+    en el hijo: se rehace el pool de conexiones y los executors de segundo
+    plano se crean de nuevo al primer uso.
+    """
+    from utils import db, jobs, miniaturas, claves, imagenes
+    db.reiniciar_pool()
+    jobs.reiniciar_executor()
+    miniaturas.reiniciar_executor()
+    claves.reiniciar_executor()
+    imagenes.reiniciar_almacen()
+    logger.info(f"Worker {os.getpid()} listo")
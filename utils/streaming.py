@@ -0,0 +1,107 @@
+from flask import Response, current_app, stream_with_context
+from config import Config
+from utils.db import desvincular_del_request
+import logging
+
+# Configurar logging
+logger = logging.getLogger(__name__)
+
+MIMETYPE_NDJSON = 'application/x-ndjson'
+
+
+def formato_respuesta(request):
+    """'ndjson' si el cliente lo pide (?formato=ndjson o Accept: application/x-ndjson), si no 'json'"""
+    if request.args.get('formato') == 'ndjson':
+        return 'ndjson'
+    if request.accept_mimetypes.best_match(['application/json', MIMETYPE_NDJSON]) == MIMETYPE_NDJSON:
+        return 'ndjson'
+    return 'json'
+
+
+def filas_cursor(cursor, tamano=None):
+    """
+    Itera las filas de un cursor sin buffer (el default de mysql.connector)
+    de a fetchmany(), sin armar la lista completa del resultado.
+    """
+    tamano = tamano or Config.STREAM_FILAS_LOTE
+    while True:
+        filas = cursor.fetchmany(tamano)
+        if not filas:
+            return
+        yield from filas
+
+
+def _cerrar(conn, cursor):
+    try:
+        cursor.close()
+    except Exception:
+        # Cursor con filas sin leer (cliente que cortó): el pool las descarta al devolver la conexión
+        pass
+    conn.close()
+
+
+def respuesta_streaming(conn, cursor, formato='json', filas=None, clave=None, cierre=None):
+    """
+    Respuesta que serializa las filas a medida que salen del cursor.
+    El endpoint ejecuta la consulta antes (así un error de SQL sigue siendo un 500)
+    y entrega conn/cursor, que se cierran al terminar o si el cliente corta.
+
+    - formato 'json': un array JSON, igual al de jsonify(filas).
+    - formato 'ndjson': un objeto JSON por línea.
+    - `filas`: iterable a serializar (default: filas_cursor(cursor)).
+    - `clave`: envuelve el array como {"<clave>": [...], ...}; `cierre()` se
+      llama al final y retorna los campos que van después del array
+      (en NDJSON van como última línea).
+    """
+    dumps = current_app.json.dumps
+    filas = filas_cursor(cursor) if filas is None else filas
+    lote = Config.STREAM_FILAS_LOTE
+
+    # La conexión sigue en uso después de retornar: la cierra el generador, no el teardown
+    desvincular_del_request(conn)
+
+    def generar_json():
+        yield '{' + dumps(clave) + ':[' if clave else '['
+        bloque = []
+        separador = ''
+        for fila in filas:
+            bloque.append(dumps(fila))
+            if len(bloque) >= lote:
+                yield separador + ','.join(bloque)
+                separador = ','
+                bloque = []
+        if bloque:
+            yield separador + ','.join(bloque)
+        if clave:
+            extra = cierre() if cierre else {}
+            yield ']' + ''.join(f",{dumps(k)}:{dumps(v)}" for k, v in extra.items()) + '}'
+        else:
+            yield ']'
+
+    def generar_ndjson():
+        bloque = []
+        for fila in filas:
+            bloque.append(dumps(fila))
+            if len(bloque) >= lote:
+                yield '\n'.join(bloque) + '\n'
+                bloque = []
+        if bloque:
+            yield '\n'.join(bloque) + '\n'
+        if cierre:
+            yield dumps(cierre()) + '\n'
+
+    def generar():
+        try:
+            yield from (generar_ndjson() if formato == 'ndjson' else generar_json())
+        except Exception as e:
+            # Ya se enviaron headers y parte del cuerpo: solo queda cortar la respuesta
+            logger.error(f"Error durante respuesta en streaming: {str(e)}")
+            raise
+        finally:
+            _cerrar(conn, cursor)
+
+    # stream_with_context mantiene el contexto del request para serializar con el JSON de la app
+    return Response(
+        stream_with_context(generar()),
+        mimetype=MIMETYPE_NDJSON if formato == 'ndjson' else 'application/json'
+    )